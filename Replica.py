@@ -1,129 +1,260 @@
 import os
-import json
 import sys
-import subprocess
+import json
+import multiprocessing
 import threading
+from collections import OrderedDict
 from datetime import datetime
-from io import StringIO
-import re
+
+if __name__ == "__main__" and "--headless" in sys.argv[1:]:
+    # מצב headless לא טוען את PySide6 כלל
+    from replica_cli import main
+    sys.exit(main(sys.argv[1:]))
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QLabel, QLineEdit, QRadioButton, QButtonGroup, QCheckBox, 
-    QPushButton, QFileDialog, QMessageBox, QTextEdit, QProgressBar,
-    QGroupBox, QStatusBar, QDialog, QTabWidget, QMenu
+    QPushButton, QFileDialog, QMessageBox, QPlainTextEdit, QProgressBar,
+    QGroupBox, QStatusBar, QDialog, QTabWidget, QMenu, QSpinBox, QFormLayout,
+    QComboBox, QTableView, QHeaderView, QAbstractItemView, QTableWidget, QTableWidgetItem
 )
-from PySide6.QtCore import Qt, QThread, Signal, Slot, QSize
-from PySide6.QtGui import QIcon, QFont, QAction, QCursor
-
-if os.name == 'nt':  # Windows
-    APP_DATA_DIR = os.path.join(os.environ.get('APPDATA', ''), 'Replica')
-elif os.name == 'posix':  # Linux, Mac
-    APP_DATA_DIR = os.path.join(os.path.expanduser('~'), '.config', 'Replica')
-else:
-    APP_DATA_DIR = os.path.join(os.path.expanduser('~'), '.Replica')
-
-if not os.path.exists(APP_DATA_DIR):
-    os.makedirs(APP_DATA_DIR)
-
-CONFIG_FILE = os.path.join(APP_DATA_DIR, "config.json")
-
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    return {}
+from PySide6.QtCore import Qt, QThread, QTimer, Signal, Slot, QSize, QAbstractTableModel, QModelIndex
+from PySide6.QtGui import QIcon, QFont, QAction, QCursor, QPixmap
 
+from replica_engine import (
+    load_config, save_config, format_option_for, format_bytes, format_eta,
+    collect_links, iter_link_file, DownloadQueue, DownloadArchive, ExpansionCache,
+    PlaylistExpander, YoutubeDLPool, DownloadEngine, EngineListener, governor_from_config,
+    validate_profiles, FormatProber, MediaCache, MetadataFetcher, format_label, canonicalize_url,
+    collection_url, RUNNING, discover_tools, tools_summary, MetricsRecorder, STAGES, STAGE_LABELS, METRICS_FILE,
+    stream_output_from_config, STREAM_SINKS, DEFAULT_STREAM_TARGET, DEFAULT_SEGMENT_MB,
+    SubscriptionStore, SubscriptionSyncer, SYNC_CHECK_INTERVAL, DEFAULT_SYNC_INTERVAL, output_store_root, OutputStore,
+    DEFAULT_MAX_WORKERS, DEFAULT_MAX_PER_HOST, DEFAULT_MAX_RETRIES, DEFAULT_MAX_CONNECTIONS
+)
 
-def save_config(config):
-    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
-    
-    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-        json.dump(config, f, ensure_ascii=False, indent=4)
+CONSOLE_MAX_BLOCKS = 5000
+SHUTDOWN_WAIT_MS = 1000
+TOOL_DISCOVERY_DELAY_MS = 500
+LINK_FILE_FILTER = "קבצי קישורים (*.txt *.csv *.jsonl *.ndjson);;כל הקבצים (*)"
+STATE_LABELS = {"pending": "ממתין", "running": "בהורדה", "done": "הושלם", "failed": "נכשל", "cancelled": "בוטל"}
+THUMBNAIL_SIZE = QSize(64, 36)
+PIXMAP_CACHE_SIZE = 300
+STATS_REFRESH_MS = 1000
+STREAM_SINK_LABELS = {"file": "קובץ", "pipe": "named pipe", "segments": "קבצים מתחלפים בגודל קבוע"}
+SYNC_START_DELAY_MS = 5000
+BUILTIN_FORMAT_LABELS = OrderedDict((("mp4", "MP4 איכות גבוהה"), ("mp4-low", "MP4 איכות נמוכה"), ("mp3", "MP3")))
 
 
 class DownloadThread(QThread):
     update_progress = Signal(str)
     update_console = Signal(str)
-    download_finished = Signal(int, int)
+    download_finished = Signal(int, int, int, int)
     download_error = Signal(str)
+    batch_started = Signal(int)
+    item_progress = Signal(object)
+    item_finished = Signal(int, bool)
 
-    def __init__(self, urls, format_option, save_directory, show_cli):
+    def __init__(self, *args, **kwargs):
         super().__init__()
-        self.urls = urls
-        self.format_option = format_option
-        self.save_directory = save_directory
-        self.show_cli = show_cli
-        self.running = True
+        self.engine = DownloadEngine(*args, listener=DownloadThreadListener(self), **kwargs)
 
     def run(self):
-        total_urls = len(self.urls)
-        successful = 0
-        failed = 0
+        self.engine.run()
 
-        for i, url in enumerate(self.urls, 1):
-            if not self.running:
-                break
+    def stop(self):
+        self.engine.stop()
 
-            self.update_progress.emit(f"מוריד {i}/{total_urls}: {url}")
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_template = os.path.join(self.save_directory, f"%(title)s_{timestamp}.%(ext)s")
-            
-            command = self.format_option + ["-o", output_template, url]
-            
-            if self.show_cli:
-                self.update_console.emit(f"\n{'='*50}\nמתחיל הורדה של: {url}\nפקודה: {' '.join(command)}\n{'='*50}\n\n")
-            
-            try:
-                process = subprocess.Popen(
-                    command, 
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1,
-                    universal_newlines=True
-                )
-                
-                if self.show_cli:
-                    for line in process.stdout:
-                        self.update_console.emit(line)
-                
-                exit_code = process.wait()
-                
-                if exit_code == 0:
-                    successful += 1
-                    if self.show_cli:
-                        self.update_console.emit(f"\n✓ ההורדה של {url} הושלמה בהצלחה!\n\n")
-                else:
-                    failed += 1
-                    error_output = process.stderr.read()
-                    if self.show_cli:
-                        self.update_console.emit(f"\n❌ שגיאה בהורדה של {url}. קוד יציאה: {exit_code}\n")
-                        self.update_console.emit(f"פרטי שגיאה: {error_output}\n\n")
-            
-            except FileNotFoundError:
-                failed += 1
-                error_msg = "yt-dlp לא נמצא במערכת. ודא שהתקנת אותו ושהוא נגיש מ-PATH."
-                self.download_error.emit(error_msg)
-                if self.show_cli:
-                    self.update_console.emit(f"\n❌ שגיאה: {error_msg}\n\n")
-                break
-
-        if self.running:
-            summary = f"הושלם: {successful}/{total_urls} הורדות הצליחו, {failed}/{total_urls} נכשלו"
-            if self.show_cli:
-                self.update_console.emit(f"\n{'='*50}\n{summary}\n{'='*50}\n")
-            
-            self.update_progress.emit(summary)
-            self.download_finished.emit(successful, failed)
 
-    def stop(self):
-        self.running = False
+class ToolDiscoveryThread(QThread):
+    discovered = Signal(object)
+
+    def run(self):
+        self.discovered.emit(discover_tools())
+
+
+class SubscriptionSyncThread(QThread):
+    synced = Signal(object)
+
+    def __init__(self, syncer, parent=None):
+        super().__init__(parent)
+        self.syncer = syncer
+
+    def run(self):
+        self.synced.emit(self.syncer.sync_due(cancelled=self.isInterruptionRequested))
+
+
+class DownloadThreadListener(EngineListener):
+    def __init__(self, thread):
+        self.thread = thread
+
+    def status(self, message):
+        self.thread.update_progress.emit(message)
+
+    def console(self, chunk):
+        self.thread.update_console.emit(chunk)
+
+    def batch_started(self, total):
+        self.thread.batch_started.emit(total)
+
+    def item_progress(self, event):
+        self.thread.item_progress.emit(event)
+
+    def item_finished(self, index, ok):
+        self.thread.item_finished.emit(index, ok)
+
+    def error(self, message):
+        self.thread.download_error.emit(message)
+
+    def finished(self, successful, failed, skipped, retries):
+        self.thread.download_finished.emit(successful, failed, skipped, retries)
+
+
+class QueueTableModel(QAbstractTableModel):
+    # התור כולו בטבלה. מטא-דאטה ותמונות מתבקשות רק כש-data() נקרא עבור שורה,
+    # כלומר רק לשורות הגלויות, ומגיעות ברקע דרך media_fetched.
+    COLUMNS = ("כותרת", "משך", "גודל", "פורמט", "מצב")
+    media_fetched = Signal(str, object, object)
+    media_dropped = Signal(str)
+
+    def __init__(self, queue, media_cache, in_process=True, parent=None):
+        super().__init__(parent)
+        self.queue = queue
+        self.fetcher = MetadataFetcher(media_cache, self.media_fetched.emit, in_process,
+                                       on_dropped=self.media_dropped.emit)
+        self.media_fetched.connect(self.on_media_fetched)
+        self.media_dropped.connect(self.on_media_dropped)
+        self._rows = []
+        self._row_by_id = {}
+        self._keys = {}
+        self._ids_by_key = {}
+        self._media = {}
+        self._pixmaps = OrderedDict()
+        self._progress = {}
+        self.reload()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item_id, url, state, format_option, error = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 3:
+                return format_label(format_option)
+            if column == 4:
+                label = STATE_LABELS.get(state, state)
+                progress = self._progress.get(item_id)
+                return f"{label} {progress:.0%}" if state == RUNNING and progress is not None else label
+            info = self.media(item_id, url, format_option)[0]
+            if column == 0:
+                return info.get("title") or url
+            if column == 1:
+                return format_eta(info["duration"]) if info.get("duration") else ""
+            return format_bytes(info["size"]) if info.get("size") else ""
+        if role == Qt.DecorationRole and column == 0:
+            return self.pixmap(self.media(item_id, url, format_option)[1])
+        if role == Qt.ToolTipRole:
+            if column == 0:
+                return url
+            if column == 4 and error:
+                return error[-500:]
+        return None
+
+    def media(self, item_id, url, format_option):
+        if item_id not in self._keys:
+            result = canonicalize_url(url) if collection_url(url) is None else None
+            self._keys[item_id] = result[0] if result is not None else None
+        key = self._keys[item_id]
+        if key is None:
+            return {}, None
+        if key in self._media:
+            return self._media[key]
+        if key in self._ids_by_key:
+            self._ids_by_key[key].add(item_id)
+            return {}, None
+        info, thumbnail = self.fetcher.request(key, url, format_option)
+        if info is not None:
+            self._media[key] = (info, thumbnail)
+            return self._media[key]
+        self._ids_by_key.setdefault(key, set()).add(item_id)
+        return {}, None
+
+    def pixmap(self, path):
+        if path is None:
+            return None
+        if path in self._pixmaps:
+            self._pixmaps.move_to_end(path)
+            return self._pixmaps[path]
+        pixmap = QPixmap(path)
+        if pixmap.isNull():
+            return None
+        pixmap = pixmap.scaled(THUMBNAIL_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self._pixmaps[path] = pixmap
+        if len(self._pixmaps) > PIXMAP_CACHE_SIZE:
+            self._pixmaps.popitem(last=False)
+        return pixmap
+
+    @Slot(str, object, object)
+    def on_media_fetched(self, key, info, thumbnail):
+        # הבאה שנכשלה נשמרת כריקה כדי שהשורה לא תבקש אותה שוב בהפעלה הזאת
+        self._media[key] = (info or {}, thumbnail)
+        for item_id in self._ids_by_key.pop(key, ()):
+            self.emit_row_changed(item_id, 0, 2)
+
+    @Slot(str)
+    def on_media_dropped(self, key):
+        # הבקשה נדחקה מהתור; אם השורה עדיין גלויה, data() יבקש אותה שוב
+        self._ids_by_key.pop(key, None)
+    
+    def emit_row_changed(self, item_id, first_column=0, last_column=4):
+        row = self._row_by_id.get(item_id)
+        if row is not None:
+            self.dataChanged.emit(self.index(row, first_column), self.index(row, last_column))
+
+    def reload(self):
+        self.beginResetModel()
+        self._rows = self.queue.view_rows()
+        self._row_by_id = {row[0]: i for i, row in enumerate(self._rows)}
+        self._ids_by_key.clear()
+        self.endResetModel()
+
+    def refresh_item(self, item_id):
+        row = self._row_by_id.get(item_id)
+        item = self.queue.get(item_id)
+        if row is None or item is None:
+            return
+        self._progress.pop(item_id, None)
+        self._rows[row] = (item_id, item["url"], item["state"], self._rows[row][3], item["error"])
+        self.emit_row_changed(item_id, 4, 4)
+
+    def set_progress(self, item_id, fraction):
+        row = self._row_by_id.get(item_id)
+        if row is None:
+            return
+        previous = self._progress.get(item_id)
+        self._progress[item_id] = fraction
+        if self._rows[row][2] != RUNNING:
+            item_id, url, _, format_option, error = self._rows[row]
+            self._rows[row] = (item_id, url, RUNNING, format_option, error)
+        elif previous is not None and int(previous * 100) == int(fraction * 100):
+            return
+        self.emit_row_changed(item_id, 4, 4)
+
+    def item_at(self, row):
+        return self._rows[row]
+
+    def close(self):
+        self.fetcher.close()
 
 
 class SettingsDialog(QDialog):
@@ -131,7 +262,7 @@ class SettingsDialog(QDialog):
         super().__init__(parent)
         self.config = config or {}
         self.setWindowTitle("הגדרות")
-        self.setMinimumSize(500, 300)
+        self.setMinimumSize(500, 760)
         self.setup_ui()
     
     def setup_ui(self):
@@ -181,8 +312,138 @@ class SettingsDialog(QDialog):
         self.dark_mode_check.setChecked(self.config.get("dark_mode", False))
         display_layout.addWidget(self.dark_mode_check)
         
+        self.metrics_log_check = QCheckBox("שמור את זמני השלבים של כל הורדה ב-metrics.jsonl")
+        self.metrics_log_check.setChecked(self.config.get("metrics_log", True))
+        display_layout.addWidget(self.metrics_log_check)
+        
         layout.addWidget(display_group)
         
+        concurrency_group = QGroupBox("הורדות במקביל")
+        concurrency_layout = QFormLayout()
+        concurrency_group.setLayout(concurrency_layout)
+        
+        self.max_workers_spin = QSpinBox()
+        self.max_workers_spin.setRange(1, 16)
+        self.max_workers_spin.setValue(self.config.get("max_workers", DEFAULT_MAX_WORKERS))
+        concurrency_layout.addRow("מספר הורדות במקביל:", self.max_workers_spin)
+        
+        self.max_per_host_spin = QSpinBox()
+        self.max_per_host_spin.setRange(1, 16)
+        self.max_per_host_spin.setValue(self.config.get("max_per_host", DEFAULT_MAX_PER_HOST))
+        concurrency_layout.addRow("מקסימום הורדות לאתר אחד:", self.max_per_host_spin)
+        
+        self.max_connections_spin = QSpinBox()
+        self.max_connections_spin.setRange(0, 256)
+        self.max_connections_spin.setSpecialValueText("ללא הגבלה")
+        self.max_connections_spin.setValue(self.config.get("max_connections", DEFAULT_MAX_CONNECTIONS))
+        self.max_connections_spin.setToolTip("כל הורדה נספרת לפי מספר המקטעים או חיבורי aria2c שהפרופיל שלה פותח")
+        concurrency_layout.addRow("מקסימום חיבורים בסך הכל:", self.max_connections_spin)
+        
+        self.max_retries_spin = QSpinBox()
+        self.max_retries_spin.setRange(0, 10)
+        self.max_retries_spin.setValue(self.config.get("max_retries", DEFAULT_MAX_RETRIES))
+        concurrency_layout.addRow("ניסיונות חוזרים בשגיאות זמניות:", self.max_retries_spin)
+        
+        self.in_process_check = QCheckBox("הרץ את yt-dlp בתוך התוכנה (מהיר יותר, דורש את מודול yt_dlp)")
+        self.in_process_check.setChecked(self.config.get("in_process", True))
+        concurrency_layout.addRow(self.in_process_check)
+        
+        layout.addWidget(concurrency_group)
+        
+        governor_group = QGroupBox("הגבלת משאבים")
+        governor_layout = QFormLayout()
+        governor_group.setLayout(governor_layout)
+        
+        self.rate_limit_edit = QLineEdit()
+        self.rate_limit_edit.setPlaceholderText("ללא הגבלה (לדוגמה 5M)")
+        self.rate_limit_edit.setText(str(self.config.get("rate_limit", "")))
+        governor_layout.addRow("קצב הורדה כולל לכל ההורדות:", self.rate_limit_edit)
+        
+        self.max_postprocess_spin = QSpinBox()
+        self.max_postprocess_spin.setRange(0, 16)
+        self.max_postprocess_spin.setSpecialValueText("לפי מספר הליבות")
+        self.max_postprocess_spin.setValue(self.config.get("max_postprocess", 0))
+        governor_layout.addRow("מקסימום עיבודי ffmpeg במקביל:", self.max_postprocess_spin)
+        
+        self.schedule_edit = QLineEdit()
+        self.schedule_edit.setPlaceholderText("mon-fri 09:00-18:00 rate=2M pp=1; ...")
+        self.schedule_edit.setText("; ".join(self.config.get("schedule", [])))
+        governor_layout.addRow("לוח זמנים:", self.schedule_edit)
+        
+        layout.addWidget(governor_group)
+        
+        archive_group = QGroupBox("ארכיון וקבצים חלקיים")
+        archive_layout = QVBoxLayout()
+        archive_group.setLayout(archive_layout)
+        
+        self.use_archive_check = QCheckBox("דלג על סרטונים שכבר הורדו בעבר")
+        self.use_archive_check.setChecked(self.config.get("use_archive", True))
+        archive_layout.addWidget(self.use_archive_check)
+        
+        self.keep_partial_check = QCheckBox("שמור קבצים חלקיים (.part) של הורדות שבוטלו כדי להמשיך אותן")
+        self.keep_partial_check.setChecked(self.config.get("keep_partial", True))
+        archive_layout.addWidget(self.keep_partial_check)
+        
+        self.store_layout_check = QCheckBox(
+            "שמור כל סרטון פעם אחת במאגר לפי id ופורמט, וקשר אותו לתיקיית השמירה (בלי הורדות כפולות)"
+        )
+        self.store_layout_check.setChecked(self.config.get("output_layout", "title") == "store")
+        archive_layout.addWidget(self.store_layout_check)
+        
+        self.sync_subscriptions_check = QCheckBox("בדוק מינויים ברקע והורד סרטונים חדשים")
+        self.sync_subscriptions_check.setChecked(self.config.get("sync_subscriptions", True))
+        archive_layout.addWidget(self.sync_subscriptions_check)
+        
+        layout.addWidget(archive_group)
+        
+        stream_group = QGroupBox("מצב הזרמה")
+        stream_layout = QFormLayout()
+        stream_group.setLayout(stream_layout)
+        
+        self.stream_check = QCheckBox("הזרם את המדיה ישר ליעד, בלי קבצים זמניים ומיזוג (קבצים גדולים ושידורים חיים)")
+        self.stream_check.setChecked(self.config.get("output_mode", "file") == "stream")
+        stream_layout.addRow(self.stream_check)
+        
+        self.stream_sink_combo = QComboBox()
+        for sink in STREAM_SINKS:
+            self.stream_sink_combo.addItem(STREAM_SINK_LABELS[sink], sink)
+        self.stream_sink_combo.setCurrentIndex(max(self.stream_sink_combo.findData(self.config.get("stream_sink", "file")), 0))
+        stream_layout.addRow("יעד:", self.stream_sink_combo)
+        
+        self.stream_target_edit = QLineEdit()
+        self.stream_target_edit.setPlaceholderText(DEFAULT_STREAM_TARGET + " (יחסית לתיקיית השמירה)")
+        self.stream_target_edit.setText(self.config.get("stream_target", ""))
+        stream_layout.addRow("נתיב:", self.stream_target_edit)
+        
+        self.segment_mb_spin = QSpinBox()
+        self.segment_mb_spin.setRange(1, 1024 * 1024)
+        self.segment_mb_spin.setSuffix(" MB")
+        self.segment_mb_spin.setValue(self.config.get("stream_segment_mb", DEFAULT_SEGMENT_MB))
+        stream_layout.addRow("גודל מקטע:", self.segment_mb_spin)
+        
+        layout.addWidget(stream_group)
+        
+        profiles_group = QGroupBox("פרופילי פורמט")
+        profiles_layout = QVBoxLayout()
+        profiles_group.setLayout(profiles_layout)
+        
+        self.profiles_edit = QPlainTextEdit()
+        self.profiles_edit.setPlaceholderText(
+            '{"720p": {"max_height": 720, "vcodec": "avc1", "container": "mp4", "fallback": ["mp4-low"]},\n'
+            ' "podcast": {"audio": "mp3", "audio_bitrate": 128}}'
+        )
+        profiles = self.config.get("profiles", {})
+        if profiles:
+            self.profiles_edit.setPlainText(json.dumps(profiles, ensure_ascii=False, indent=2))
+        self.profiles_edit.setFont(QFont("Consolas", 9))
+        profiles_layout.addWidget(self.profiles_edit)
+        
+        self.probe_formats_check = QCheckBox("בדוק לפני ההורדה איזה פורמט נגיש (התוצאה נשמרת לכל סרטון)")
+        self.probe_formats_check.setChecked(self.config.get("probe_formats", False))
+        profiles_layout.addWidget(self.probe_formats_check)
+        
+        layout.addWidget(profiles_group)
+        
         layout.addStretch()
         
         buttons_layout = QHBoxLayout()
@@ -199,6 +460,28 @@ class SettingsDialog(QDialog):
         save_btn.setDefault(True)
         buttons_layout.addWidget(save_btn)
     
+    def accept(self):
+        try:
+            validate_profiles(self.get_profiles())
+        except ValueError as e:
+            QMessageBox.warning(self, "פרופילי פורמט", f"ערך לא תקין: {e}")
+            return
+        try:
+            governor_from_config(self.get_settings())
+        except ValueError as e:
+            QMessageBox.warning(self, "הגבלת משאבים", f"ערך לא תקין: {e}")
+            return
+        try:
+            stream_output_from_config(self.get_settings())
+        except ValueError as e:
+            QMessageBox.warning(self, "מצב הזרמה", f"ערך לא תקין: {e}")
+            return
+        super().accept()
+    
+    def get_profiles(self):
+        text = self.profiles_edit.toPlainText().strip()
+        return json.loads(text) if text else {}
+    
     def select_directory(self):
         directory = QFileDialog.getExistingDirectory(self, "בחר תיקייה לשמירת קבצים")
         if directory:
@@ -209,7 +492,27 @@ class SettingsDialog(QDialog):
             "save_dir": self.save_dir_edit.text(),
             "ssl_check": self.ssl_check.isChecked(),
             "show_cli": self.show_cli_check.isChecked(),
-            "dark_mode": self.dark_mode_check.isChecked()
+            "dark_mode": self.dark_mode_check.isChecked(),
+            "metrics_log": self.metrics_log_check.isChecked(),
+            "max_workers": self.max_workers_spin.value(),
+            "max_per_host": self.max_per_host_spin.value(),
+            "max_connections": self.max_connections_spin.value(),
+            "max_retries": self.max_retries_spin.value(),
+            "in_process": self.in_process_check.isChecked(),
+            "use_archive": self.use_archive_check.isChecked(),
+            "keep_partial": self.keep_partial_check.isChecked(),
+            "sync_subscriptions": self.sync_subscriptions_check.isChecked(),
+            "output_layout": "store" if self.store_layout_check.isChecked() else "title",
+            "store_dir": self.config.get("store_dir", ""),
+            "rate_limit": self.rate_limit_edit.text().strip(),
+            "max_postprocess": self.max_postprocess_spin.value(),
+            "schedule": [rule.strip() for rule in self.schedule_edit.text().split(";") if rule.strip()],
+            "profiles": self.get_profiles(),
+            "probe_formats": self.probe_formats_check.isChecked(),
+            "output_mode": "stream" if self.stream_check.isChecked() else "file",
+            "stream_sink": self.stream_sink_combo.currentData(),
+            "stream_target": self.stream_target_edit.text().strip(),
+            "stream_segment_mb": self.segment_mb_spin.value()
         }
 
 
@@ -277,7 +580,201 @@ class AboutDialog(QDialog):
         layout.addLayout(btn_layout)
 
 
+class StatsDialog(QDialog):
+    # זמני השלבים (p50/p95) של ניסיונות ההורדה האחרונים ותפוקה מצטברת.
+    # החלון לא מודאלי ומתעדכן פעם בשנייה, כך שאפשר להשאיר אותו פתוח בזמן הורדה.
+    def __init__(self, metrics, parent=None):
+        super().__init__(parent)
+        self.metrics = metrics
+        self.setWindowTitle("סטטיסטיקה")
+        self.setMinimumSize(460, 360)
+        self.setup_ui()
+        self.refresh()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+    
+    def showEvent(self, event):
+        self.timer.start(STATS_REFRESH_MS)
+        super().showEvent(event)
+    
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+    
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        
+        self.summary_label = QLabel()
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+        
+        self.stages_table = QTableWidget(len(STAGES), 3)
+        self.stages_table.setHorizontalHeaderLabels(["p50", "p95", "סה\"כ"])
+        self.stages_table.setVerticalHeaderLabels([STAGE_LABELS[stage] for stage in STAGES])
+        self.stages_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.stages_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        layout.addWidget(self.stages_table)
+        
+        buttons_layout = QHBoxLayout()
+        layout.addLayout(buttons_layout)
+        
+        export_btn = QPushButton("ייצוא ל-Prometheus...")
+        export_btn.clicked.connect(self.export_prometheus)
+        buttons_layout.addWidget(export_btn)
+        
+        buttons_layout.addStretch()
+        
+        close_btn = QPushButton("סגור")
+        close_btn.clicked.connect(self.close)
+        buttons_layout.addWidget(close_btn)
+    
+    def refresh(self):
+        snapshot = self.metrics.snapshot()
+        results = snapshot["results"]
+        text = (f"ניסיונות: {snapshot['attempts']} | הצליחו: {results.get('ok', 0)} | "
+                f"נכשלו: {results.get('failed', 0)} | ניסיונות חוזרים: {results.get('retry', 0)} | "
+                f"הורדו: {format_bytes(snapshot['bytes'])}")
+        if snapshot["throughput"] is not None:
+            text += (f"\nתפוקה ב-{snapshot['window']} הניסיונות האחרונים: {format_bytes(snapshot['throughput'])}/s, "
+                     f"{snapshot['items_per_minute']:.1f} סרטונים לדקה")
+        self.summary_label.setText(text)
+        for row, stage in enumerate(STAGES):
+            quantiles = snapshot["stages"][stage]
+            values = (quantiles[0.5], quantiles[0.95], snapshot["stage_sums"][stage])
+            for column, value in enumerate(values):
+                self.stages_table.setItem(row, column, QTableWidgetItem("-" if value is None else f"{value:.2f}s"))
+    
+    def export_prometheus(self):
+        path, _ = QFileDialog.getSaveFileName(self, "ייצוא מדדים", "replica.prom", "Prometheus (*.prom);;כל הקבצים (*)")
+        if not path:
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.metrics.prometheus())
+        except OSError as e:
+            QMessageBox.critical(self, "שגיאה", f"לא ניתן לשמור את הקובץ: {e}")
+
+
+class SubscriptionsDialog(QDialog):
+    # ניהול מינויים לערוצים ולפלייליסטים. הסנכרון עצמו רץ ב-MainWindow
+    def __init__(self, store, config, sync_now, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.config = config
+        self.sync_now = sync_now
+        self.setWindowTitle("מינויים")
+        self.setMinimumSize(640, 380)
+        self.setup_ui()
+        self.refresh()
+    
+    def setup_ui(self):
+        layout = QVBoxLayout(self)
+        
+        self.table = QTableWidget(0, 5)
+        self.table.setHorizontalHeaderLabels(["קישור", "כל (שעות)", "סונכרן לאחרונה", "תאריך אחרון", "שגיאה"])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.verticalHeader().hide()
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(self.table)
+        
+        add_group = QGroupBox("מינוי חדש")
+        add_layout = QFormLayout()
+        add_group.setLayout(add_layout)
+        
+        self.url_edit = QLineEdit()
+        self.url_edit.setPlaceholderText("https://www.youtube.com/@channel או קישור לפלייליסט")
+        add_layout.addRow("קישור:", self.url_edit)
+        
+        self.format_combo = QComboBox()
+        for kind, label in BUILTIN_FORMAT_LABELS.items():
+            self.format_combo.addItem(label, kind)
+        for name in self.config.get("profiles", {}):
+            self.format_combo.addItem(name, name)
+        add_layout.addRow("פורמט:", self.format_combo)
+        
+        self.interval_spin = QSpinBox()
+        self.interval_spin.setRange(1, 24 * 30)
+        self.interval_spin.setValue(DEFAULT_SYNC_INTERVAL // 3600)
+        self.interval_spin.setSuffix(" שעות")
+        add_layout.addRow("בדיקה כל:", self.interval_spin)
+        
+        self.backfill_spin = QSpinBox()
+        self.backfill_spin.setRange(0, 500)
+        self.backfill_spin.setToolTip("כמה מהסרטונים הקיימים האחרונים להוריד בסנכרון הראשון")
+        add_layout.addRow("סרטונים קיימים להורדה:", self.backfill_spin)
+        
+        layout.addWidget(add_group)
+        
+        buttons_layout = QHBoxLayout()
+        layout.addLayout(buttons_layout)
+        
+        add_btn = QPushButton("הוסף")
+        add_btn.clicked.connect(self.add_subscription)
+        buttons_layout.addWidget(add_btn)
+        
+        remove_btn = QPushButton("הסר")
+        remove_btn.clicked.connect(self.remove_selected)
+        buttons_layout.addWidget(remove_btn)
+        
+        sync_btn = QPushButton("סנכרן עכשיו")
+        sync_btn.clicked.connect(self.sync_all)
+        buttons_layout.addWidget(sync_btn)
+        
+        buttons_layout.addStretch()
+        
+        close_btn = QPushButton("סגור")
+        close_btn.clicked.connect(self.close)
+        buttons_layout.addWidget(close_btn)
+    
+    def refresh(self):
+        subscriptions = self.store.all()
+        self.table.setRowCount(len(subscriptions))
+        for row, subscription in enumerate(subscriptions):
+            last_sync = (datetime.fromtimestamp(subscription.last_sync).strftime("%d/%m %H:%M")
+                         if subscription.last_sync else "-")
+            newest_date = subscription.newest_date
+            if newest_date:
+                newest_date = f"{newest_date[6:8]}/{newest_date[4:6]}/{newest_date[:4]}"
+            values = (subscription.url, f"{subscription.interval / 3600:g}", last_sync, newest_date or "-",
+                      subscription.error or "")
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                item.setData(Qt.UserRole, subscription.id)
+                self.table.setItem(row, column, item)
+    
+    def add_subscription(self):
+        try:
+            format_option = format_option_for(self.format_combo.currentData(), self.config.get("ssl_check", False),
+                                              self.config.get("profiles", {}))
+        except ValueError as e:
+            QMessageBox.critical(self, "שגיאה", str(e))
+            return
+        subscription = self.store.add(self.url_edit.text().strip(), format_option,
+                                      self.interval_spin.value() * 3600, self.backfill_spin.value())
+        if subscription is None:
+            QMessageBox.warning(self, "שגיאה", "אפשר להירשם רק לערוץ או לפלייליסט של YouTube.")
+            return
+        self.url_edit.clear()
+        self.refresh()
+        self.sync_now()
+    
+    def remove_selected(self):
+        rows = {index.row() for index in self.table.selectionModel().selectedRows()}
+        for row in rows:
+            self.store.remove(self.table.item(row, 0).data(Qt.UserRole))
+        self.refresh()
+    
+    def sync_all(self):
+        self.store.mark_due()
+        self.sync_now()
+
+
 class MainWindow(QMainWindow):
+    # פריטים שהמנוע דחה כי סיים בינתיים; חוזרים לחוט הממשק כדי להתחיל אצווה חדשה
+    submit_rejected = Signal(object)
+
     def __init__(self):
         super().__init__()
         
@@ -292,6 +789,40 @@ class MainWindow(QMainWindow):
         self.setup_ui()
         
         self.download_thread = None
+        self.deferred_items = []
+        self.submit_rejected.connect(self.run_rejected_items)
+        self.ydl_pool = YoutubeDLPool()
+        self.queue = DownloadQueue()
+        self.archive = DownloadArchive()
+        self.expansion_cache = ExpansionCache()
+        self.media_cache = MediaCache()
+        self.metrics = MetricsRecorder(METRICS_FILE if self.config.get("metrics_log", True) else None)
+        self.stats_dialog = None
+        self.output_stores = {}
+        self.subscriptions = SubscriptionStore()
+        self.subscriptions_dialog = None
+        self.sync_thread = None
+        self.sync_timer = QTimer(self)
+        self.sync_timer.timeout.connect(self.sync_subscriptions)
+        self.sync_timer.start(int(SYNC_CHECK_INTERVAL * 1000))
+        self.queue_model = QueueTableModel(self.queue, self.media_cache, self.config.get("in_process", True), self)
+        self.queue_view.setModel(self.queue_model)
+        header = self.queue_view.horizontalHeader()
+        # ResizeToContents היה מודד את כל השורות; בתור גדול זה איטי
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for column, width in ((1, 70), (2, 80), (3, 80), (4, 90)):
+            self.queue_view.setColumnWidth(column, width)
+        
+        # איתור הכלים רץ ברקע קצת אחרי שהחלון צויר (ייבוא yt_dlp מחזיק את ה-GIL),
+        # וגם מחמם את הייבוא להורדה הראשונה
+        self.tools = None
+        self.tools_confirmed = set()
+        self.tool_discovery = ToolDiscoveryThread(self)
+        self.tool_discovery.discovered.connect(self.tools_discovered)
+        QTimer.singleShot(TOOL_DISCOVERY_DELAY_MS, self.tool_discovery.start)
+        QTimer.singleShot(0, self.offer_resume)
+        QTimer.singleShot(SYNC_START_DELAY_MS, self.sync_subscriptions)
     
     def set_dark_mode(self):
         dark_style = """
@@ -369,6 +900,14 @@ class MainWindow(QMainWindow):
         
         btn_layout.addStretch()
         
+        subscriptions_btn = QPushButton("מינויים")
+        subscriptions_btn.clicked.connect(self.show_subscriptions)
+        btn_layout.addWidget(subscriptions_btn)
+        
+        stats_btn = QPushButton("סטטיסטיקה")
+        stats_btn.clicked.connect(self.show_stats)
+        btn_layout.addWidget(stats_btn)
+        
         about_btn = QPushButton("אודות")
         about_btn.clicked.connect(self.show_about)
         btn_layout.addWidget(about_btn)
@@ -390,6 +929,14 @@ class MainWindow(QMainWindow):
         self.url_edit.setPlaceholderText("https://www.youtube.com/watch?v=...")
         url_layout.addWidget(self.url_edit)
         
+        import_layout = QHBoxLayout()
+        url_layout.addLayout(import_layout)
+        
+        self.import_btn = QPushButton("ייבוא קישורים מקובץ...")
+        self.import_btn.clicked.connect(self.import_links)
+        import_layout.addWidget(self.import_btn)
+        import_layout.addStretch()
+        
         #self.url_edit.setContextMenuPolicy(Qt.CustomContextMenu)
         #self.url_edit.customContextMenuRequested.connect(self.show_context_menu)
         
@@ -433,6 +980,18 @@ class MainWindow(QMainWindow):
         
         format_quality_layout.addWidget(self.quality_group)
         
+        self.profile_group = QGroupBox("פרופיל")
+        profile_layout = QVBoxLayout()
+        self.profile_group.setLayout(profile_layout)
+        
+        self.profile_combo = QComboBox()
+        self.profile_combo.currentIndexChanged.connect(self.toggle_quality_options)
+        profile_layout.addWidget(self.profile_combo)
+        profile_layout.addStretch()
+        
+        format_quality_layout.addWidget(self.profile_group)
+        self.refresh_profiles()
+        
         download_layout = QHBoxLayout()
         main_layout.addLayout(download_layout)
         
@@ -444,14 +1003,45 @@ class MainWindow(QMainWindow):
         self.download_btn.setFont(download_font)
         self.download_btn.clicked.connect(self.start_download)
         download_layout.addWidget(self.download_btn)
+        
+        self.stop_btn = QPushButton("עצור")
+        self.stop_btn.setMinimumSize(80, 40)
+        self.stop_btn.setEnabled(False)
+        self.stop_btn.clicked.connect(self.stop_download)
+        download_layout.addWidget(self.stop_btn)
         download_layout.addStretch()
         
         self.progress_bar = QProgressBar()
-        self.progress_bar.setTextVisible(False)
-        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setFormat("%p%")
         self.progress_bar.hide()
         main_layout.addWidget(self.progress_bar)
         
+        self.item_progress_bar = QProgressBar()
+        self.item_progress_bar.setRange(0, 1000)
+        self.item_progress_bar.hide()
+        main_layout.addWidget(self.item_progress_bar)
+        
+        self.progress_label = QLabel()
+        self.progress_label.hide()
+        main_layout.addWidget(self.progress_label)
+        
+        queue_group = QGroupBox("תור הורדות")
+        queue_layout = QVBoxLayout()
+        queue_group.setLayout(queue_layout)
+        
+        self.queue_view = QTableView()
+        self.queue_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.queue_view.setWordWrap(False)
+        self.queue_view.setIconSize(THUMBNAIL_SIZE)
+        self.queue_view.verticalHeader().hide()
+        self.queue_view.verticalHeader().setDefaultSectionSize(THUMBNAIL_SIZE.height() + 4)
+        self.queue_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.queue_view.customContextMenuRequested.connect(self.show_queue_menu)
+        queue_layout.addWidget(self.queue_view)
+        
+        main_layout.addWidget(queue_group, 1)
+        
         self.cli_group = QGroupBox("פלט תהליך ההורדה")
         cli_layout = QVBoxLayout()
         self.cli_group.setLayout(cli_layout)
@@ -463,8 +1053,10 @@ class MainWindow(QMainWindow):
         clear_btn.clicked.connect(self.clear_console)
         cli_header_layout.addWidget(clear_btn)
         
-        self.console_text = QTextEdit()
+        self.console_text = QPlainTextEdit()
         self.console_text.setReadOnly(True)
+        self.console_text.setUndoRedoEnabled(False)
+        self.console_text.setMaximumBlockCount(CONSOLE_MAX_BLOCKS)
         self.console_text.setFont(QFont("Consolas", 10))
         cli_layout.addWidget(self.console_text)
         
@@ -490,85 +1082,347 @@ class MainWindow(QMainWindow):
         
         context_menu.exec_(self.url_edit.mapToGlobal(position))
     
+    def refresh_profiles(self):
+        current = self.profile_combo.currentData()
+        self.profile_combo.blockSignals(True)
+        self.profile_combo.clear()
+        self.profile_combo.addItem("לפי הפורמט והאיכות", None)
+        for name in self.config.get("profiles", {}):
+            self.profile_combo.addItem(name, name)
+        index = self.profile_combo.findData(current)
+        self.profile_combo.setCurrentIndex(max(index, 0))
+        self.profile_combo.blockSignals(False)
+        self.profile_group.setVisible(self.profile_combo.count() > 1)
+    
+    def show_queue_menu(self, position):
+        rows = sorted({index.row() for index in self.queue_view.selectionModel().selectedRows()})
+        if not rows:
+            return
+        items = [self.queue_model.item_at(row) for row in rows]
+        menu = QMenu()
+        cancel_action = menu.addAction("בטל הורדה")
+        cancel_action.setEnabled(any(item[2] in ("pending", RUNNING) for item in items))
+        copy_action = menu.addAction("העתק קישור")
+        action = menu.exec(self.queue_view.viewport().mapToGlobal(position))
+        if action == copy_action:
+            QApplication.clipboard().setText("\n".join(item[1] for item in items))
+        elif action == cancel_action:
+            self.cancel_items(items)
+    
+    def cancel_items(self, items):
+        engine = self.download_thread.engine if self.download_thread and self.download_thread.isRunning() else None
+        for item_id, url, state, format_option, error in items:
+            if state not in ("pending", RUNNING):
+                continue
+            if engine is not None and engine.cancel_item(item_id):
+                # הפריט הרץ מסומן כמבוטל כשה-worker שלו מסיים
+                continue
+            self.queue.mark_cancelled(item_id)
+            self.queue_model.refresh_item(item_id)
+    
     def toggle_quality_options(self):
-        if self.format_group.checkedId() == 1:
+        # פרופיל שנבחר מחליף את בחירת הפורמט והאיכות
+        profile_selected = self.profile_combo.currentData() is not None
+        self.format_mp4.setEnabled(not profile_selected)
+        self.format_mp3.setEnabled(not profile_selected)
+        if self.format_group.checkedId() == 1 and not profile_selected:
             self.quality_group.setEnabled(True)
         else:
             self.quality_group.setEnabled(False)
     
-    def start_download(self):
-
-        urls_input = self.url_edit.text().strip()
-        if not urls_input:
-            QMessageBox.warning(self, "שגיאה", "לא הוזנו קישורים.")
-            return
-        
-        urls = [url.strip() for url in urls_input.split(",")]
+    def build_format_option(self):
         format_choice = self.format_group.checkedId()
         quality_choice = self.quality_button_group.checkedId()
-        ssl_option = [] if not self.config.get("ssl_check", False) else ["--no-check-certificate"]
+        no_check_certificate = self.config.get("ssl_check", False)
+        
+        profile = self.profile_combo.currentData()
+        if profile is not None:
+            try:
+                return format_option_for(profile, no_check_certificate, self.config.get("profiles", {}))
+            except ValueError as e:
+                QMessageBox.critical(self, "שגיאה", f"הפרופיל {profile} אינו תקין: {e}")
+                return None
         
         if format_choice == 1:  # MP4
             if quality_choice == 1:  # איכות גבוהה
-                format_option = ["yt-dlp"] + ssl_option
+                return format_option_for("mp4", no_check_certificate)
             elif quality_choice == 2:  # איכות נמוכה
-                format_option = ["yt-dlp"] + ssl_option + ["-f", "mp4"]
+                return format_option_for("mp4-low", no_check_certificate)
             else:
                 QMessageBox.critical(self, "שגיאה", "בחר איכות תקינה.")
-                return
+                return None
         elif format_choice == 2:  # MP3
-            format_option = ["yt-dlp"] + ssl_option + ["-x", "--audio-format", "mp3"]
+            return format_option_for("mp3", no_check_certificate)
         else:
             QMessageBox.critical(self, "שגיאה", "בחר פורמט תקין.")
+            return None
+    
+    def start_download(self):
+
+        urls_input = self.url_edit.text().strip()
+        if not urls_input:
+            QMessageBox.warning(self, "שגיאה", "לא הוזנו קישורים.")
+            return
+        
+        result = collect_links(urls_input.split(","))
+        if not result.urls:
+            QMessageBox.warning(self, "שגיאה", "לא נמצאו קישורים תקינים.")
+            return
+        
+        format_option = self.build_format_option()
+        if format_option is None:
+            return
+        
+        self.run_items(self.queue.add(result.urls, format_option))
+    
+    def import_links(self):
+        path, _ = QFileDialog.getOpenFileName(self, "בחר קובץ קישורים", "", LINK_FILE_FILTER)
+        if not path:
+            return
+        
+        try:
+            result = collect_links(iter_link_file(path))
+        except OSError as e:
+            QMessageBox.critical(self, "שגיאה", f"לא ניתן לקרוא את הקובץ: {e}")
+            return
+        
+        summary = f"התקבלו {result.accepted} קישורים, {result.duplicates} כפולים הושמטו, {result.invalid} לא תקינים."
+        if not result.urls:
+            QMessageBox.warning(self, "ייבוא קישורים", summary)
+            return
+        
+        reply = QMessageBox.question(
+            self, "ייבוא קישורים", f"{summary}\n\nלהתחיל בהורדה?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        if reply != QMessageBox.Yes:
+            return
+        
+        format_option = self.build_format_option()
+        if format_option is None:
+            return
+        
+        self.run_items(self.queue.add(result.urls, format_option))
+    
+    def offer_resume(self):
+        items = self.queue.unfinished()
+        if not items:
+            return
+        reply = QMessageBox.question(
+            self, "המשך הורדות",
+            f"נמצאו {len(items)} הורדות שלא הושלמו מהפעלה קודמת. האם להמשיך אותן?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        if reply == QMessageBox.Yes:
+            self.run_items(items)
+        else:
+            self.queue.discard_unfinished()
+            self.queue_model.reload()
+    
+    @Slot(object)
+    def tools_discovered(self, tools):
+        self.tools = tools
+        summary, problems = tools_summary(tools)
+        if problems:
+            self.status_bar.showMessage("⚠ " + "; ".join(problems))
+        elif summary and not (self.download_thread and self.download_thread.isRunning()):
+            self.status_bar.showMessage(f"Replica מוכן להורדה ({summary})")
+    
+    def check_tools(self, items=()):
+        # בעיה בכלים מוצגת לפני שהאצווה מתחילה, ולא כשגיאה באמצע ההורדה
+        if self.tools is None:
+            return True
+        _, problems = tools_summary(self.tools, [item.format_option for item in items])
+        if not problems:
+            return True
+        if self.tools["yt-dlp"].path is None and self.tools["yt_dlp"].path is None:
+            QMessageBox.critical(self, "שגיאה", problems[0] + "\nודא שהתקנת אותו ושהוא נגיש מ-PATH.")
+            return False
+        if set(problems) <= self.tools_confirmed:
+            return True
+        reply = QMessageBox.question(
+            self, "כלים חסרים", "\n".join(problems) + "\n\nלהמשיך בכל זאת?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return False
+        self.tools_confirmed |= set(problems)
+        return True
+    
+    def run_items(self, items):
+        if not self.check_tools(items):
+            return
+        try:
+            governor = governor_from_config(self.config)
+        except ValueError as e:
+            QMessageBox.critical(self, "שגיאה", f"הגדרות הגבלת המשאבים אינן תקינות: {e}")
+            return
+        try:
+            stream = stream_output_from_config(self.config)
+        except ValueError as e:
+            QMessageBox.critical(self, "שגיאה", f"הגדרות מצב ההזרמה אינן תקינות: {e}")
             return
         
         save_directory = self.config.get("save_dir", os.path.join(os.path.expanduser("~"), "Downloads", "Replica"))
         if not os.path.exists(save_directory):
             os.makedirs(save_directory)
         
+        # מאגר נשאר פתוח עד היציאה, כי אצווה קודמת עדיין עשויה לכתוב אליו
+        try:
+            store_root = output_store_root(self.config, save_directory)
+            if store_root is not None and store_root not in self.output_stores:
+                self.output_stores[store_root] = OutputStore(store_root)
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, "שגיאה", f"לא ניתן לפתוח את מאגר הקבצים: {e}")
+            return
+        
         self.download_btn.setEnabled(False)
-        self.status_bar.showMessage(f"מוריד {len(urls)} קבצים...")
-        self.progress_bar.show()
+        self.import_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self.status_bar.showMessage(f"מוריד {len(items)} קבצים...")
+        self.reset_progress(len(items))
         
         if self.config.get("show_cli", True):
             self.clear_console()
         
         self.download_thread = DownloadThread(
-            urls, format_option, save_directory, self.config.get("show_cli", True)
+            items, save_directory, self.config.get("show_cli", True),
+            self.config.get("max_workers", DEFAULT_MAX_WORKERS),
+            self.config.get("max_per_host", DEFAULT_MAX_PER_HOST),
+            self.ydl_pool if self.config.get("in_process", True) else None,
+            self.queue,
+            self.archive if self.config.get("use_archive", True) else None,
+            PlaylistExpander(self.expansion_cache, self.config.get("in_process", True)),
+            self.config.get("max_retries", DEFAULT_MAX_RETRIES),
+            keep_partial=self.config.get("keep_partial", True),
+            governor=governor,
+            prober=FormatProber(self.expansion_cache, self.config.get("in_process", True))
+            if self.config.get("probe_formats", False) else None,
+            metrics=self.metrics,
+            stream=stream,
+            max_connections=self.config.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+            store=self.output_stores.get(store_root)
         )
         
         self.download_thread.update_progress.connect(self.update_status)
         self.download_thread.update_console.connect(self.update_console)
         self.download_thread.download_finished.connect(self.download_complete)
         self.download_thread.download_error.connect(self.show_error)
+        self.download_thread.batch_started.connect(self.reset_progress)
+        self.download_thread.batch_started.connect(self.queue_model.reload)
+        self.download_thread.item_progress.connect(self.update_item_progress)
+        self.download_thread.item_finished.connect(self.item_finished)
+        self.download_thread.finished.connect(self.download_thread_finished)
         
         self.download_thread.start()
     
+    def stop_download(self):
+        if self.download_thread and self.download_thread.isRunning():
+            self.stop_btn.setEnabled(False)
+            self.download_thread.stop()
+            self.status_bar.showMessage("ההורדה נעצרה. הפריטים שלא הסתיימו יחודשו בהפעלה הבאה.")
+    
+    @Slot()
+    def download_thread_finished(self):
+        self.download_btn.setEnabled(True)
+        self.import_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+        self.progress_bar.hide()
+        self.item_progress_bar.hide()
+        self.progress_label.hide()
+        self.queue_model.reload()
+        if self.deferred_items:
+            items, self.deferred_items = self.deferred_items, []
+            self.run_items(items)
+    
     @Slot(str)
     def update_status(self, message):
         self.status_bar.showMessage(message)
     
     @Slot(str)
     def update_console(self, text):
-        self.console_text.append(text)
-        self.console_text.verticalScrollBar().setValue(
-            self.console_text.verticalScrollBar().maximum()
-        )
+        scroll_bar = self.console_text.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 2
+        cursor = self.console_text.textCursor()
+        cursor.movePosition(cursor.MoveOperation.End)
+        cursor.insertText(text)
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+    
+    def reset_progress(self, total):
+        self.batch_total = total
+        self.batch_done = 0
+        self.active_progress = {}
+        self.progress_bar.setValue(0)
+        self.item_progress_bar.setRange(0, 1000)
+        self.item_progress_bar.setValue(0)
+        self.progress_label.setText("")
+        self.progress_bar.show()
+        self.item_progress_bar.show()
+        self.progress_label.show()
+    
+    def item_id_at(self, index):
+        items = self.download_thread.engine.items if self.download_thread else []
+        return items[index - 1].id if 0 < index <= len(items) else None
+    
+    @Slot(object)
+    def update_item_progress(self, event):
+        self.active_progress[event.index] = event
+        self.refresh_progress()
+        if event.total:
+            self.queue_model.set_progress(self.item_id_at(event.index), min(event.downloaded / event.total, 1))
+    
+    @Slot(int, bool)
+    def item_finished(self, index, ok):
+        self.active_progress.pop(index, None)
+        self.batch_done += 1
+        self.refresh_progress()
+        self.queue_model.refresh_item(self.item_id_at(index))
     
-    @Slot(int, int)
-    def download_complete(self, successful, failed):
-        total = successful + failed
+    def refresh_progress(self):
+        active = self.active_progress
+        fraction = self.batch_done
+        speed = 0
+        for event in active.values():
+            if event.total:
+                fraction += min(event.downloaded / event.total, 1)
+            speed += event.speed or 0
+        self.progress_bar.setValue(int(fraction * 1000 / max(self.batch_total, 1)))
+        
+        focused = active[min(active)] if active else None
+        if focused is None or not focused.total:
+            self.item_progress_bar.setRange(0, 0 if focused is not None else 1000)
+        else:
+            self.item_progress_bar.setRange(0, 1000)
+            self.item_progress_bar.setValue(int(min(focused.downloaded / focused.total, 1) * 1000))
         
-        self.download_btn.setEnabled(True)
-        self.progress_bar.hide()
+        text = f"{self.batch_done}/{self.batch_total} הושלמו | {speed / (1024 * 1024):.2f} MB/s"
+        if focused is not None:
+            text += f" | פריט {focused.index}: {format_bytes(focused.downloaded)} מתוך {format_bytes(focused.total)}, ETA {format_eta(focused.eta)}"
+        self.progress_label.setText(text)
+    
+    @Slot(int, int, int, int)
+    def download_complete(self, successful, failed, skipped, retries):
+        total = successful + failed + skipped
+        
+        self.download_thread_finished()
         
         if successful > 0:
             msg = f"הורדה הושלמה: {successful}/{total} קבצים הורדו בהצלחה"
             if failed > 0:
                 msg += f", {failed}/{total} קבצים נכשלו."
+            if skipped > 0:
+                msg += f" {skipped}/{total} דולגו כי כבר הורדו בעבר."
+            if retries > 0:
+                msg += f" בוצעו {retries} ניסיונות חוזרים."
             QMessageBox.information(self, "הצלחה", msg)
         elif failed > 0:
             QMessageBox.critical(self, "שגיאה", f"כל ההורדות נכשלו ({failed}/{total}).")
+        elif skipped > 0:
+            QMessageBox.information(self, "הורדה הושלמה", f"כל הקישורים ({skipped}/{total}) כבר הורדו בעבר.")
     
     @Slot(str)
     def show_error(self, message):
@@ -584,6 +1438,8 @@ class MainWindow(QMainWindow):
             
             self.config = dialog.get_settings()
             save_config(self.config)
+            self.refresh_profiles()
+            self.metrics.set_path(METRICS_FILE if self.config.get("metrics_log", True) else None)
             
             if dialog.get_settings().get("dark_mode") != self.config.get("dark_mode", False):
                 if dialog.get_settings().get("dark_mode"):
@@ -606,6 +1462,72 @@ class MainWindow(QMainWindow):
         dialog = AboutDialog(self)
         dialog.exec()
     
+    def show_stats(self):
+        if self.stats_dialog is None:
+            self.stats_dialog = StatsDialog(self.metrics, self)
+        self.stats_dialog.refresh()
+        self.stats_dialog.show()
+        self.stats_dialog.raise_()
+    
+    def show_subscriptions(self):
+        # הפורמטים בחלון נבנים מההגדרות, ולכן חלון סגור נבנה מחדש אחרי שינוי פרופילים
+        if self.subscriptions_dialog is None or not self.subscriptions_dialog.isVisible():
+            if self.subscriptions_dialog is not None:
+                self.subscriptions_dialog.deleteLater()
+            self.subscriptions_dialog = SubscriptionsDialog(
+                self.subscriptions, self.config, lambda: self.sync_subscriptions(force=True), self
+            )
+        self.subscriptions_dialog.refresh()
+        self.subscriptions_dialog.show()
+        self.subscriptions_dialog.raise_()
+    
+    def sync_subscriptions(self, force=False):
+        # force: פעולה מפורשת של המשתמש גם כשהסנכרון ברקע כבוי
+        if not force and not self.config.get("sync_subscriptions", True):
+            return
+        if self.sync_thread is not None and self.sync_thread.isRunning():
+            return
+        expander = PlaylistExpander(self.expansion_cache, self.config.get("in_process", True))
+        self.sync_thread = SubscriptionSyncThread(SubscriptionSyncer(self.subscriptions, expander), self)
+        self.sync_thread.synced.connect(self.subscriptions_synced)
+        self.sync_thread.start()
+    
+    @Slot(object)
+    def subscriptions_synced(self, results):
+        if self.subscriptions_dialog is not None:
+            self.subscriptions_dialog.refresh()
+        items = []
+        for result in results:
+            if result.entries:
+                items += self.queue.add([entry[1] for entry in result.entries], result.subscription.format_option)
+        errors = sum(1 for result in results if result.error)
+        if errors:
+            self.status_bar.showMessage(f"⚠ {errors} מינויים לא נבדקו; הפרטים בחלון המינויים")
+        if not items:
+            return
+        self.status_bar.showMessage(f"מינויים: נמצאו {len(items)} סרטונים חדשים")
+        if self.download_thread and self.download_thread.isRunning():
+            # submit מחכה עד שהמנוע מוכן לקבל פריטים, ולכן לא רץ בחוט הממשק. אצווה
+            # שמסיימת את הפריט האחרון שלה בדיוק עכשיו דוחה אותם, והם מתחילים אצווה חדשה
+            engine = self.download_thread.engine
+
+            def submit():
+                # מנוע שנעצר ביד דוחה גם הוא; אז הפריטים נשארים בתור להפעלה הבאה
+                if engine.submit(items) is None and engine.running:
+                    self.submit_rejected.emit(items)
+
+            threading.Thread(target=submit, daemon=True).start()
+        else:
+            self.run_items(items)
+
+    @Slot(object)
+    def run_rejected_items(self, items):
+        if self.download_thread and self.download_thread.isRunning():
+            # המנוע שדחה עוד מסכם; מתחילים כשהחוט שלו נגמר
+            self.deferred_items.extend(items)
+        else:
+            self.run_items(items)
+    
     def closeEvent(self, event):
         if self.download_thread and self.download_thread.isRunning():
             reply = QMessageBox.question(
@@ -616,16 +1538,40 @@ class MainWindow(QMainWindow):
             )
             
             if reply == QMessageBox.Yes:
+                # stop() הורג את תהליכי ההורדה; workers שלא הגיבו נזנחים אחרי STOP_TIMEOUT.
+                # המאגרים נסגרים רק אחרי שה-workers סיימו, ומי שעדיין לא סיים בזמן
+                # כותב לחיבור סגור שמתעלם מהכתיבה
                 self.download_thread.stop()
-                self.download_thread.wait()
+                self.download_thread.wait(SHUTDOWN_WAIT_MS)
+                self.download_thread.engine.wait_stopped(SHUTDOWN_WAIT_MS / 1000)
+                self.close_stores()
                 event.accept()
             else:
                 event.ignore()
         else:
+            self.close_stores()
             event.accept()
+    
+    def close_stores(self):
+        self.tool_discovery.wait(SHUTDOWN_WAIT_MS)
+        self.sync_timer.stop()
+        if self.sync_thread is not None:
+            self.sync_thread.requestInterruption()
+            self.sync_thread.wait(SHUTDOWN_WAIT_MS)
+        self.queue_model.close()
+        self.media_cache.close()
+        self.ydl_pool.close()
+        self.queue.close()
+        self.expansion_cache.close()
+        self.subscriptions.close()
+        self.metrics.close()
+        for store in self.output_stores.values():
+            store.close()
 
 
 if __name__ == "__main__":
+    # תהליכי העבודה של MetadataFetcher בגרסה הארוזה
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setLayoutDirection(Qt.RightToLeft)
     app.setStyle("Fusion")
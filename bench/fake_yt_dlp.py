@@ -0,0 +1,271 @@
+"""A local stand-in for the yt-dlp executable, for benchmarks and offline checks.
+
+It understands the arguments Replica passes (-o, --progress-template, --newline,
+--limit-rate, --concurrent-fragments, --downloader-args aria2c:-xN, -J,
+--flat-playlist with --download-archive/--break-on-existing, --playlist-items 1:N
+and --break-match-filters "upload_date >=? D", -P home:/temp:,
+--print-to-file after_move:%(.{fields})j FILE, --version) and prints output shaped like
+yt-dlp's. With "-o -" the media goes to stdout and all messages to stderr, as
+yt-dlp does. Behaviour is taken from the query string of the URL, so every item of
+a batch can behave differently, with REPLICA_FAKE_<NAME> environment variables
+as defaults:
+
+    https://fake.test/watch?v=abc&size=5000000&rate=2000000&fail=transient
+
+    size          bytes to "download" (default 1000000)
+    rate          bytes per second, 0 = as fast as possible (default 0)
+    steps         progress lines (default 10)
+    fail          none | transient | ratelimit | permanent | flaky:N (fails the first N runs)
+    stdout_lines  extra yt-dlp-like lines on stdout (default 0)
+    stderr_lines  WARNING lines on stderr (default 0)
+    pp            seconds of fake ffmpeg post-processing (default 0)
+    write         1 = create the output file, as a sparse file of `size` bytes (default 1)
+    child         1 = start a grandchild process, like ffmpeg/aria2c (default 0)
+    entries       number of videos for --flat-playlist, newest first; entry N was
+                  uploaded N days after 2026-01-01 (default 5)
+    fragments     DASH/HLS fragments; the download then takes one round of `latency`
+                  per batch of concurrently fetched fragments (default 0 = one file)
+    latency       seconds per fragment request (default 0)
+
+Use it by putting [sys.executable, "bench/fake_yt_dlp.py"] where the format
+option has "yt-dlp".
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit, parse_qs
+
+VERSION = "2099.01.01"
+DEFAULTS = {
+    "size": "1000000", "rate": "0", "steps": "10", "fail": "none", "stdout_lines": "0",
+    "stderr_lines": "0", "pp": "0", "write": "1", "child": "0", "entries": "5", "fragments": "0",
+    "latency": "0",
+}
+FAILURES = {
+    "transient": "ERROR: unable to download video data: HTTP Error 503: Service Unavailable",
+    "ratelimit": "ERROR: unable to download video data: HTTP Error 429: Too Many Requests",
+    "permanent": "ERROR: [youtube] {id}: Video unavailable",
+}
+FIRST_UPLOAD = datetime.date(2026, 1, 1)
+DATE_FILTER_RE = re.compile(r"^upload_date\s*>=\??\s*(\d{8})$")
+TEMPLATE_RE = re.compile(r"%\((?:(progress|info)\.)?([\w.]+)\)([sdj])")
+RATE_RE = re.compile(r"^(\d+(?:\.\d+)?)([kKmMgG]?)")
+ARIA2C_RE = re.compile(r"-x\s*(\d+)")
+FIELDS_TEMPLATE_RE = re.compile(r"^%\(\.\{([\w,]+)\}\)j$")
+
+
+def option(args, name, default=None):
+    return args[args.index(name) + 1] if name in args[:-1] else default
+
+
+def options(args, name):
+    return [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+
+
+def parse_rate(text):
+    match = RATE_RE.match(text or "")
+    if not match:
+        return 0
+    return float(match.group(1)) * 1024 ** " kmg".index(match.group(2).lower() or " ")
+
+
+def fragment_concurrency(args):
+    concurrency = int(option(args, "--concurrent-fragments", option(args, "-N", "1")))
+    downloader_args = option(args, "--downloader-args", "")
+    match = ARIA2C_RE.search(downloader_args) if downloader_args.startswith("aria2c:") else None
+    return max(concurrency, int(match.group(1)) if match else 1)
+
+
+def settings_for(url):
+    query = {key: values[-1] for key, values in parse_qs(urlsplit(url).query).items()}
+    settings = {name: query.get(name, os.environ.get(f"REPLICA_FAKE_{name.upper()}", default))
+                for name, default in DEFAULTS.items()}
+    settings["id"] = query.get("v") or hashlib.sha1(url.encode("utf-8")).hexdigest()[:11]
+    settings["title"] = query.get("title", f"fake {settings['id']}")
+    return settings
+
+
+def render(template, values):
+    def replace(match):
+        value = values.get(match.group(2))
+        return "NA" if value is None else str(value)
+    return TEMPLATE_RE.sub(replace, template)
+
+
+def info_dict(url, settings):
+    size = int(settings["size"])
+    return {
+        "id": settings["id"], "title": settings["title"], "webpage_url": url, "duration": 212,
+        "extractor": "fake", "ext": "mp4", "format_id": "18", "filesize": size,
+        "thumbnails": [], "formats": [{"format_id": "18", "ext": "mp4", "url": url, "filesize": size,
+                                       "protocol": "https", "vcodec": "avc1", "acodec": "mp4a", "height": 360}],
+    }
+
+
+def failed_runs(url, limit):
+    # מונה הרצות לכל קישור, עבור flaky:N
+    state = os.path.join(os.environ.get("REPLICA_FAKE_STATE", tempfile.gettempdir()),
+                         "replica-fake-" + hashlib.sha1(url.encode("utf-8")).hexdigest())
+    try:
+        with open(state) as f:
+            runs = int(f.read() or 0)
+    except (OSError, ValueError):
+        runs = 0
+    with open(state, "w") as f:
+        f.write(str(runs + 1))
+    return runs < limit
+
+
+def flat_playlist(args, url, settings):
+    known = set()
+    archive = option(args, "--download-archive")
+    if archive:
+        with open(archive, encoding="utf-8") as f:
+            known = {line.strip() for line in f}
+    items = option(args, "--playlist-items", "")
+    limit = int(items.split(":")[1]) if items.startswith("1:") else None
+    match = DATE_FILTER_RE.match(option(args, "--break-match-filters", ""))
+    date_after = match.group(1) if match else None
+    for count, i in enumerate(range(int(settings["entries"]), 0, -1)):
+        if limit is not None and count >= limit:
+            break
+        video_id = f"{settings['id'][:6]}{i:05d}"
+        upload_date = (FIRST_UPLOAD + datetime.timedelta(days=i)).strftime("%Y%m%d")
+        if date_after and upload_date < date_after:
+            return 101
+        if f"youtube {video_id}" in known and "--break-on-existing" in args:
+            return 101
+        print(json.dumps({"_type": "url", "ie_key": "Youtube", "id": video_id, "title": f"entry {i}",
+                          "upload_date": upload_date, "url": f"https://fake.test/watch?v={video_id}"}),
+              flush=True)
+    return 0
+
+
+def download(args, url, settings):
+    streaming = option(args, "-o") == "-"
+    out = sys.stderr if streaming else sys.stdout
+    size = int(settings["size"])
+    steps = max(int(settings["steps"]), 1)
+    latency = float(settings["latency"])
+    fragments = int(settings["fragments"])
+    if fragments:
+        # כל סבב מביא עד concurrency מקטעים, ועולה latency אחד
+        steps = -(-fragments // fragment_concurrency(args))
+    rate = float(settings["rate"])
+    limit = parse_rate(option(args, "--limit-rate"))
+    if limit:
+        rate = min(rate, limit) if rate else limit
+    template = option(args, "--progress-template")
+    if template and template.startswith("download:"):
+        template = template[len("download:"):]
+    fields = {"title": settings["title"], "ext": "mp4", "id": settings["id"],
+              "extractor_key": "Youtube" if "youtube" in urlsplit(url).netloc else "Fake"}
+    filename = render(option(args, "-o", "%(title)s.%(ext)s"), fields)
+    # כמו ב-yt-dlp: עם -P home:/temp: ההורדה נכתבת ב-temp ומועברת ל-home בסיום
+    paths = dict(path.split(":", 1) for path in options(args, "-P") if ":" in path)
+    final = os.path.join(paths.get("home", ""), filename)
+    filename = os.path.join(paths.get("temp", paths.get("home", "")), filename)
+    fields["filepath"] = os.path.abspath(final)
+
+    if settings["child"] == "1":
+        subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3600)"])
+
+    print(f"[fake] Extracting URL: {url}", file=out)
+    print(f"[fake] {settings['id']}: Downloading webpage", file=out)
+    for i in range(int(settings["stdout_lines"])):
+        print(f"[fake] {settings['id']}: Downloading fragment {i} (noise line)", file=out)
+    stderr_lines = int(settings["stderr_lines"])
+    for i in range(stderr_lines):
+        print(f"WARNING: [fake] {settings['id']}: noisy warning {i}", file=sys.stderr)
+    print(f"[info] {settings['id']}: Downloading 1 format(s): 18", file=out)
+    print(f"[download] Destination: {filename}", file=out, flush=True)
+
+    if settings["fail"] in FAILURES or (settings["fail"].startswith("flaky:")
+                                        and failed_runs(url, int(settings["fail"].split(":")[1]))):
+        message = FAILURES.get(settings["fail"], FAILURES["transient"])
+        print(message.format(id=settings["id"]), file=sys.stderr, flush=True)
+        return 1
+
+    if not streaming and os.path.exists(final):
+        print(f"[download] {final} has already been downloaded", file=out, flush=True)
+        return after_move(args, fields)
+
+    part = filename + ".part"
+    if streaming:
+        block = bytes(min(max(size // steps, 1), 1024 * 1024))
+    elif settings["write"] == "1":
+        os.makedirs(os.path.dirname(os.path.abspath(part)), exist_ok=True)
+        with open(part, "wb") as f:
+            f.truncate(size)
+    start = time.monotonic()
+    for step in range(steps + 1):
+        downloaded = size * step // steps
+        elapsed = time.monotonic() - start
+        speed = downloaded / elapsed if elapsed > 0 else None
+        eta = int((size - downloaded) / rate) if rate else 0
+        if streaming and step:
+            chunk = size * step // steps - size * (step - 1) // steps
+            while chunk > 0:
+                written = sys.stdout.buffer.write(block[:chunk])
+                chunk -= written
+            sys.stdout.buffer.flush()
+        values = {"downloaded_bytes": downloaded, "total_bytes": size, "total_bytes_estimate": None,
+                  "speed": speed, "eta": eta, "filename": part, "id": settings["id"], "ext": "mp4",
+                  "title": settings["title"]}
+        if template:
+            print(render(template, values), file=out, flush=True)
+        else:
+            print(f"[download] {downloaded * 100 / size:5.1f}% of {size}B", file=out, flush=True)
+        if step < steps and (rate or latency):
+            time.sleep((size / steps / rate if rate else 0) + latency)
+    if settings["write"] == "1" and not streaming:
+        os.replace(part, filename)
+        if filename != final:
+            print(f'[MoveFiles] Moving file "{filename}" to "{final}"', file=out, flush=True)
+            os.makedirs(os.path.dirname(os.path.abspath(final)), exist_ok=True)
+            os.replace(filename, final)
+
+    pp = float(settings["pp"])
+    if pp:
+        print(f'[Merger] Merging formats into "{filename}"', file=out, flush=True)
+        time.sleep(pp)
+    return after_move(args, fields)
+
+
+def after_move(args, fields):
+    # --print-to-file after_move:%(.{a,b})j FILE
+    values = options(args, "--print-to-file")
+    index = args.index("--print-to-file") if values else -1
+    if index >= 0 and index + 2 < len(args) and args[index + 1].startswith("after_move:"):
+        match = FIELDS_TEMPLATE_RE.match(args[index + 1][len("after_move:"):])
+        if match:
+            with open(args[index + 2], "a", encoding="utf-8") as f:
+                f.write(json.dumps({name: fields.get(name) for name in match.group(1).split(",")}) + "\n")
+    return 0
+
+
+def main(args):
+    if "--version" in args:
+        print(VERSION)
+        return 0
+    url = args[-1] if args else ""
+    settings = settings_for(url)
+    if "--flat-playlist" in args:
+        return flat_playlist(args, url, settings)
+    if "-J" in args or "--dump-single-json" in args:
+        if settings["fail"] == "permanent":
+            print(FAILURES["permanent"].format(id=settings["id"]), file=sys.stderr)
+            return 1
+        print(json.dumps(info_dict(url, settings)))
+        return 0
+    return download(args, url, settings)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
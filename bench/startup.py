@@ -0,0 +1,83 @@
+"""Startup time of Replica: time until the main window is painted, and import
+time of headless mode. Each run is a fresh interpreter with an empty settings
+folder, so no resume prompt or cached state is involved.
+
+    python bench/startup.py --runs 5 --max-seconds 1.5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GUI_CHILD = """
+import os, sys
+sys.path.insert(0, {repo!r})
+from PySide6.QtWidgets import QApplication
+from PySide6.QtCore import QTimer
+app = QApplication(sys.argv)
+import Replica
+window = Replica.MainWindow()
+window.show()
+def ready():
+    print("ready", "yt_dlp" in sys.modules, flush=True)
+    os._exit(0)
+QTimer.singleShot(0, ready)
+app.exec()
+"""
+
+HEADLESS_CHILD = """
+import sys
+sys.path.insert(0, {repo!r})
+import replica_cli
+print("ready", "PySide6" in sys.modules, flush=True)
+"""
+
+
+def measure(child, env):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", child.format(repo=REPO_DIR)], env=env,
+                            capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - start
+    words = result.stdout.split()
+    if result.returncode != 0 or not words or words[0] != "ready":
+        raise RuntimeError(result.stderr.strip() or "child did not start")
+    return elapsed, words[1] == "True"
+
+
+def run(name, child, runs, leaked_module):
+    times = []
+    leaked = False
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as home:
+            env = dict(os.environ, HOME=home, APPDATA=home, QT_QPA_PLATFORM="offscreen")
+            elapsed, loaded = measure(child, env)
+        times.append(elapsed)
+        leaked = leaked or loaded
+    median = statistics.median(times)
+    print(f"{name:9} median {median:.3f}s  min {min(times):.3f}s  max {max(times):.3f}s"
+          + (f"  ({leaked_module} imported at startup!)" if leaked else ""))
+    return median, leaked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, help="fail if the GUI median exceeds this")
+    parser.add_argument("--skip-gui", action="store_true", help="only measure headless mode")
+    args = parser.parse_args(argv)
+
+    ok = True
+    if not args.skip_gui:
+        median, leaked = run("gui", GUI_CHILD, args.runs, "yt_dlp")
+        ok = not leaked and (args.max_seconds is None or median <= args.max_seconds)
+    _, leaked = run("headless", HEADLESS_CHILD, args.runs, "PySide6")
+    return 0 if ok and not leaked else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
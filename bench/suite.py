@@ -0,0 +1,318 @@
+"""Offline benchmarks of the download pipeline, driven by bench/fake_yt_dlp.py.
+
+    python bench/suite.py                      # all scenarios
+    python bench/suite.py throughput cancel --quick
+    python bench/suite.py --json now.json --baseline before.json
+
+Scenarios:
+    throughput   items/second through DownloadEngine (spawn, line streaming, parsing)
+    gui_latency  lateness of a 10 ms GUI-thread timer while MainWindow shows heavy console output
+    memory       RSS growth of the process over a long batch (10k items, 1k with --quick)
+    cancel       time from stop()/cancel_item() until the engine reports back
+    fragments    items/second of latency-bound fragmented (DASH/HLS) downloads with the
+                 default format options vs. profiles with parallel fragments / aria2c,
+                 and the peak number of connections under the connection budget
+
+With --baseline, the exit code is 1 when a metric got worse by more than
+--tolerance (default 25%).
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_YT_DLP = os.path.join(REPO_DIR, "bench", "fake_yt_dlp.py")
+sys.path.insert(0, REPO_DIR)
+
+# תיקיית הגדרות ריקה, לפני ש-replica_engine קובע את APP_DATA_DIR: התור, הארכיון
+# וההגדרות של המשתמש לא נוגעים במדידה ולא נפגעים ממנה
+BENCH_HOME = tempfile.mkdtemp(prefix="replica-bench-")
+os.environ["HOME"] = os.environ["APPDATA"] = BENCH_HOME
+
+from replica_engine import (  # noqa: E402
+    DownloadEngine, DownloadQueue, EngineListener, QueueItem, CONFIG_FILE, save_config, format_option_for,
+    DEFAULT_MAX_CONNECTIONS
+)
+
+# (שם, True אם ערך גבוה יותר טוב)
+METRICS = {
+    "throughput.items_per_second": True,
+    "throughput.items_per_second_cli": True,
+    "gui_latency.p50_ms": False,
+    "gui_latency.p95_ms": False,
+    "gui_latency.max_ms": False,
+    "memory.growth_mb_per_1k": False,
+    "cancel.stop_ms": False,
+    "cancel.item_ms": False,
+    "fragments.items_per_second_default": True,
+    "fragments.items_per_second_fragments": True,
+    "fragments.items_per_second_aria2c": True,
+}
+FRAGMENT_PROFILES = {
+    "fragments": {"fragments": 8},
+    "aria2c": {"downloader": "aria2c", "connections": 8},
+}
+
+
+class BenchListener(EngineListener):
+    def __init__(self):
+        self.finished_items = 0
+        self.progress = {}
+        self.item_done = {}
+        self.console_bytes = 0
+
+    def console(self, chunk):
+        self.console_bytes += len(chunk)
+
+    def item_progress(self, event):
+        self.progress[event.index] = event
+
+    def item_finished(self, index, ok):
+        self.finished_items += 1
+        self.item_done[index] = time.perf_counter()
+
+
+def fake_option():
+    return [sys.executable, FAKE_YT_DLP]
+
+
+def fake_items(count, first_id=1, **settings):
+    query = "&".join(f"{key}={value}" for key, value in settings.items())
+    return [QueueItem(first_id + i, f"https://fake{i % 4}.test/watch?v=v{i:07d}&{query}", fake_option(), None, 0)
+            for i in range(count)]
+
+
+def make_engine(items, save_directory, listener, workers, show_cli=False, queue=None, **kwargs):
+    return DownloadEngine(items, save_directory, show_cli, workers, workers, None, queue, None, None, 0,
+                          listener=listener, **kwargs)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
+
+def bench_throughput(args, workdir):
+    results = {}
+    count = 50 if args.quick else 200
+    for key, show_cli in (("items_per_second", False), ("items_per_second_cli", True)):
+        listener = BenchListener()
+        engine = make_engine(fake_items(count, write=0, stdout_lines=20), workdir, listener, args.workers, show_cli)
+        start = time.perf_counter()
+        engine.run()
+        elapsed = time.perf_counter() - start
+        assert listener.finished_items == count, "not all items finished"
+        results[key] = count / elapsed
+    return results
+
+
+def bench_gui_latency(args, workdir):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from PySide6.QtCore import QTimer, QElapsedTimer
+    import Replica
+
+    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+    save_config({"show_cli": True, "in_process": False, "use_archive": False, "save_dir": workdir,
+                 "max_workers": args.workers, "max_per_host": args.workers})
+    app = QApplication.instance() or QApplication(sys.argv)
+    # איתור הכלים מייבא את yt_dlp בתהליך; הוא לא חלק מהמדידה
+    Replica.TOOL_DISCOVERY_DELAY_MS = 3600 * 1000
+    # הודעת הסיום מודאלית ותחסום את הלולאה
+    Replica.QMessageBox.information = Replica.QMessageBox.critical = staticmethod(lambda *args: None)
+    window = Replica.MainWindow()
+    window.show()
+    # offer_resume רץ בסיבוב הראשון של לולאת האירועים, לפני שיש פריטים בתור
+    app.processEvents()
+
+    count = 10 if args.quick else 40
+    items = window.queue.add([item.url for item in fake_items(count, write=0, steps=200, stdout_lines=2000,
+                                                               stderr_lines=200)], fake_option())
+    lateness = []
+    interval = 10
+    clock = QElapsedTimer()
+    timer = QTimer()
+    timer.setInterval(interval)
+
+    def tick():
+        lateness.append(max(clock.restart() - interval, 0))
+
+    timer.timeout.connect(tick)
+    window.run_items(items)
+    clock.start()
+    timer.start()
+    while window.download_thread.isRunning():
+        app.processEvents()
+        time.sleep(0.001)
+    timer.stop()
+    app.processEvents()
+    window.close_stores()
+
+    lateness.sort()
+    return {
+        "p50_ms": statistics.median(lateness),
+        "p95_ms": lateness[int(len(lateness) * 0.95)],
+        "max_ms": lateness[-1],
+    }
+
+
+def bench_memory(args, workdir):
+    count = 1000 if args.quick else 10000
+    queue = DownloadQueue(os.path.join(workdir, "memory.db"))
+    items = queue.add([item.url for item in fake_items(count, write=0, steps=4)], fake_option())
+    listener = BenchListener()
+    engine = make_engine(items, workdir, listener, args.workers, True, queue)
+    samples = []
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.5):
+            samples.append((listener.finished_items, rss_bytes()))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    start_rss = rss_bytes()
+    sampler.start()
+    engine.run()
+    done.set()
+    sampler.join()
+    queue.close()
+    end_rss = rss_bytes()
+    if start_rss is None:
+        return {}
+    # הצמיחה נמדדת מהאלף הראשון, אחרי שהמטמונים וה-threads התייצבו
+    warm = [rss for finished, rss in samples if finished >= min(1000, count // 10)]
+    baseline = warm[0] if warm else start_rss
+    return {
+        "start_mb": start_rss / 2 ** 20,
+        "peak_mb": max([rss for _, rss in samples] + [end_rss]) / 2 ** 20,
+        "end_mb": end_rss / 2 ** 20,
+        "growth_mb_per_1k": (end_rss - baseline) / 2 ** 20 / (count / 1000),
+    }
+
+
+def bench_cancel(args, workdir):
+    results = {}
+    listener = BenchListener()
+    items = fake_items(args.workers, rate=100000, size=10 ** 9, child=1)
+    engine = make_engine(items, workdir, listener, args.workers)
+    runner = threading.Thread(target=engine.run)
+    runner.start()
+    while len(listener.progress) < args.workers:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    engine.cancel_item(items[0].id)
+    while 1 not in listener.item_done:
+        time.sleep(0.001)
+    results["item_ms"] = (listener.item_done[1] - start) * 1000
+    start = time.perf_counter()
+    engine.stop()
+    runner.join()
+    results["stop_ms"] = (time.perf_counter() - start) * 1000
+    return results
+
+
+def bench_fragments(args, workdir):
+    # "yt-dlp" של אפשרויות הפורמט מוחלף ב-fake; השאר זהה למה שהחלון הראשי בונה
+    results = {}
+    count = args.workers if args.quick else args.workers * 2
+    peak = 0
+    for name in ("default", *FRAGMENT_PROFILES):
+        option = format_option_for("mp4" if name == "default" else name, profiles=FRAGMENT_PROFILES)
+        items = [item._replace(format_option=fake_option() + option[1:])
+                 for item in fake_items(count, write=0, fragments=64, latency=0.05)]
+        listener = BenchListener()
+        engine = make_engine(items, workdir, listener, args.workers, max_connections=DEFAULT_MAX_CONNECTIONS)
+        done = threading.Event()
+
+        def sample():
+            nonlocal peak
+            while not done.wait(0.005):
+                peak = max(peak, engine.scheduler._connections)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        engine.run()
+        elapsed = time.perf_counter() - start
+        done.set()
+        sampler.join()
+        assert listener.finished_items == count, "not all items finished"
+        results[f"items_per_second_{name}"] = count / elapsed
+    results["peak_connections"] = peak
+    return results
+
+
+SCENARIOS = {
+    "throughput": bench_throughput,
+    "gui_latency": bench_gui_latency,
+    "memory": bench_memory,
+    "cancel": bench_cancel,
+    "fragments": bench_fragments,
+}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, higher_is_better in METRICS.items():
+        if name not in results or name not in baseline or not baseline[name]:
+            continue
+        change = (results[name] - baseline[name]) / baseline[name]
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {baseline[name]:.2f} -> {results[name]:.2f} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--quick", action="store_true", help="smaller batches")
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {}
+    try:
+        for name in args.scenarios or list(SCENARIOS):
+            with tempfile.TemporaryDirectory() as workdir:
+                os.environ["REPLICA_FAKE_STATE"] = workdir
+                metrics = SCENARIOS[name](args, workdir)
+            for key, value in metrics.items():
+                results[f"{name}.{key}"] = value
+                print(f"{name + '.' + key:36} {value:10.2f}", flush=True)
+    finally:
+        shutil.rmtree(BENCH_HOME, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
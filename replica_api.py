@@ -0,0 +1,532 @@
+import hmac
+import ipaddress
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+
+from replica_engine import (
+    JsonLinesListener, format_option_for, profile_names, collect_links, DEFAULT_SYNC_INTERVAL,
+    DownloadQueue, QueueItem, LEASE_SECONDS, PENDING, RUNNING, DONE, FAILED, CANCELLED
+)
+
+DEFAULT_API_HOST = "127.0.0.1"
+DEFAULT_API_PORT = 8765
+SUBSCRIBER_QUEUE_SIZE = 1000
+SSE_KEEPALIVE = 15.0
+REMOTE_TIMEOUT = 30.0
+# השדות של הדיווח של worker (QueueWorker.status) והסוגים שלהם; כל שדה אחר נזרק
+WORKER_STATUS_FIELDS = {
+    "state": str, "host": str, "pid": int, "started": (int, float), "capacity": int, "outstanding": int,
+    "successful": int, "failed": int, "skipped": int, "retries": int, "active": list, "speed": (int, float),
+}
+
+
+def subscription_payload(subscription):
+    # רשימת ה-id שנראו עלולה להיות ארוכה; מספיק לדעת כמה יש
+    payload = subscription._asdict()
+    payload["seen"] = len(subscription.seen)
+    return payload
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class EventBroker(JsonLinesListener):
+    # מפיץ כל אירוע של המנוע לכל מנויי ה-SSE. מנוי איטי שהתור שלו מלא מאבד
+    # אירועים במקום לעכב את ה-workers.
+    def __init__(self, out=None, console_out=None):
+        super().__init__(out, console_out)
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self.echo = out is not None
+
+    def write(self, event, **fields):
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(fields)
+            except queue.Full:
+                pass
+        if self.echo:
+            with self._lock:
+                self.out.write(json.dumps(fields, ensure_ascii=False) + "\n")
+                self.out.flush()
+
+    def subscribe(self):
+        subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._subscribers_lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._subscribers_lock:
+            self._subscribers.discard(subscriber)
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # engine הוא None ב-coordinator: הוא רק מחזיק את התור המשותף, וה-workers
+    # חוכרים ממנו פריטים ומורידים אותם
+    def __init__(self, engine, broker, host=DEFAULT_API_HOST, port=DEFAULT_API_PORT, token=None,
+                 no_check_certificate=False, profiles=None, subscriptions=None, queue=None):
+        if not token and not is_loopback(host):
+            # בלי token כל מחשב ברשת יכול להוסיף, לבטל ולשכתב פריטים בתור
+            raise ValueError(f"an API token is required to listen on {host}")
+        super().__init__((host, port), ApiHandler)
+        self.engine = engine
+        self.queue = queue if queue is not None else engine.queue
+        self.broker = broker
+        self.token = token
+        self.no_check_certificate = no_check_certificate
+        self.profiles = profiles or {}
+        self.subscriptions = subscriptions
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    server_version = "ReplicaAPI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_text(self, status, text, content_type="text/plain; version=0.0.4; charset=utf-8"):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        token = self.server.token
+        header = self.headers.get("Authorization", "")
+        if not token or hmac.compare_digest(header.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self.send_json(401, {"error": "unauthorized"})
+        return False
+
+    def route(self):
+        parts = urlsplit(self.path)
+        segments = [segment for segment in parts.path.split("/") if segment]
+        return segments, parse_qs(parts.query)
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        segments, query = self.route()
+        queue_store = self.server.queue
+        if segments == ["jobs"]:
+            state = query.get("state", [None])[0]
+            try:
+                limit = int(query.get("limit", ["500"])[0])
+                offset = int(query.get("offset", ["0"])[0])
+            except ValueError:
+                self.send_json(400, {"error": "limit and offset must be integers"})
+                return
+            self.send_json(200, {
+                "items": queue_store.list_items(state, limit, offset),
+                "counts": queue_store.counts(),
+            })
+        elif len(segments) == 2 and segments[0] == "jobs" and segments[1].isdigit():
+            item = queue_store.get(int(segments[1]))
+            if item is not None:
+                self.send_json(200, item)
+            else:
+                self.send_json(404, {"error": "not found"})
+        elif segments == ["stats"]:
+            engine = self.server.engine
+            if engine is None:
+                self.send_json(200, cluster_stats(queue_store))
+                return
+            self.send_json(200, {
+                "successful": engine.successful,
+                "failed": engine.failed,
+                "skipped": engine.skipped,
+                "retries": engine.retries,
+                "total": len(engine.items),
+                "stages": {stage: round(seconds, 3) for stage, seconds in engine.stage_totals.items()},
+                "metrics": engine.metrics.snapshot() if engine.metrics is not None else None,
+            })
+        elif segments == ["workers"]:
+            self.send_json(200, {"workers": queue_store.workers(), "counts": queue_store.counts()})
+        elif segments == ["metrics"]:
+            engine = self.server.engine
+            if engine is not None and engine.metrics is not None:
+                self.send_text(200, engine.metrics.prometheus())
+            else:
+                self.send_json(404, {"error": "metrics are disabled"})
+        elif segments == ["subscriptions"]:
+            if self.server.subscriptions is None:
+                self.send_json(404, {"error": "subscriptions are disabled"})
+                return
+            store = self.server.subscriptions.syncer.store
+            self.send_json(200, {"subscriptions": [subscription_payload(sub) for sub in store.all()]})
+        elif segments == ["events"]:
+            self.stream_events()
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        segments, _ = self.route()
+        # הנתיבים של ה-workers קיימים רק ב-coordinator. עם --serve התור שייך למנוע המקומי,
+        # ולקוח שחוכר או משנה בו פריטים היה מתנגש בהורדות שהמנוע מריץ
+        worker_route = self.server.engine is None and (
+            segments[:1] in (["leases"], ["workers"])
+            or (len(segments) == 3 and segments[0] == "jobs" and segments[1].isdigit()))
+        if segments not in (["jobs"], ["subscriptions"], ["subscriptions", "sync"]) and not worker_route:
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "invalid JSON"})
+            return
+        if not isinstance(payload, dict):
+            self.send_json(400, {"error": "expected a JSON object"})
+            return
+        if segments[0] == "subscriptions":
+            self.post_subscription(segments, payload)
+            return
+        if worker_route:
+            try:
+                self.post_worker(segments, payload)
+            except (KeyError, TypeError, ValueError):
+                self.send_json(400, {"error": "invalid worker request"})
+            return
+        urls = payload.get("urls")
+        if isinstance(urls, str):
+            urls = [urls]
+        kind = payload.get("format", "mp4")
+        kinds = profile_names(self.server.profiles)
+        if (not isinstance(urls, list) or not all(isinstance(url, str) for url in urls)
+                or not isinstance(kind, str) or kind not in kinds):
+            self.send_json(400, {"error": "expected {\"urls\": [...], \"format\": one of %s}" % kinds})
+            return
+
+        result = collect_links(urls)
+        engine = self.server.engine
+        no_check_certificate = payload.get("no_check_certificate", self.server.no_check_certificate)
+        items = self.server.queue.add(result.urls, format_option_for(kind, no_check_certificate, self.server.profiles))
+        if engine is not None:
+            # הרחבת פלייליסטים עלולה לקחת זמן, ולכן התשובה לא מחכה לה
+            threading.Thread(target=engine.submit, args=(items,), daemon=True).start()
+        self.send_json(202, {
+            "ids": [item.id for item in items],
+            "accepted": result.accepted,
+            "duplicates": result.duplicates,
+            "invalid": result.invalid,
+        })
+
+    def post_worker(self, segments, payload):
+        # הפרוטוקול של RemoteQueue: כל קריאה היא מתודה של DownloadQueue על התור המשותף
+        queue_store = self.server.queue
+        if segments[0] == "workers" and len(segments) == 2:
+            name = unquote(segments[1])
+            status = worker_status(payload)
+            queue_store.report(name, status)
+            self.server.broker.write("worker", name=name, status=status)
+            self.send_json(200, {"reported": True})
+            return
+        worker = str(payload["worker"])
+        lease = float(payload.get("lease", LEASE_SECONDS))
+        if segments == ["leases"]:
+            items = queue_store.claim(worker, int(payload["limit"]), lease)
+            self.send_json(200, {"items": [item._asdict() for item in items]})
+        elif segments == ["leases", "heartbeat"]:
+            ids = payload["ids"]
+            if not isinstance(ids, list):
+                raise TypeError("ids must be a list")
+            active, lost = queue_store.heartbeat(worker, [int(item_id) for item_id in ids], lease)
+            self.send_json(200, {"active": active, "lost": lost})
+        elif segments == ["leases", "release"]:
+            queue_store.release(worker)
+            self.send_json(200, {"released": True})
+        elif segments[0] == "jobs" and segments[2] == "expand":
+            item = queue_store.item(int(segments[1]))
+            if item is None:
+                self.send_json(404, {"error": "not found"})
+                return
+            urls = payload["urls"]
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                raise TypeError("urls must be a list of strings")
+            children = queue_store.expand(item, urls, worker)
+            self.send_json(200, {"items": [child._asdict() for child in children]})
+        elif segments[0] == "jobs" and segments[2] == "state":
+            item_id = int(segments[1])
+            state = payload["state"]
+            if state == RUNNING:
+                queue_store.mark_running(item_id, payload.get("output_template"), worker)
+            elif state == PENDING:
+                queue_store.mark_pending(item_id, payload.get("error"), worker)
+            elif state == DONE:
+                queue_store.mark_done(item_id, worker)
+            elif state == FAILED:
+                queue_store.mark_failed(item_id, payload.get("error"), worker)
+            elif state == CANCELLED:
+                queue_store.mark_cancelled(item_id, worker)
+            else:
+                raise ValueError(state)
+            self.send_json(200, {"state": state})
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def post_subscription(self, segments, payload):
+        scheduler = self.server.subscriptions
+        if scheduler is None:
+            self.send_json(404, {"error": "subscriptions are disabled"})
+            return
+        store = scheduler.syncer.store
+        if segments == ["subscriptions", "sync"]:
+            subscription_id = payload.get("id")
+            if subscription_id is not None and (not isinstance(subscription_id, int)
+                                                or isinstance(subscription_id, bool)):
+                self.send_json(400, {"error": "expected {\"id\": N} or {}"})
+                return
+            store.mark_due(subscription_id)
+            scheduler.wake()
+            self.send_json(202, {"syncing": True})
+            return
+        url = payload.get("url")
+        kind = payload.get("format", "mp4")
+        kinds = profile_names(self.server.profiles)
+        if not isinstance(kind, str):
+            kind = None
+        try:
+            interval = float(payload.get("interval_hours", DEFAULT_SYNC_INTERVAL / 3600)) * 3600
+            backfill = int(payload.get("backfill", 0))
+        except (TypeError, ValueError):
+            interval = backfill = None
+        if not isinstance(url, str) or kind not in kinds or interval is None or interval <= 0:
+            self.send_json(400, {"error": "expected {\"url\": ..., \"format\": one of %s,"
+                                          " \"interval_hours\": > 0, \"backfill\": N}" % kinds})
+            return
+        no_check_certificate = payload.get("no_check_certificate", self.server.no_check_certificate)
+        subscription = store.add(url, format_option_for(kind, no_check_certificate, self.server.profiles),
+                                 interval, backfill)
+        if subscription is None:
+            self.send_json(400, {"error": "not a playlist or channel link"})
+            return
+        scheduler.wake()
+        self.send_json(201, subscription_payload(subscription))
+
+    def do_DELETE(self):
+        if not self.authorized():
+            return
+        segments, _ = self.route()
+        if (len(segments) == 2 and segments[0] == "subscriptions" and segments[1].isdigit()
+                and self.server.subscriptions is not None):
+            if self.server.subscriptions.syncer.store.remove(int(segments[1])):
+                self.send_json(200, {"removed": True})
+            else:
+                self.send_json(404, {"error": "not found"})
+            return
+        if len(segments) != 2 or segments[0] != "jobs" or not segments[1].isdigit():
+            self.send_json(404, {"error": "not found"})
+            return
+        if self.server.engine is None:
+            # ה-worker שמחזיק בפריט יראה ב-heartbeat הבא שהוא בוטל ויעצור אותו
+            item = self.server.queue.get(int(segments[1]))
+            if item is not None and item["state"] in (PENDING, RUNNING):
+                self.server.queue.mark_cancelled(item["id"])
+                self.send_json(200, {"cancelled": True})
+            else:
+                self.send_json(409, {"cancelled": False, "error": "item is not queued or running"})
+            return
+        if self.server.engine.cancel_item(int(segments[1])):
+            self.send_json(200, {"cancelled": True})
+        else:
+            self.send_json(409, {"cancelled": False, "error": "item is not queued or running"})
+
+    def stream_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        subscriber = self.server.broker.subscribe()
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    data = json.dumps(event, ensure_ascii=False)
+                    self.wfile.write(f"event: {event['event']}\ndata: {data}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.broker.unsubscribe(subscriber)
+
+
+def worker_status(payload):
+    # נבדק לפני שהדיווח נשמר, כדי שדיווח פגום יידחה בלי לשנות את התור
+    status = {}
+    for key, kind in WORKER_STATUS_FIELDS.items():
+        if key not in payload:
+            continue
+        value = payload[key]
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise TypeError(f"{key} must be {kind}")
+        if key == "active" and not all(isinstance(entry, dict) for entry in value):
+            raise TypeError("active must be a list of objects")
+        status[key] = value
+    return status
+
+
+def start_api_server(engine, broker, host=DEFAULT_API_HOST, port=DEFAULT_API_PORT, token=None,
+                     no_check_certificate=False, profiles=None, subscriptions=None, queue=None):
+    server = ApiServer(engine, broker, host, port, token, no_check_certificate, profiles, subscriptions, queue)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def cluster_stats(queue_store):
+    # התצוגה המרוכזת של כל ה-workers: המונים של כל אחד מהם מאז שעלה, והמהירות
+    # הכוללת של מי שעדיין חי
+    workers = queue_store.workers()
+    alive = [worker for worker in workers if worker["alive"]]
+    counts = queue_store.counts()
+    return {
+        "successful": sum(worker.get("successful", 0) for worker in workers),
+        "failed": sum(worker.get("failed", 0) for worker in workers),
+        "skipped": sum(worker.get("skipped", 0) for worker in workers),
+        "retries": sum(worker.get("retries", 0) for worker in workers),
+        "total": sum(counts.values()),
+        "counts": counts,
+        "workers": len(alive),
+        "active": sum(len(worker.get("active", ())) for worker in alive),
+        "speed": sum(worker.get("speed") or 0 for worker in alive),
+    }
+
+
+class RemoteQueue:
+    # אותו ממשק כמו DownloadQueue, מול coordinator ב-HTTP. עדכון מצב שלא הגיע
+    # (coordinator שהופעל מחדש, רשת) נשמר ונשלח שוב לפני ה-heartbeat הבא,
+    # כדי שהורדה שהסתיימה לא תחזור לתור כשהחכירה שלה תפוג.
+    def __init__(self, url, worker=None, token=None, timeout=REMOTE_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.worker = worker
+        self.token = token
+        self.timeout = timeout
+        self._outbox = []
+        self._lock = threading.Lock()
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method)
+        request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            raise OSError(f"{method} {path}: HTTP {e.code}") from e
+        except ValueError as e:
+            raise OSError(f"{method} {path}: {e}") from e
+
+    def _post_state(self, item_id, state, **fields):
+        path = f"/jobs/{item_id}/state"
+        payload = dict(fields, worker=self.worker, state=state)
+        try:
+            self._request("POST", path, payload)
+        except OSError:
+            with self._lock:
+                self._outbox.append((path, payload))
+
+    def _flush(self):
+        with self._lock:
+            outbox, self._outbox = self._outbox, []
+        for pos, (path, payload) in enumerate(outbox):
+            try:
+                self._request("POST", path, payload)
+            except OSError:
+                with self._lock:
+                    self._outbox[:0] = outbox[pos:]
+                raise
+
+    def add(self, urls, kind, no_check_certificate=False):
+        # בניגוד ל-DownloadQueue.add מקבל שם של פורמט, שה-coordinator מפרש לפי הפרופילים שלו
+        return self._request("POST", "/jobs", {"urls": list(urls), "format": kind,
+                                               "no_check_certificate": no_check_certificate})
+
+    def mark_running(self, item_id, output_template):
+        self._post_state(item_id, RUNNING, output_template=output_template)
+
+    def mark_pending(self, item_id, error):
+        self._post_state(item_id, PENDING, error=error)
+
+    def mark_done(self, item_id):
+        self._post_state(item_id, DONE)
+
+    def mark_failed(self, item_id, error):
+        self._post_state(item_id, FAILED, error=error)
+
+    def mark_cancelled(self, item_id):
+        self._post_state(item_id, CANCELLED)
+
+    def expand(self, item, urls):
+        result = self._request("POST", f"/jobs/{item.id}/expand", {"worker": self.worker, "urls": list(urls)})
+        return [QueueItem(**child) for child in result["items"]]
+
+    def claim(self, worker, limit, lease=LEASE_SECONDS):
+        result = self._request("POST", "/leases", {"worker": worker, "limit": limit, "lease": lease})
+        return [QueueItem(**item) for item in result["items"]]
+
+    def heartbeat(self, worker, item_ids, lease=LEASE_SECONDS):
+        self._flush()
+        result = self._request("POST", "/leases/heartbeat", {"worker": worker, "ids": list(item_ids), "lease": lease})
+        return result["active"], result["lost"]
+
+    def release(self, worker):
+        self._flush()
+        self._request("POST", "/leases/release", {"worker": worker})
+
+    def report(self, worker, status):
+        self._request("POST", f"/workers/{quote(worker, safe='')}", status)
+
+    def workers(self):
+        return self._request("GET", "/workers")["workers"]
+
+    def counts(self):
+        return self._request("GET", "/workers")["counts"]
+
+    def close(self):
+        try:
+            self._flush()
+        except OSError:
+            pass
+
+
+def open_worker_queue(spec, worker=None, token=None):
+    # http(s)://host:port הוא coordinator; כל דבר אחר הוא נתיב לקובץ SQLite משותף
+    if urlsplit(spec).scheme in ("http", "https"):
+        return RemoteQueue(spec, worker, token)
+    return DownloadQueue(spec, worker)
@@ -0,0 +1,372 @@
+import argparse
+import contextlib
+import itertools
+import os
+import signal
+import sqlite3
+import sys
+import threading
+
+from replica_engine import (
+    load_config, format_option_for, collect_links, iter_link_file, DownloadQueue,
+    DownloadArchive, ExpansionCache, PlaylistExpander, YoutubeDLPool, DownloadEngine,
+    JsonLinesListener, governor_from_config, validate_profiles, FormatProber, discover_tools, tools_summary,
+    MetricsRecorder, METRICS_FILE, stream_output_from_config, STREAM_SINKS, SubscriptionStore,
+    SubscriptionSyncer, SubscriptionScheduler, DEFAULT_SYNC_INTERVAL, output_store_from_config, OUTPUT_LAYOUTS,
+    DEFAULT_MAX_WORKERS, DEFAULT_MAX_PER_HOST, DEFAULT_MAX_RETRIES, DEFAULT_MAX_CONNECTIONS,
+    STOP_TIMEOUT, SHARED_QUEUE_FILE, LEASE_SECONDS, HEARTBEAT_INTERVAL, QueueWorker, default_worker_name
+)
+from replica_api import (
+    EventBroker, start_api_server, open_worker_queue, RemoteQueue, is_loopback, DEFAULT_API_HOST, DEFAULT_API_PORT
+)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="Replica.py --headless",
+        description="Replica headless mode: download a batch of links without the GUI."
+    )
+    parser.add_argument("--headless", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("urls", nargs="*", help="links to download")
+    parser.add_argument("-i", "--input", action="append", default=[],
+                        help="txt/CSV/JSONL file with links (may be repeated)")
+    parser.add_argument("-f", "--format", default="mp4",
+                        help="mp4, mp4-low, mp3 or the name of a profile from config.json (default: mp4)")
+    parser.add_argument("-o", "--output", help="save directory (default: from config.json)")
+    parser.add_argument("-w", "--workers", type=int, help="concurrent downloads")
+    parser.add_argument("--per-host", type=int, help="concurrent downloads per host")
+    parser.add_argument("--max-connections", type=int,
+                        help="connections shared by all downloads, counting parallel fragments and aria2c "
+                             f"connections of each (0 = unlimited, default {DEFAULT_MAX_CONNECTIONS})")
+    parser.add_argument("--retries", type=int, help="retries for transient failures")
+    parser.add_argument("--limit-rate", help="total download rate shared by all workers, e.g. 5M")
+    parser.add_argument("--max-postprocess", type=int, help="concurrent ffmpeg post-processing jobs (0 = one per CPU core)")
+    parser.add_argument("--schedule", action="append",
+                        help="time-of-day rule, e.g. 'mon-fri 09:00-18:00 rate=2M pp=1' (may be repeated)")
+    parser.add_argument("--probe-formats", action="store_true",
+                        help="check which format of the profile is reachable before downloading (cached per video)")
+    parser.add_argument("--no-check-certificate", action="store_true")
+    parser.add_argument("--no-archive", action="store_true", help="do not skip already downloaded videos")
+    parser.add_argument("--subprocess", action="store_true", help="always run yt-dlp as a subprocess")
+    parser.add_argument("--delete-partial", action="store_true",
+                        help="delete .part files of cancelled downloads instead of keeping them for resume")
+    parser.add_argument("--resume", action="store_true", help="also run unfinished items from the queue")
+    parser.add_argument("--stream", choices=STREAM_SINKS,
+                        help="pipe the media from yt-dlp (-o -) straight into a file, a named pipe or "
+                             "fixed-size segments, without temporary files")
+    parser.add_argument("--stream-target",
+                        help="sink path; may use %%(title)s %%(id)s %%(ext)s %%(timestamp)s (required for a pipe)")
+    parser.add_argument("--segment-size", type=int, help="segment size in MB for --stream segments")
+    parser.add_argument("--layout", choices=OUTPUT_LAYOUTS,
+                        help="'store' saves each video once by id and format and links it into the save directory")
+    parser.add_argument("--store-dir", help="store directory for --layout store (default: <output>/.replica-store)")
+    parser.add_argument("--no-metrics-log", action="store_true",
+                        help=f"do not append per-item timings to {METRICS_FILE}")
+    parser.add_argument("--subscribe", action="append", default=[], metavar="URL",
+                        help="save a playlist or channel subscription (with -f, --sync-interval, --backfill)")
+    parser.add_argument("--unsubscribe", action="append", default=[], type=int, metavar="ID",
+                        help="remove a subscription")
+    parser.add_argument("--subscriptions", action="store_true", help="list saved subscriptions")
+    parser.add_argument("--sync", nargs="?", const="due", choices=("due", "all"),
+                        help="download new videos of subscriptions that are due, or of all of them"
+                             " (--serve syncs in the background)")
+    parser.add_argument("--sync-interval", type=float, default=DEFAULT_SYNC_INTERVAL / 3600,
+                        help="hours between syncs of a new subscription (default 24)")
+    parser.add_argument("--backfill", type=int, default=0,
+                        help="also download the latest N existing videos of a new subscription")
+    parser.add_argument("-v", "--verbose", action="store_true", help="stream yt-dlp output to stderr")
+    parser.add_argument("--serve", action="store_true",
+                        help="keep running and accept jobs over the local HTTP API")
+    parser.add_argument("--port", type=int, default=DEFAULT_API_PORT,
+                        help="HTTP API port (with --serve or --coordinator)")
+    parser.add_argument("--host", default=DEFAULT_API_HOST,
+                        help="HTTP API address; use 0.0.0.0 to accept workers from other hosts"
+                             f" (default {DEFAULT_API_HOST})")
+    parser.add_argument("--coordinator", action="store_true",
+                        help="keep running and serve a shared queue to --worker processes over the HTTP API")
+    parser.add_argument("--queue-file", default=SHARED_QUEUE_FILE,
+                        help="shared queue of --coordinator (default: shared-queue.db in the app data directory)")
+    parser.add_argument("--worker", metavar="QUEUE",
+                        help="download items leased from a shared queue: a coordinator URL (http://host:port)"
+                             " or the path of a shared queue file")
+    parser.add_argument("--worker-name", help="name of this worker in the shared queue (default: <host>-<pid>)")
+    parser.add_argument("--drain", action="store_true", help="with --worker, exit once the shared queue is empty")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                        help="seconds before the items of a worker that stopped responding are handed to another"
+                             f" worker (default {LEASE_SECONDS:g})")
+    parser.add_argument("--cluster-status", metavar="QUEUE",
+                        help="print the workers and item counts of a shared queue and exit")
+    parser.add_argument("--api-token", default=os.environ.get("REPLICA_API_TOKEN"),
+                        help="require 'Authorization: Bearer <token>' (default: $REPLICA_API_TOKEN)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    config = load_config()
+    console_out = sys.stderr if args.verbose else None
+    if args.serve or args.coordinator:
+        listener = EventBroker(sys.stdout, console_out)
+    else:
+        listener = JsonLinesListener(console_out=console_out)
+
+    if (args.serve or args.coordinator) and not args.api_token and not is_loopback(args.host):
+        listener.error(f"--api-token is required to listen on {args.host}")
+        return 2
+
+    candidates = itertools.chain(args.urls, *(iter_link_file(path) for path in args.input))
+    try:
+        result = collect_links(candidates)
+    except OSError as e:
+        listener.error(f"cannot read input: {e}")
+        return 2
+    listener.write("import", accepted=result.accepted, duplicates=result.duplicates, invalid=result.invalid)
+
+    profiles = config.get("profiles", {})
+    no_check_certificate = args.no_check_certificate or config.get("ssl_check", False)
+    try:
+        validate_profiles(profiles)
+        format_option = format_option_for(args.format, no_check_certificate, profiles)
+    except ValueError as e:
+        listener.error(str(e))
+        return 2
+
+    if args.cluster_status:
+        return print_cluster_status(args, listener)
+    if args.coordinator:
+        return run_coordinator(args, listener, result, format_option, profiles, no_check_certificate)
+    if args.worker and (args.serve or args.sync or args.resume):
+        listener.error("--worker cannot be combined with --serve, --sync or --resume")
+        return 2
+
+    # כל משאב נרשם לסגירה ברגע שהוא נפתח, וכל return מכאן סוגר את מה שנפתח עד אז
+    with contextlib.ExitStack() as resources:
+        return run_downloads(args, config, listener, result, format_option, profiles, no_check_certificate,
+                             resources)
+
+
+def run_downloads(args, config, listener, result, format_option, profiles, no_check_certificate, resources):
+    subscriptions = SubscriptionStore()
+    resources.callback(subscriptions.close)
+    for subscription_id in args.unsubscribe:
+        listener.write("unsubscribed", id=subscription_id, removed=subscriptions.remove(subscription_id))
+    for url in args.subscribe:
+        subscription = subscriptions.add(url, format_option, args.sync_interval * 3600, args.backfill)
+        if subscription is None:
+            listener.error(f"not a playlist or channel link: {url}")
+        else:
+            listener.write("subscribed", id=subscription.id, url=subscription.url, kind=subscription.kind)
+    if args.subscriptions:
+        for subscription in subscriptions.all():
+            listener.write("subscription", id=subscription.id, url=subscription.url, kind=subscription.kind,
+                           interval=subscription.interval, last_sync=subscription.last_sync,
+                           newest_id=subscription.newest_id, newest_date=subscription.newest_date,
+                           error=subscription.error)
+    if not (result.urls or args.resume or args.sync or args.serve) and (
+            args.subscribe or args.unsubscribe or args.subscriptions):
+        return 0
+
+    tools = discover_tools()
+    _, problems = tools_summary(tools, [format_option])
+    listener.write("tools", problems=problems,
+                   **{name: tool.version for name, tool in tools.items()})
+    if tools["yt-dlp"].path is None and tools["yt_dlp"].path is None:
+        listener.error(problems[0])
+        return 2
+
+    in_process = not args.subprocess and config.get("in_process", True)
+    expansion_cache = ExpansionCache()
+    resources.callback(expansion_cache.close)
+    expander = PlaylistExpander(expansion_cache, in_process)
+    syncer = SubscriptionSyncer(subscriptions, expander)
+
+    worker_name = args.worker_name or default_worker_name()
+    if args.worker:
+        # הקישורים מצטרפים לתור המשותף, וכל worker (גם זה) חוכר מהם
+        queue = open_worker_queue(args.worker, worker_name, args.api_token)
+        resources.callback(queue.close)
+        items = []
+        try:
+            if isinstance(queue, RemoteQueue):
+                queue.add(result.urls, args.format, no_check_certificate)
+            else:
+                queue.add(result.urls, format_option)
+        except (sqlite3.Error, OSError) as e:
+            listener.error(f"cannot reach the shared queue {args.worker}: {e}")
+            return 2
+    else:
+        queue = DownloadQueue()
+        resources.callback(queue.close)
+        items = queue.unfinished() if args.resume else []
+        items += queue.add(result.urls, format_option)
+    if args.sync and not args.serve:
+        if args.sync == "all":
+            subscriptions.mark_due()
+        for sync in syncer.sync_due():
+            listener.write("sync", id=sync.subscription.id, url=sync.subscription.url,
+                           new=len(sync.entries), error=sync.error)
+            items += queue.add([entry[1] for entry in sync.entries], sync.subscription.format_option)
+    if not items and not (args.serve or args.worker):
+        # סנכרון בלי סרטונים חדשים אינו שגיאה
+        if not args.sync:
+            listener.error("no links to download")
+        return 0 if args.sync else 2
+
+    save_directory = args.output or config.get(
+        "save_dir", os.path.join(os.path.expanduser("~"), "Downloads", "Replica")
+    )
+    os.makedirs(save_directory, exist_ok=True)
+
+    governor_config = dict(config)
+    for key, value in (("rate_limit", args.limit_rate), ("max_postprocess", args.max_postprocess),
+                       ("schedule", args.schedule)):
+        if value is not None:
+            governor_config[key] = value
+    stream_config = dict(config)
+    if args.stream is not None:
+        stream_config["output_mode"] = "stream"
+        stream_config["stream_sink"] = args.stream
+    for key, value in (("stream_target", args.stream_target), ("stream_segment_mb", args.segment_size)):
+        if value is not None:
+            stream_config[key] = value
+    store_config = dict(config)
+    for key, value in (("output_layout", args.layout), ("store_dir", args.store_dir)):
+        if value is not None:
+            store_config[key] = value
+    try:
+        governor = governor_from_config(governor_config)
+        stream = stream_output_from_config(stream_config)
+        store = output_store_from_config(store_config, save_directory)
+    except (ValueError, OSError) as e:
+        listener.error(str(e))
+        return 2
+    if store is not None:
+        resources.callback(store.close)
+
+    ydl_pool = YoutubeDLPool() if in_process else None
+    if ydl_pool is not None:
+        resources.callback(ydl_pool.close)
+    use_archive = not args.no_archive and config.get("use_archive", True)
+    metrics = MetricsRecorder(None if args.no_metrics_log or not config.get("metrics_log", True) else METRICS_FILE)
+    resources.callback(metrics.close)
+
+    engine = DownloadEngine(
+        items, save_directory, args.verbose,
+        args.workers or config.get("max_workers", DEFAULT_MAX_WORKERS),
+        args.per_host or config.get("max_per_host", DEFAULT_MAX_PER_HOST),
+        ydl_pool,
+        queue,
+        DownloadArchive() if use_archive else None,
+        expander,
+        config.get("max_retries", DEFAULT_MAX_RETRIES) if args.retries is None else args.retries,
+        listener=listener,
+        persistent=args.serve or bool(args.worker),
+        keep_partial=not args.delete_partial and config.get("keep_partial", True),
+        governor=governor,
+        prober=FormatProber(expansion_cache, in_process)
+        if args.probe_formats or config.get("probe_formats", False) else None,
+        metrics=metrics,
+        stream=stream,
+        max_connections=config.get("max_connections", DEFAULT_MAX_CONNECTIONS)
+        if args.max_connections is None else args.max_connections,
+        store=store,
+        die_with_parent=bool(args.worker)
+    )
+
+    def on_sync_entries(subscription, entries):
+        listener.write("sync", id=subscription.id, url=subscription.url, new=len(entries), error=None)
+        engine.submit(queue.add([entry[1] for entry in entries], subscription.format_option))
+
+    def on_sync_error(subscription, error):
+        listener.write("sync", id=subscription.id, url=subscription.url, new=0, error=error)
+
+    if args.serve:
+        scheduler = None
+        if config.get("sync_subscriptions", True):
+            scheduler = SubscriptionScheduler(syncer, on_sync_entries, on_sync_error)
+        try:
+            server = start_api_server(engine, listener, args.host, args.port, args.api_token,
+                                      no_check_certificate, profiles, scheduler)
+        except (OSError, ValueError) as e:
+            listener.error(f"cannot listen on port {args.port}: {e}")
+            return 2
+        resources.callback(server.server_close)
+        resources.callback(server.shutdown)
+        listener.write("listening", url=f"http://{args.host}:{args.port}")
+        if scheduler is not None:
+            scheduler.start()
+            resources.callback(scheduler.stop)
+
+    if args.worker:
+        queue_worker = QueueWorker(engine, queue, worker_name, lease=args.lease,
+                                   heartbeat=min(HEARTBEAT_INTERVAL, args.lease / 4), drain=args.drain)
+        listener.write("worker", name=worker_name, queue=args.worker, capacity=queue_worker.capacity)
+        queue_worker.start()
+        resources.callback(queue_worker.stop)
+
+    # נסגר ראשון: workers שלא הגיבו לעצירה בזמן עוד עלולים לעדכן את התור והמדדים
+    resources.callback(engine.wait_stopped, STOP_TIMEOUT)
+
+    def handle_signal(signum, frame):
+        engine.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        engine.stop()
+    resources.close()
+
+    if not engine.running:
+        listener.write("stopped")
+        return 130
+    return 0 if engine.failed == 0 else 1
+
+
+def print_cluster_status(args, listener):
+    backend = open_worker_queue(args.cluster_status, token=args.api_token)
+    try:
+        for worker in backend.workers():
+            listener.write("worker", **worker)
+        listener.write("counts", **backend.counts())
+    except (sqlite3.Error, OSError) as e:
+        listener.error(f"cannot read the shared queue {args.cluster_status}: {e}")
+        return 2
+    finally:
+        backend.close()
+    return 0
+
+
+def run_coordinator(args, listener, result, format_option, profiles, no_check_certificate):
+    # ה-coordinator לא מוריד בעצמו: הוא מחזיק את התור המשותף, וה-workers חוכרים
+    # ממנו פריטים דרך ה-API ומדווחים לו על ההתקדמות
+    queue = DownloadQueue(args.queue_file)
+    if result.urls:
+        items = queue.add(result.urls, format_option)
+        listener.write("queued", ids=[item.id for item in items])
+    try:
+        server = start_api_server(None, listener, args.host, args.port, args.api_token,
+                                  no_check_certificate, profiles, queue=queue)
+    except (OSError, ValueError) as e:
+        listener.error(f"cannot listen on port {args.port}: {e}")
+        queue.close()
+        return 2
+    listener.write("listening", url=f"http://{args.host}:{args.port}", queue=args.queue_file)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        queue.close()
+    listener.write("stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3837 @@
+import os
+import copy
+import csv
+import errno
+import glob
+import hashlib
+import heapq
+import importlib.util
+import io
+import json
+import random
+import shutil
+import signal
+import socket
+import sys
+import subprocess
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qs
+import re
+
+if os.name == 'nt':  # Windows
+    APP_DATA_DIR = os.path.join(os.environ.get('APPDATA', ''), 'Replica')
+elif os.name == 'posix':  # Linux, Mac
+    APP_DATA_DIR = os.path.join(os.path.expanduser('~'), '.config', 'Replica')
+else:
+    APP_DATA_DIR = os.path.join(os.path.expanduser('~'), '.Replica')
+
+if not os.path.exists(APP_DATA_DIR):
+    os.makedirs(APP_DATA_DIR)
+
+CONFIG_FILE = os.path.join(APP_DATA_DIR, "config.json")
+QUEUE_FILE = os.path.join(APP_DATA_DIR, "queue.db")
+ARCHIVE_FILE = os.path.join(APP_DATA_DIR, "archive.txt")
+METADATA_FILE = os.path.join(APP_DATA_DIR, "metadata.db")
+TOOLS_FILE = os.path.join(APP_DATA_DIR, "tools.json")
+METRICS_FILE = os.path.join(APP_DATA_DIR, "metrics.jsonl")
+SUBSCRIPTIONS_FILE = os.path.join(APP_DATA_DIR, "subscriptions.db")
+STORE_FILE = os.path.join(APP_DATA_DIR, "store.db")
+SHARED_QUEUE_FILE = os.path.join(APP_DATA_DIR, "shared-queue.db")
+APP_DIR = os.path.dirname(os.path.abspath(sys.argv[0] if getattr(sys, "frozen", False) else __file__))
+
+# תור משותף לכמה workers: המתנה לנעילת הקובץ, אורך חכירה, ותדירות ה-heartbeat והדיווח
+QUEUE_BUSY_TIMEOUT = 30.0
+LEASE_SECONDS = 60.0
+HEARTBEAT_INTERVAL = 15.0
+CLAIM_POLL_INTERVAL = 2.0
+# workers מדווחים בכל CLAIM_POLL_INTERVAL; מי ששתק יותר מזה כנראה נפל
+WORKER_TIMEOUT = HEARTBEAT_INTERVAL
+
+_yt_dlp_module = None
+
+
+def load_config():
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return {}
+    return {}
+
+
+def save_config(config):
+    os.makedirs(os.path.dirname(CONFIG_FILE), exist_ok=True)
+    
+    with open(CONFIG_FILE, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+
+
+FORMAT_KINDS = {
+    "mp4": [],
+    "mp4-low": ["-f", "mp4"],
+    "mp3": ["-x", "--audio-format", "mp3"],
+}
+
+
+# בחירת הפורמט שמשתמע מכל אחד מהסוגים המובנים, לשימוש כ-fallback של פרופילים
+BUILTIN_SELECTORS = {
+    "mp4": ["bv*+ba", "b"],
+    "mp4-low": ["mp4"],
+    "mp3": ["ba", "b"],
+}
+PROFILE_FIELDS = ("max_height", "vcodec", "acodec", "container", "audio", "audio_bitrate", "format", "fallback",
+                  "fragments", "downloader", "connections")
+AUDIO_FORMATS = ("mp3", "m4a", "opus", "aac", "flac", "wav", "vorbis", "alac", "best")
+VIDEO_CONTAINERS = ("mp4", "mkv", "webm", "mov", "flv", "avi")
+DOWNLOADERS = ("native", "aria2c")
+MAX_FRAGMENTS = 32
+# aria2c לא מרשה יותר מ-16 חיבורים לשרת
+MAX_ARIA2C_CONNECTIONS = 16
+DEFAULT_ARIA2C_CONNECTIONS = 8
+ARIA2C_CONNECTIONS_RE = re.compile(r"(?:^|\s)(?:-x\s*|--max-connection-per-server=)(\d+)")
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _profile_selectors(profile):
+    # רשימת חלופות לפי סדר עדיפות; yt-dlp מנסה אותן משמאל לימין
+    if profile.get("format"):
+        return [profile["format"]]
+
+    height = f"[height<={int(profile['max_height'])}]" if profile.get("max_height") else ""
+    acodecs = [f"[acodec^={codec}]" for codec in _as_list(profile.get("acodec"))]
+    if profile.get("audio"):
+        return [f"ba{codec}" for codec in acodecs] + ["ba", "b"]
+
+    vcodecs = [f"[vcodec^={codec}]" for codec in _as_list(profile.get("vcodec"))]
+    container = profile.get("container")
+    selectors = []
+    for vcodec in vcodecs:
+        selectors += [f"bv*{height}{vcodec}+ba{acodec}" for acodec in acodecs]
+        selectors.append(f"bv*{height}{vcodec}+ba")
+    selectors.append(f"bv*{height}+ba")
+    if container:
+        selectors.append(f"b{height}[ext={container}]")
+    selectors.append(f"b{height}")
+    return selectors
+
+
+def validate_profile(name, profile):
+    if not isinstance(profile, dict):
+        raise ValueError(f"profile '{name}' must be an object")
+    unknown = set(profile) - set(PROFILE_FIELDS)
+    if unknown:
+        raise ValueError(f"profile '{name}': unknown fields {sorted(unknown)}")
+    for field in ("max_height", "audio_bitrate", "fragments", "connections"):
+        if profile.get(field) is not None:
+            try:
+                if int(profile[field]) <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise ValueError(f"profile '{name}': {field} must be a positive number")
+    if profile.get("fragments") is not None and int(profile["fragments"]) > MAX_FRAGMENTS:
+        raise ValueError(f"profile '{name}': fragments must be at most {MAX_FRAGMENTS}")
+    if profile.get("downloader") and profile["downloader"] not in DOWNLOADERS:
+        raise ValueError(f"profile '{name}': downloader must be one of {list(DOWNLOADERS)}")
+    if profile.get("connections") is not None:
+        if profile.get("downloader") != "aria2c":
+            raise ValueError(f"profile '{name}': connections needs \"downloader\": \"aria2c\"")
+        if int(profile["connections"]) > MAX_ARIA2C_CONNECTIONS:
+            raise ValueError(f"profile '{name}': connections must be at most {MAX_ARIA2C_CONNECTIONS}")
+    if profile.get("audio") and profile["audio"] not in AUDIO_FORMATS:
+        raise ValueError(f"profile '{name}': audio must be one of {list(AUDIO_FORMATS)}")
+    if profile.get("container") and profile["container"] not in VIDEO_CONTAINERS:
+        raise ValueError(f"profile '{name}': container must be one of {list(VIDEO_CONTAINERS)}")
+
+
+def profile_args(name, profiles):
+    # מתרגם פרופיל בשם (כולל שרשרת ה-fallback שלו) לארגומנטים של yt-dlp.
+    # העיבוד (המרה ל-mp3, מיכל המיזוג) נקבע לפי הפרופיל הראשי בלבד.
+    selectors = []
+    chain = [name]
+    seen = set()
+    while chain:
+        current = chain.pop(0)
+        if current in seen:
+            continue
+        seen.add(current)
+        if current in FORMAT_KINDS:
+            selectors += [selector for selector in BUILTIN_SELECTORS[current] if selector not in selectors]
+            continue
+        if current not in profiles:
+            raise ValueError(f"unknown format profile '{current}'")
+        profile = profiles[current]
+        validate_profile(current, profile)
+        selectors += [selector for selector in _profile_selectors(profile) if selector not in selectors]
+        chain += _as_list(profile.get("fallback"))
+
+    primary = profiles[name]
+    args = ["-f", "/".join(selectors)]
+    if primary.get("audio"):
+        args += ["-x", "--audio-format", primary["audio"]]
+        if primary.get("audio_bitrate"):
+            args += ["--audio-quality", f"{int(primary['audio_bitrate'])}K"]
+    elif primary.get("container"):
+        args += ["--merge-output-format", primary["container"]]
+    if primary.get("fragments"):
+        # מקטעי DASH/HLS במקביל; עם aria2c זה מספר המקטעים שהוא מוריד יחד
+        args += ["--concurrent-fragments", str(int(primary["fragments"]))]
+    if primary.get("downloader") == "aria2c":
+        connections = int(primary.get("connections") or DEFAULT_ARIA2C_CONNECTIONS)
+        args += ["--downloader", find_tool("aria2c") or "aria2c",
+                 "--downloader-args", f"aria2c:-x{connections} -s{connections} -k1M"]
+    return args
+
+
+def format_connections(format_option):
+    # כמה חיבורים הורדה עם הארגומנטים האלה פותחת, לתקציב החיבורים של ה-scheduler
+    connections = 1
+    for flag, value in zip(format_option, format_option[1:]):
+        if flag in ("-N", "--concurrent-fragments") and value.isdigit():
+            connections = max(connections, int(value))
+        elif flag == "--downloader-args" and value.startswith("aria2c:"):
+            match = ARIA2C_CONNECTIONS_RE.search(value[len("aria2c:"):])
+            if match:
+                connections = max(connections, int(match.group(1)))
+    return connections
+
+
+def uses_aria2c(format_option):
+    return any(flag == "--downloader" and os.path.basename(value).startswith("aria2c")
+               for flag, value in zip(format_option, format_option[1:]))
+
+
+def profile_names(profiles=None):
+    return list(FORMAT_KINDS) + [name for name in (profiles or {}) if name not in FORMAT_KINDS]
+
+
+def validate_profiles(profiles):
+    if not isinstance(profiles, dict):
+        raise ValueError("profiles must be an object of name → profile")
+    for name in profiles:
+        if name in FORMAT_KINDS:
+            raise ValueError(f"profile name '{name}' is reserved")
+        profile_args(name, profiles)
+
+
+def format_option_for(kind, no_check_certificate=False, profiles=None):
+    ssl_option = ["--no-check-certificate"] if no_check_certificate else []
+    if kind in FORMAT_KINDS:
+        return ["yt-dlp"] + ssl_option + FORMAT_KINDS[kind]
+    return ["yt-dlp"] + ssl_option + profile_args(kind, profiles or {})
+
+
+QueueItem = namedtuple("QueueItem", "id url format_option output_template attempts")
+
+
+class ClosedConnection:
+    # מחליף את החיבור של מאגר SQLite אחרי close(). worker שנזנח ביציאה (לא הגיב
+    # לביטול בזמן) עוד עלול לעדכן מצב; הכתיבה שלו נזרקת והקריאה מחזירה תוצאה ריקה,
+    # במקום ProgrammingError על חיבור סגור.
+    lastrowid = None
+
+    def execute(self, sql, params=()):
+        return self
+
+    def executemany(self, sql, params):
+        return self
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def __iter__(self):
+        return iter(())
+
+    def close(self):
+        pass
+
+
+CLOSED_CONNECTION = ClosedConnection()
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class DownloadQueue:
+    # תור הורדות עמיד לקריסות: כל פריט נשמר ב-SQLite (מצב WAL) עם מצבו, מספר
+    # הניסיונות ותבנית שם הקובץ, כדי שהפעלה הבאה תמשיך מאותו קובץ .part.
+    # כתור משותף לכמה workers, כל worker חוכר פריטים (claim) ומחדש את החכירה
+    # ב-heartbeat; פריט שחכירתו פגה חוזר לתור. worker הוא שם ה-worker שמשתמש
+    # במופע הזה, ועדכוני מצב של פריט שכבר נלקח ממנו לא נרשמים.
+    def __init__(self, path=QUEUE_FILE, worker=None):
+        self.worker = worker
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=QUEUE_BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " url TEXT NOT NULL,"
+            " format_option TEXT NOT NULL,"
+            " output_template TEXT,"
+            " state TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state)")
+        # עמודות החכירה נוספו אחרי הגרסה הראשונה של התור
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(items)")}
+        for column, kind in (("worker", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                try:
+                    self._conn.execute(f"ALTER TABLE items ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # תהליך אחר הוסיף אותה באותו רגע
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            " name TEXT PRIMARY KEY,"
+            " seen REAL NOT NULL,"
+            " status TEXT NOT NULL)"
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _owned(self, worker):
+        worker = self.worker if worker is None else worker
+        if worker is None:
+            return "", ()
+        return " AND (worker IS NULL OR worker = ?)", (worker,)
+
+    def add(self, urls, format_option):
+        now = time.time()
+        options = json.dumps(format_option)
+        items = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for url in urls:
+                    cursor = self._conn.execute(
+                        "INSERT INTO items (url, format_option, updated) VALUES (?, ?, ?)",
+                        (url, options, now)
+                    )
+                    items.append(QueueItem(cursor.lastrowid, url, list(format_option), None, 0))
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return items
+
+    def unfinished(self):
+        rows = self._execute(
+            "SELECT id, url, format_option, output_template, attempts FROM items"
+            " WHERE state IN (?, ?) ORDER BY id", (PENDING, RUNNING)
+        ).fetchall()
+        return [QueueItem(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows]
+
+    def mark_running(self, item_id, output_template, worker=None):
+        owned, params = self._owned(worker)
+        self._execute(
+            "UPDATE items SET state = ?, output_template = ?, attempts = attempts + 1, updated = ?"
+            " WHERE id = ?" + owned, (RUNNING, output_template, time.time(), item_id) + params
+        )
+
+    def mark_pending(self, item_id, error, worker=None):
+        owned, params = self._owned(worker)
+        self._execute(
+            "UPDATE items SET state = ?, error = ?, updated = ? WHERE id = ?" + owned,
+            (PENDING, error, time.time(), item_id) + params
+        )
+
+    def mark_done(self, item_id, worker=None):
+        owned, params = self._owned(worker)
+        self._execute(
+            "UPDATE items SET state = ?, error = NULL, updated = ? WHERE id = ?" + owned,
+            (DONE, time.time(), item_id) + params
+        )
+
+    def mark_failed(self, item_id, error, worker=None):
+        owned, params = self._owned(worker)
+        self._execute(
+            "UPDATE items SET state = ?, error = ?, updated = ? WHERE id = ?" + owned,
+            (FAILED, error, time.time(), item_id) + params
+        )
+
+    def claim(self, worker, limit, lease=LEASE_SECONDS):
+        # חוכר עד limit פריטים: ממתינים שאינם חכורים, וגם פריטים של worker שהחכירה
+        # שלו פגה (קרס או התנתק). BEGIN IMMEDIATE נועל את הקובץ, כך ששני workers
+        # לא לוקחים את אותו פריט.
+        # פריט שנלקח מ-worker אחר מתחיל מחדש בשם קובץ חדש: ה-yt-dlp של ה-worker
+        # שנפל עלול עדיין לכתוב לשם הקודם (מחוץ ללינוקס הוא לא מת איתו)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, url, format_option, output_template, attempts, worker FROM items"
+                    " WHERE (state = ? AND (worker IS NULL OR lease_until < ?))"
+                    " OR (state = ? AND worker IS NOT NULL AND lease_until < ?) ORDER BY id LIMIT ?",
+                    (PENDING, now, RUNNING, now, limit)
+                ).fetchall()
+                rows = [row[:3] + ((None,) if row[5] not in (None, worker) else (row[3],)) + row[4:5]
+                        for row in rows]
+                self._conn.executemany(
+                    "UPDATE items SET state = ?, worker = ?, lease_until = ?, output_template = ?, updated = ?"
+                    " WHERE id = ?", [(PENDING, worker, now + lease, row[3], now, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [QueueItem(row[0], row[1], json.loads(row[2]), row[3], row[4]) for row in rows]
+
+    def heartbeat(self, worker, item_ids, lease=LEASE_SECONDS):
+        # מחדש את החכירה ומחזיר (פעילים, אבודים): פעילים עדיין של ה-worker ולא
+        # הסתיימו; אבודים בוטלו או נלקחו על ידי worker אחר, וה-worker צריך לעצור אותם
+        if not item_ids:
+            return [], []
+        now = time.time()
+        marks = ", ".join("?" * len(item_ids))
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE items SET lease_until = ? WHERE worker = ? AND state IN (?, ?) AND id IN ({marks})",
+                (now + lease, worker, PENDING, RUNNING, *item_ids)
+            )
+            rows = self._conn.execute(
+                f"SELECT id, state, worker FROM items WHERE id IN ({marks})", tuple(item_ids)
+            ).fetchall()
+        active = [row[0] for row in rows if row[1] in (PENDING, RUNNING) and row[2] == worker]
+        lost = [row[0] for row in rows if row[1] == CANCELLED or (row[1] in (PENDING, RUNNING) and row[2] != worker)]
+        return active, lost
+
+    def release(self, worker):
+        # worker שנעצר מחזיר את הפריטים שלו לתור מיד, בלי לחכות שהחכירה תפוג
+        self._execute(
+            "UPDATE items SET state = ?, worker = NULL, lease_until = NULL, updated = ?"
+            " WHERE worker = ? AND state IN (?, ?)", (PENDING, time.time(), worker, PENDING, RUNNING)
+        )
+
+    def report(self, worker, status):
+        self._execute(
+            "INSERT OR REPLACE INTO workers (name, seen, status) VALUES (?, ?, ?)",
+            (worker, time.time(), json.dumps(status, ensure_ascii=False))
+        )
+
+    def workers(self):
+        # התצוגה המרוכזת: הדיווח האחרון של כל worker, ומי מהם עדיין חי
+        now = time.time()
+        rows = self._execute("SELECT name, seen, status FROM workers ORDER BY name").fetchall()
+        workers = []
+        for name, seen, status in rows:
+            status = json.loads(status)
+            alive = status.get("state") != "stopped" and now - seen < WORKER_TIMEOUT
+            workers.append(dict(status, name=name, seen=seen, alive=alive))
+        return workers
+
+    def item(self, item_id):
+        row = self._execute(
+            "SELECT id, url, format_option, output_template, attempts FROM items WHERE id = ?", (item_id,)
+        ).fetchone()
+        return QueueItem(row[0], row[1], json.loads(row[2]), row[3], row[4]) if row else None
+
+    def expand(self, item, urls, worker=None):
+        # מחליף פריט של פלייליסט/ערוץ בפריטי הסרטונים שלו, בטרנזקציה אחת
+        # בתור משותף הילדים נחכרים מיד ל-worker שפרש את הפריט, כי הוא מוריד אותם
+        worker = self.worker if worker is None else worker
+        now = time.time()
+        lease_until = now + LEASE_SECONDS if worker is not None else None
+        options = json.dumps(item.format_option)
+        children = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for url in urls:
+                    cursor = self._conn.execute(
+                        "INSERT INTO items (url, format_option, updated, worker, lease_until)"
+                        " VALUES (?, ?, ?, ?, ?)", (url, options, now, worker, lease_until)
+                    )
+                    children.append(QueueItem(cursor.lastrowid, url, list(item.format_option), None, 0))
+                self._conn.execute(
+                    "UPDATE items SET state = ?, updated = ? WHERE id = ?", (DONE, now, item.id)
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+        return children
+
+    def mark_cancelled(self, item_id, worker=None):
+        owned, params = self._owned(worker)
+        self._execute(
+            "UPDATE items SET state = ?, updated = ? WHERE id = ?" + owned,
+            (CANCELLED, time.time(), item_id) + params
+        )
+
+    ITEM_FIELDS = ("id", "url", "state", "attempts", "output_template", "error", "updated", "worker")
+
+    def list_items(self, state=None, limit=500, offset=0):
+        sql = f"SELECT {', '.join(self.ITEM_FIELDS)} FROM items"
+        params = ()
+        if state:
+            sql += " WHERE state = ?"
+            params = (state,)
+        sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+        rows = self._execute(sql, params + (limit, offset)).fetchall()
+        return [dict(zip(self.ITEM_FIELDS, row)) for row in rows]
+
+    def get(self, item_id):
+        row = self._execute(
+            f"SELECT {', '.join(self.ITEM_FIELDS)} FROM items WHERE id = ?", (item_id,)
+        ).fetchone()
+        return dict(zip(self.ITEM_FIELDS, row)) if row else None
+
+    def view_rows(self):
+        # כל הפריטים לתצוגת התור, מהחדש לישן
+        rows = self._execute(
+            "SELECT id, url, state, format_option, error FROM items ORDER BY id DESC"
+        ).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3]), row[4]) for row in rows]
+
+    def counts(self):
+        return dict(self._execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall())
+
+    def discard_unfinished(self):
+        self._execute("DELETE FROM items WHERE state IN (?, ?)", (PENDING, RUNNING))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._conn = CLOSED_CONNECTION
+
+
+def load_yt_dlp():
+    global _yt_dlp_module
+    if _yt_dlp_module is None:
+        try:
+            import yt_dlp
+            _yt_dlp_module = yt_dlp
+        except ImportError:
+            _yt_dlp_module = False
+    return _yt_dlp_module or None
+
+
+def yt_dlp_installed():
+    if _yt_dlp_module is not None:
+        return bool(_yt_dlp_module)
+    return importlib.util.find_spec("yt_dlp") is not None
+
+
+ToolInfo = namedtuple("ToolInfo", "name path version")
+TOOL_VERSION_ARGS = {"yt-dlp": ["--version"], "ffmpeg": ["-version"], "aria2c": ["--version"]}
+TOOL_VERSION_TIMEOUT = 15
+
+
+def find_tool(name):
+    # קובץ שליד Replica (כך מופצת הגרסה הארוזה) קודם ל-PATH
+    local = os.path.join(APP_DIR, name + (".exe" if os.name == 'nt' else ""))
+    if os.path.isfile(local):
+        return local
+    return shutil.which(name)
+
+
+def _tool_version(name, path):
+    try:
+        result = subprocess.run([path] + TOOL_VERSION_ARGS[name], capture_output=True, text=True,
+                                encoding="utf-8", errors="replace", timeout=TOOL_VERSION_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return None
+    # "ffmpeg version 6.1.1-3ubuntu5 Copyright ..." / "aria2 version 1.37.0" / "2026.08.19"
+    words = lines[0].split()
+    return words[2] if name in ("ffmpeg", "aria2c") and len(words) > 2 else lines[0].strip()
+
+
+def discover_tools(cache_path=TOOLS_FILE):
+    # מאתר את yt-dlp ו-ffmpeg ובודק את הגרסה שלהם. הרצת --version איטית (במיוחד
+    # yt-dlp.exe הארוז), ולכן התוצאה נשמרת לפי נתיב, זמן שינוי וגודל של הקובץ.
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    changed = False
+    tools = {}
+    for name in TOOL_VERSION_ARGS:
+        path = find_tool(name)
+        if path is None:
+            tools[name] = ToolInfo(name, None, None)
+            continue
+        try:
+            stat = os.stat(path)
+            key = [path, stat.st_mtime, stat.st_size]
+        except OSError:
+            key = None
+        entry = cache.get(name)
+        if key is not None and isinstance(entry, dict) and entry.get("key") == key:
+            version = entry.get("version")
+        else:
+            version = _tool_version(name, path)
+            cache[name] = {"key": key, "version": version}
+            changed = True
+        tools[name] = ToolInfo(name, path if version else None, version)
+    yt_dlp = load_yt_dlp()
+    tools["yt_dlp"] = ToolInfo("yt_dlp", yt_dlp.__file__ if yt_dlp else None,
+                               yt_dlp.version.__version__ if yt_dlp else None)
+    if changed:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, indent=4)
+        except OSError:
+            pass
+    return tools
+
+
+def tools_summary(tools, format_options=()):
+    # (הודעה, בעיות): בעיות היא רשימה של הודעות על כלים חסרים. aria2c נחשב חסר רק
+    # כשאחת מאפשרויות הפורמט של האצווה משתמשת בו.
+    problems = []
+    if tools["yt-dlp"].path is None and tools["yt_dlp"].path is None:
+        problems.append("yt-dlp לא נמצא (לא כקובץ ליד Replica או ב-PATH, ולא כמודול Python)")
+    if tools["ffmpeg"].path is None:
+        problems.append("ffmpeg לא נמצא: מיזוג וידאו ואודיו והמרה ל-MP3 ייכשלו")
+    if tools["aria2c"].path is None and any(uses_aria2c(option) for option in format_options):
+        problems.append("aria2c לא נמצא: הורדות בפרופילים שמשתמשים בו ייכשלו")
+    parts = [f"{tool.name} {tool.version}" for tool in tools.values() if tool.version]
+    return " | ".join(parts), problems
+
+
+class YtdlpLogger:
+    def __init__(self, emit):
+        self.emit = emit
+        self.errors = []
+
+    def debug(self, msg):
+        if not msg.startswith("[debug] "):
+            self.emit(msg + "\n")
+
+    info = debug
+
+    def warning(self, msg):
+        self.emit(msg + "\n")
+
+    def error(self, msg):
+        self.errors.append(msg)
+        self.emit(msg + "\n")
+
+
+class ProgressRelay:
+    def __init__(self):
+        self.callback = None
+        self.cancelled = None
+        self.on_postprocess = None
+        self.on_move = None
+
+    def __call__(self, d):
+        # אין דרך לעצור thread מבחוץ; חריגה מתוך ה-hook מפילה את ההורדה בחתיכה הבאה
+        if self.cancelled is not None and self.cancelled.is_set():
+            raise load_yt_dlp().utils.DownloadCancelled()
+        callback = self.callback
+        if callback is not None and d.get("status") in ("downloading", "finished"):
+            callback(d)
+
+    def postprocessor_hook(self, d):
+        # נקרא פעם אחת, לפני עיבוד ה-ffmpeg הראשון של ההורדה (מעבר לשלב העיבוד)
+        if d.get("status") != "started":
+            return
+        on_move = self.on_move
+        if on_move is not None and MOVE_POSTPROCESSOR_RE.match(d.get("postprocessor", "")):
+            self.on_move = None
+            on_move()
+            return
+        on_postprocess = self.on_postprocess
+        if on_postprocess is None:
+            return
+        if not FFMPEG_POSTPROCESSOR_RE.match(d.get("postprocessor", "")):
+            return
+        self.on_postprocess = None
+        if not on_postprocess():
+            raise load_yt_dlp().utils.DownloadCancelled()
+
+
+class YoutubeDLPool:
+    # מחזיק מופעי YoutubeDL חמים לכל פרופיל פורמט, כך שחיבורי HTTP ומצב ה-extractors
+    # נשמרים בין קישורים. מופע אינו thread-safe ולכן כל הורדה שואלת מופע משלה.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def available(self):
+        return load_yt_dlp() is not None
+
+    def acquire(self, format_option):
+        key = tuple(format_option[1:])
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        yt_dlp = load_yt_dlp()
+        ydl_opts = yt_dlp.parse_options(list(key)).ydl_opts
+        relay = ProgressRelay()
+        ydl_opts["noprogress"] = True
+        ydl_opts["progress_hooks"] = [relay]
+        ydl_opts["postprocessor_hooks"] = [relay.postprocessor_hook]
+        local_ffmpeg = os.path.join(APP_DIR, "ffmpeg.exe" if os.name == 'nt' else "ffmpeg")
+        if not ydl_opts.get("ffmpeg_location") and os.path.exists(local_ffmpeg):
+            ydl_opts["ffmpeg_location"] = local_ffmpeg
+        return yt_dlp.YoutubeDL(ydl_opts), relay
+
+    def release(self, format_option, instance):
+        with self._lock:
+            self._idle.setdefault(tuple(format_option[1:]), []).append(instance)
+
+    def download(self, format_option, url, output_template, emit, on_progress=None, cancelled=None,
+                 on_start=None, on_postprocess=None, on_move=None, params=None):
+        yt_dlp = load_yt_dlp()
+        ydl, relay = instance = self.acquire(format_option)
+        # פרמטרים לקישור הזה בלבד (למשל paths של OutputStore); מוחזרים אחרי ההורדה
+        missing = object()
+        saved = {key: ydl.params.get(key, missing) for key in params or ()}
+        ydl.params.update(params or {})
+        logger = YtdlpLogger(emit)
+        ydl.params["logger"] = logger
+        relay.callback = on_progress
+        relay.cancelled = cancelled
+        relay.on_postprocess = on_postprocess
+        relay.on_move = on_move
+        if on_start is not None:
+            on_start(ydl.params)
+        ydl.params["outtmpl"]["default"] = output_template
+        ydl._download_retcode = 0  # download() מחזיר קוד מצטבר, ולכן מאפסים בין קישורים
+        try:
+            exit_code = ydl.download([url])
+        except yt_dlp.utils.YoutubeDLError as e:
+            if not logger.errors:
+                logger.errors.append(str(e))
+            exit_code = 1
+        finally:
+            ydl.params["logger"] = None
+            ydl.params["ratelimit"] = None
+            relay.callback = None
+            relay.cancelled = None
+            relay.on_postprocess = None
+            relay.on_move = None
+            for key, value in saved.items():
+                if value is missing:
+                    ydl.params.pop(key, None)
+                else:
+                    ydl.params[key] = value
+            self.release(format_option, instance)
+        return exit_code, "\n".join(logger.errors)
+
+    def close(self):
+        with self._lock:
+            instances = [instance for idle in self._idle.values() for instance in idle]
+            self._idle.clear()
+        for ydl, relay in instances:
+            ydl.close()
+
+
+ProgressEvent = namedtuple("ProgressEvent", "index downloaded total speed eta filename", defaults=(None,))
+
+PROGRESS_PREFIX = "replica-progress:"
+PROGRESS_ARGS = [
+    "--newline",
+    "--progress-template",
+    "download:" + PROGRESS_PREFIX + "%(progress.downloaded_bytes)s/%(progress.total_bytes)s/"
+    "%(progress.total_bytes_estimate)s/%(progress.speed)s/%(progress.eta)s/%(progress.filename)s",
+]
+PROGRESS_RE = re.compile(r"replica-progress:([^/]*)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/(.*)")
+PROGRESS_INTERVAL = 0.25
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_progress_line(index, line):
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    match = PROGRESS_RE.match(line)
+    if match is None:
+        return None
+    downloaded, total, estimate, speed, eta = (_number(v) for v in match.groups()[:5])
+    filename = match.group(6).rstrip("\r\n")
+    return ProgressEvent(index, downloaded or 0, total or estimate, speed, eta, filename or None)
+
+
+def progress_from_hook(index, d):
+    return ProgressEvent(
+        index,
+        d.get("downloaded_bytes") or 0,
+        d.get("total_bytes") or d.get("total_bytes_estimate"),
+        d.get("speed"),
+        d.get("eta"),
+        d.get("filename"),
+    )
+
+
+def format_bytes(num):
+    if num is None:
+        return "?"
+    for unit in ("B", "KB", "MB", "GB"):
+        if num < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} TB"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def format_progress(event):
+    if event.total:
+        percent = f"{event.downloaded * 100 / event.total:5.1f}%"
+    else:
+        percent = "  ?  %"
+    speed = format_bytes(event.speed) + "/s" if event.speed else "?"
+    return f"[download] {percent} מתוך {format_bytes(event.total)} | {speed} | ETA {format_eta(event.eta)}\n"
+
+
+CONSOLE_FLUSH_INTERVAL = 0.075
+
+
+class ConsoleBuffer:
+    # אוסף שורות פלט מכל ה-workers ומשחרר אותן כגוש אחד בכל tick של טיימר.
+    # שורות התקדמות רצופות של אותו פריט מתמזגות כך שרק האחרונה נשארת.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = []
+        self._progress_slots = {}
+
+    def write(self, text, key=None, progress=False):
+        with self._lock:
+            if progress:
+                slot = self._progress_slots.get(key)
+                if slot is not None:
+                    self._lines[slot] = text
+                    return
+                self._progress_slots[key] = len(self._lines)
+            else:
+                self._progress_slots.pop(key, None)
+            self._lines.append(text)
+
+    def drain(self):
+        with self._lock:
+            lines = self._lines
+            self._lines = []
+            self._progress_slots = {}
+        return "".join(lines)
+
+
+STDOUT = "stdout"
+STDERR = "stderr"
+STDERR_TAIL_LINES = 50
+
+
+class OutputPump:
+    # קורא את stdout ואת stderr במקביל (stderr ב-thread נפרד), כדי שתהליך רועש
+    # לא ייתקע על באפר מלא של pipe שאף אחד לא קורא.
+    def __init__(self, process, on_line=None, tail_lines=STDERR_TAIL_LINES, drain_stdout=True):
+        self.process = process
+        self.on_line = on_line
+        self.drain_stdout = drain_stdout
+        self.stderr_tail = deque(maxlen=tail_lines)
+        self._stderr_thread = None
+        if process.stderr is not None:
+            self._stderr_thread = threading.Thread(
+                target=self._drain, args=(process.stderr, STDERR), daemon=True
+            )
+            self._stderr_thread.start()
+
+    def _drain(self, stream, name):
+        on_line = self.on_line
+        with stream:
+            for line in stream:
+                if name == STDERR:
+                    self.stderr_tail.append(line)
+                if on_line is not None:
+                    on_line(name, line)
+
+    def run(self):
+        if self.drain_stdout and self.process.stdout is not None:
+            self._drain(self.process.stdout, STDOUT)
+        exit_code = self.process.wait()
+        if self._stderr_thread is not None:
+            self._stderr_thread.join()
+        return exit_code
+
+    def stderr_open(self):
+        return self._stderr_thread is not None and self._stderr_thread.is_alive()
+
+    def error_output(self):
+        return "".join(self.stderr_tail)
+
+
+CANCEL_GRACE = 0.5
+STOP_TIMEOUT = 0.8
+PARTIAL_MARKERS = (".part", ".ytdl", ".temp.")
+
+
+def popen_group_kwargs():
+    # כל הורדה רצה בקבוצת תהליכים משלה, כדי שביטול יגיע גם ל-ffmpeg שה-yt-dlp מפעיל
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def parent_death_prefix():
+    # בקבוצה משלו yt-dlp לא מת עם Replica. ב-worker של תור משותף זה אומר שהורדה ממשיכה
+    # אחרי שה-worker נהרג (SIGKILL) והפריט כבר עבר ל-worker אחר, ולכן בלינוקס הפקודה
+    # רצה דרך setpriv, שמבקש מהקרנל להרוג אותה כשמי שהפעיל אותה מת. אין preexec_fn:
+    # הוא לא בטוח כשיש threads. ה-PDEATHSIG נקשר ל-thread שהפעיל את התהליך, וה-thread
+    # של ההורדה ממתין לתהליך עד שהוא מסתיים.
+    if not sys.platform.startswith("linux"):
+        return []
+    setpriv = shutil.which("setpriv")
+    return [setpriv, "--pdeathsig", "KILL", "--"] if setpriv else []
+
+
+def terminate_process_group(process, grace=CANCEL_GRACE):
+    # SIGTERM לכל הקבוצה מיד, ו-SIGKILL למי שנשאר אחרי grace שניות. לא חוסם את הקורא.
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == "nt":
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            os.killpg(process.pid, signal.SIGTERM)
+    except OSError:
+        return
+
+    def kill_after_grace():
+        try:
+            process.wait(grace)
+        except subprocess.TimeoutExpired:
+            pass
+        try:
+            if os.name == "nt":
+                if process.poll() is None:
+                    subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], capture_output=True)
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    threading.Thread(target=kill_after_grace, daemon=True).start()
+
+
+def suspend_process_group(process):
+    # ב-Windows אין SIGSTOP; שם התהליך ממשיך לרוץ בזמן ההמתנה
+    if os.name != "nt":
+        try:
+            os.killpg(process.pid, signal.SIGSTOP)
+        except OSError:
+            pass
+
+
+def resume_process_group(process):
+    if os.name != "nt":
+        try:
+            os.killpg(process.pid, signal.SIGCONT)
+        except OSError:
+            pass
+
+
+def partial_files(filename):
+    # קבצי .part/.ytdl/fragments שנשארו מהורדה של filename (הקובץ הסופי עצמו לא נכלל)
+    return [
+        path for path in glob.glob(glob.escape(filename) + "*")
+        if any(marker in os.path.basename(path)[len(os.path.basename(filename)):] for marker in PARTIAL_MARKERS)
+    ]
+
+
+# מצב הזרמה: yt-dlp כותב את המדיה ל-stdout (-o -) והיא עוברת ישר ל-sink, בלי
+# קובצי .part, fragments ומיזוג על הדיסק. ההודעות וההתקדמות עוברות ל-stderr.
+STREAM_SINKS = ("file", "pipe", "segments")
+STREAM_BUFFER_SIZE = 1024 * 1024
+STREAM_NAME_TIMEOUT = 15.0
+STREAM_PIPE_POLL = 0.2
+DEFAULT_SEGMENT_MB = 1024
+DEFAULT_STREAM_TARGET = "%(title)s_%(timestamp)s.%(ext)s"
+STREAM_FIELD_RE = re.compile(r"%\((title|ext|id|timestamp)\)s")
+UNSAFE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+# שדות ה-info בסוף תבנית ההתקדמות נותנים ל-sink שם לפני שהבתים הראשונים נכתבים
+STREAM_PROGRESS_ARGS = [
+    "--newline",
+    "--progress-template",
+    "download:" + PROGRESS_PREFIX + "%(progress.downloaded_bytes)s/%(progress.total_bytes)s/"
+    "%(progress.total_bytes_estimate)s/%(progress.speed)s/%(progress.eta)s/%(info.id)s\t%(info.ext)s\t%(info.title)s",
+]
+
+StreamOutput = namedtuple("StreamOutput", "sink target segment_bytes")
+
+
+def stream_output_from_config(config):
+    # None = מצב הקבצים הרגיל
+    if config.get("output_mode", "file") != "stream":
+        return None
+    sink = config.get("stream_sink", "file")
+    if sink not in STREAM_SINKS:
+        raise ValueError(f"stream sink must be one of {', '.join(STREAM_SINKS)}, not {sink!r}")
+    target = (config.get("stream_target") or "").strip()
+    if sink == "pipe" and not target:
+        raise ValueError("a named pipe sink needs a target path")
+    try:
+        segment_mb = int(config.get("stream_segment_mb", DEFAULT_SEGMENT_MB))
+    except (TypeError, ValueError):
+        raise ValueError("stream_segment_mb must be an integer")
+    if segment_mb < 1:
+        raise ValueError("stream_segment_mb must be at least 1")
+    return StreamOutput(sink, target or DEFAULT_STREAM_TARGET, segment_mb * 1024 * 1024)
+
+
+def render_stream_name(template, fields):
+    # שדות שאינם ב-fields נשארים בתבנית, למילוי מאוחר יותר
+    def replace(match):
+        if match.group(1) not in fields:
+            return match.group(0)
+        return UNSAFE_NAME_RE.sub("_", str(fields[match.group(1)] or "NA"))
+    return STREAM_FIELD_RE.sub(replace, template)
+
+
+class FileSink:
+    # קובץ רגיל, פתוח בלי באפר של Python (os.splice כותב ישר ל-fd). כשהגודל ידוע
+    # השטח מוקצה מראש, כך שקובץ של כמה ג'יגה לא מתפצל על הדיסק.
+    def __init__(self, path):
+        self.path = path
+        self.paths = []
+        self.file = None
+        self.written = 0
+        self.reserved = 0
+
+    def open(self, name, cancelled=None):
+        self.path = name
+        self.paths.append(name)
+        os.makedirs(os.path.dirname(os.path.abspath(name)), exist_ok=True)
+        self.file = open(name, "wb", buffering=0)
+
+    def reserve(self, total):
+        if not hasattr(os, "posix_fallocate") or total <= self.reserved:
+            return
+        try:
+            os.posix_fallocate(self.file.fileno(), 0, int(total))
+            self.reserved = int(total)
+        except OSError:
+            # מערכת קבצים בלי fallocate (למשל FAT) או אין מקום; ההורדה תגלה את זה בעצמה
+            self.reserved = float("inf")
+
+    def room(self):
+        return None
+
+    def wrote(self, count):
+        self.written += count
+
+    def close(self):
+        if self.file is None:
+            return
+        # הקצאה מראש לפי total_bytes_estimate עלולה להיות גדולה מהתוכן
+        if self.reserved and self.reserved != float("inf"):
+            self.file.truncate(self.written)
+        self.file.close()
+        self.file = None
+
+
+class PipeSink(FileSink):
+    # named pipe (FIFO) שתוכנה אחרת קוראת ממנו (נגן, ffmpeg, שרת). אם הוא לא קיים הוא
+    # נוצר. הפתיחה מחכה לקורא, אבל מתעוררת כל STREAM_PIPE_POLL כדי לאפשר ביטול.
+    def open(self, name, cancelled=None):
+        self.path = name
+        self.paths.append(name)
+        if os.name == "nt":
+            self.file = open(name, "wb", buffering=0)
+            return
+        if not os.path.exists(name):
+            os.mkfifo(name)
+        while True:
+            try:
+                fd = os.open(name, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                # ENXIO: אין עדיין קורא בצד השני
+                if e.errno != errno.ENXIO or (cancelled is not None and cancelled()):
+                    raise
+                time.sleep(STREAM_PIPE_POLL)
+        os.set_blocking(fd, True)
+        self.file = open(fd, "wb", buffering=0)
+
+    def reserve(self, total):
+        pass
+
+
+class SegmentSink(FileSink):
+    # קבצים מתחלפים בגודל קבוע: name.00000.ext, name.00001.ext... להקלטות ארוכות
+    # ולשידורים חיים, שאפשר להעביר או למחוק חלקים מהם בזמן שההקלטה נמשכת
+    def __init__(self, path, segment_bytes):
+        super().__init__(path)
+        self.segment_bytes = segment_bytes
+        self.base = None
+        self.segment = 0
+        self.segment_written = 0
+
+    def open(self, name, cancelled=None):
+        self.base = os.path.splitext(name)
+        self._open_segment()
+
+    def _open_segment(self):
+        root, ext = self.base
+        super().open(f"{root}.{self.segment:05d}{ext}")
+        self.segment_written = 0
+
+    def reserve(self, total):
+        pass
+
+    def room(self):
+        if self.segment_written >= self.segment_bytes:
+            self.file.close()
+            self.segment += 1
+            self._open_segment()
+        return self.segment_bytes - self.segment_written
+
+    def wrote(self, count):
+        super().wrote(count)
+        self.segment_written += count
+
+
+def stream_target_path(stream, save_directory, timestamp):
+    target = render_stream_name(stream.target, {"timestamp": timestamp})
+    if stream.sink == "pipe" or os.path.isabs(target):
+        return target
+    return os.path.join(save_directory, target)
+
+
+def open_stream_sink(stream, path):
+    if stream.sink == "pipe":
+        return PipeSink(path)
+    if stream.sink == "segments":
+        return SegmentSink(path, stream.segment_bytes)
+    return FileSink(path)
+
+
+def pump_stream(source, sink, name_ready, cancelled=None, expected_size=None, buffer_size=STREAM_BUFFER_SIZE):
+    # מעביר את stdout של yt-dlp ל-sink. ב-Linux עם os.splice הבתים עוברים מה-pipe לקובץ
+    # בתוך הקרנל; אחרת דרך באפר אחד בגודל קבוע שמשמש שוב ושוב, כך שהזיכרון לא גדל
+    # עם גודל הקובץ. name_ready() מחזיר את שם ה-sink כשהוא ידוע. מחזיר כמה בתים נכתבו.
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    # הגוש הראשון נקרא לבאפר: בלי נתונים (yt-dlp נכשל) לא נוצר קובץ בכלל
+    count = source.readinto(view)
+    if not count:
+        return 0
+    sink.open(name_ready(), cancelled)
+    pending = view[:count]
+    use_splice = hasattr(os, "splice")
+    fd_in = source.fileno()
+    while True:
+        if expected_size is not None and expected_size():
+            sink.reserve(expected_size())
+        room = sink.room()
+        if pending:
+            chunk = pending[:room] if room is not None else pending
+            written = sink.file.write(chunk)
+            sink.wrote(written)
+            pending = pending[written:]
+            continue
+        size = min(buffer_size, room) if room is not None else buffer_size
+        if use_splice:
+            try:
+                count = os.splice(fd_in, sink.file.fileno(), size)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                # ה-sink לא תומך ב-splice (למשל מערכות קבצים מסוימות); עוברים לבאפר
+                use_splice = False
+                continue
+            if not count:
+                break
+            sink.wrote(count)
+        else:
+            count = source.readinto(view[:size])
+            if not count:
+                break
+            pending = view[:count]
+    return sink.written
+
+
+DEFAULT_MAX_WORKERS = 3
+DEFAULT_MAX_PER_HOST = 2
+# סך החיבורים של כל ההורדות הפעילות (מקטעים במקביל, חיבורי aria2c). 0 = ללא הגבלה.
+DEFAULT_MAX_CONNECTIONS = 16
+
+YOUTUBE_HOSTS = ("youtube.com", "youtube-nocookie.com")
+YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+YOUTUBE_PATH_RE = re.compile(r"^/(?:shorts|embed|live|v)/([^/]+)")
+BARE_HOST_PREFIXES = ("www.", "m.", "youtube.com/", "youtu.be/", "music.youtube.com/")
+
+ImportResult = namedtuple("ImportResult", "urls accepted duplicates invalid")
+
+
+def host_key(url):
+    host = (urlsplit(url).hostname or "").lower()
+    for prefix in ("www.", "m.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    if host == "youtu.be":
+        host = "youtube.com"
+    return host
+
+
+def canonicalize_url(url):
+    # מחזיר (מפתח ייחודי, קישור קנוני), או None לקישור לא תקין.
+    # קישורי סרטונים של YouTube בכל צורותיהם מתכנסים למזהה הסרטון.
+    url = url.strip().strip("\"'<>")
+    if not url:
+        return None
+    if "://" not in url:
+        if not url.lower().startswith(BARE_HOST_PREFIXES):
+            return None
+        url = "https://" + url
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return None
+    
+    host = host_key(url)
+    video_id = None
+    if (parts.hostname or "").lower() == "youtu.be":
+        video_id = parts.path.strip("/").split("/")[0]
+    elif host in YOUTUBE_HOSTS:
+        if parts.path.rstrip("/") == "/watch":
+            video_id = parse_qs(parts.query).get("v", [""])[0]
+        else:
+            match = YOUTUBE_PATH_RE.match(parts.path)
+            if match:
+                video_id = match.group(1)
+    if video_id is not None:
+        if not YOUTUBE_ID_RE.match(video_id):
+            return None
+        return f"youtube:{video_id}", f"https://www.youtube.com/watch?v={video_id}"
+    
+    canonical = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+    return f"{host}{parts.path.rstrip('/')}?{parts.query}", canonical
+
+
+def collect_links(candidates, seen=None):
+    seen = set() if seen is None else seen
+    urls = []
+    duplicates = 0
+    invalid = 0
+    for candidate in candidates:
+        if not candidate or not candidate.strip():
+            continue
+        result = canonicalize_url(candidate)
+        if result is None:
+            invalid += 1
+            continue
+        key, url = result
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        urls.append(url)
+    return ImportResult(urls, len(urls), duplicates, invalid)
+
+
+LINK_COLUMNS = ("url", "webpage_url", "link")
+
+
+def iter_csv_links(rows):
+    # ייצוא CSV רגיל הוא שורת כותרת ועמודות של כותרת, תאריך וערוץ לצד הקישור. שורה
+    # ראשונה בלי קישור היא כותרת, ואם יש בה עמודת url/link לוקחים רק אותה. אחרת כל
+    # תא שהוא קישור נלקח, ושורה שאין בה אף קישור נספרת פעם אחת בין הלא תקינים.
+    column = None
+    header = True
+    for row in rows:
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        links = [cell for cell in cells if canonicalize_url(cell) is not None]
+        if header:
+            header = False
+            if not links:
+                names = [cell.lower() for cell in cells]
+                column = next((names.index(name) for name in LINK_COLUMNS if name in names), None)
+                continue
+        if column is not None and column < len(cells) and cells[column]:
+            yield cells[column]
+        elif column is None and links:
+            yield from links
+        else:
+            yield next(cell for cell in cells if cell)
+
+
+def iter_link_file(path):
+    # קורא את הקובץ בזרימה, שורה אחר שורה, בלי לטעון אותו כולו לזיכרון
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8-sig", errors="replace", newline="") as f:
+        if ext == ".csv":
+            yield from iter_csv_links(csv.reader(f))
+        elif ext in (".jsonl", ".ndjson"):
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    yield line
+                    continue
+                if isinstance(record, dict):
+                    yield record.get("url") or record.get("webpage_url") or record.get("link") or "-"
+                else:
+                    yield record if isinstance(record, str) else "-"
+        else:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                yield from line.split(",")
+
+
+def archive_id(url):
+    result = canonicalize_url(url)
+    if result is None or not result[0].startswith("youtube:"):
+        return None
+    return "youtube " + result[0].split(":", 1)[1]
+
+
+class DownloadArchive:
+    # ארכיון בפורמט של --download-archive של yt-dlp ("extractor id" בכל שורה).
+    # yt-dlp עצמו כותב לקובץ; כאן הוא נטען פעם אחת לסט בזיכרון לבדיקה ב-O(1)
+    # לפני שמריצים תהליך או פונים לרשת.
+    def __init__(self, path=ARCHIVE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._ids.add(line)
+
+    def __contains__(self, entry):
+        return entry in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def remember(self, entry):
+        with self._lock:
+            self._ids.add(entry)
+
+    def args(self):
+        return ["--download-archive", self.path]
+
+
+OUTPUT_LAYOUTS = ("title", "store")
+STORE_DIR_NAME = ".replica-store"
+STORE_TEMP_DIR = ".tmp"
+STORE_TEMPLATE = "%(extractor_key)s/%(id)s.{key}.%(ext)s"
+STORE_RESULT_TEMPLATE = "%(.{filepath,title,id,extractor_key})j"
+STORE_NAME_MAX = 150
+HASH_CHUNK = 1024 * 1024
+FICLONE = 0x40049409
+# אפשרויות שמשנות רק את אופן ההורדה ולא את הקובץ שמתקבל, ולכן לא נכנסות למפתח הפורמט
+TRANSPORT_OPTIONS = {"--no-check-certificate": 0, "--concurrent-fragments": 1, "-N": 1, "--downloader": 1,
+                     "--downloader-args": 1, "--limit-rate": 1}
+
+StoredFile = namedtuple("StoredFile", "video format_key path size sha256 title")
+
+
+def format_key(format_option):
+    args = []
+    skip = 0
+    for arg in format_option[1:]:
+        if skip:
+            skip -= 1
+        elif arg in TRANSPORT_OPTIONS:
+            skip = TRANSPORT_OPTIONS[arg]
+        else:
+            args.append(arg)
+    return hashlib.sha1(json.dumps(args).encode("utf-8")).hexdigest()[:10]
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def safe_filename(name, max_length=STORE_NAME_MAX):
+    # תווים שאסורים במערכות קבצים נפוצות מוחלפים, והשם מקוצר; נקודות ורווחים בסוף
+    # נכשלים ב-Windows
+    name = UNSAFE_NAME_RE.sub("_", name).strip()
+    return name[:max_length].rstrip(". ") or "video"
+
+
+def link_file(source, target):
+    # hardlink, אחרת reflink (העתקה בלי לשכפל בלוקים, ב-btrfs/XFS), אחרת העתקה.
+    # הקישור נוצר בשם זמני ומוחלף בשם הסופי ב-rename אטומי.
+    temporary = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    method = "hardlink"
+    try:
+        try:
+            os.link(source, temporary)
+        except OSError:
+            method = "reflink"
+            try:
+                import fcntl
+                with open(source, "rb") as src, open(temporary, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except (ImportError, OSError):
+                method = "copy"
+                shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    except OSError:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return method
+
+
+def output_store_root(config, save_directory):
+    # תיקיית המאגר כשפריסת הפלט היא store, או None לפריסה לפי כותרת
+    layout = config.get("output_layout", "title")
+    if layout not in OUTPUT_LAYOUTS:
+        raise ValueError(f"output_layout חייב להיות אחד מ-{', '.join(OUTPUT_LAYOUTS)}")
+    if layout == "title":
+        return None
+    return config.get("store_dir") or os.path.join(save_directory, STORE_DIR_NAME)
+
+
+def output_store_from_config(config, save_directory):
+    root = output_store_root(config, save_directory)
+    return OutputStore(root) if root is not None else None
+
+
+class OutputStore:
+    # מאגר קבצים לפי מזהה סרטון ופורמט: root/<extractor>/<id>.<מפתח פורמט>.<ext>,
+    # עם אינדקס SQLite של נתיב, גודל ו-sha256. yt-dlp כותב לתיקייה זמנית בתוך המאגר
+    # ומעביר את הקובץ הגמור ב-rename, ובתיקיית השמירה נוצר קישור "כותרת [id].ext".
+    # סרטון שכבר קיים במאגר באותו פורמט מקושר במקום להיות מורד שוב.
+    def __init__(self, root, index_path=STORE_FILE):
+        self.root = root
+        self.temp_dir = os.path.join(root, STORE_TEMP_DIR)
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " video TEXT NOT NULL,"
+            " format_key TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " sha256 TEXT NOT NULL,"
+            " title TEXT,"
+            " added REAL NOT NULL,"
+            " PRIMARY KEY (video, format_key))"
+        )
+
+    def template(self, key):
+        return STORE_TEMPLATE.format(key=key)
+
+    def args(self, result_path):
+        # התבנית יחסית, כדי ש-yt-dlp יכתוב ל-temp ויעביר ל-home רק בסיום
+        return ["-P", f"home:{self.root}", "-P", f"temp:{self.temp_dir}",
+                "--print-to-file", f"after_move:{STORE_RESULT_TEMPLATE}", result_path]
+
+    def params(self, result_path):
+        # המקבילה של args() למופע YoutubeDL שרץ בתוך התהליך
+        return {"paths": {"home": self.root, "temp": self.temp_dir},
+                "print_to_file": {"after_move": [(STORE_RESULT_TEMPLATE, result_path)]}}
+
+    def result_file(self):
+        fd, path = tempfile.mkstemp(suffix=".json", dir=self.temp_dir)
+        os.close(fd)
+        return path
+
+    def lookup(self, video, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT video, format_key, path, size, sha256, title FROM files WHERE video = ? AND format_key = ?",
+                (video, key)
+            ).fetchone()
+        if row is None:
+            return None
+        stored = StoredFile(*row)
+        try:
+            if os.path.getsize(stored.path) == stored.size:
+                return stored
+        except OSError:
+            pass
+        # הקובץ נמחק או השתנה מחוץ למאגר
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE video = ? AND format_key = ?", (video, key))
+        return None
+
+    def add(self, path, key, video, title):
+        stored = StoredFile(video, key, os.path.abspath(path), os.path.getsize(path), file_checksum(path), title)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (video, format_key, path, size, sha256, title, added)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)", stored + (time.time(),)
+            )
+        return stored
+
+    def add_result(self, result_path, key):
+        # קורא את השורה ש-yt-dlp כתב אחרי העברת הקובץ (--print-to-file after_move)
+        try:
+            with open(result_path, encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            info = json.loads(lines[-1])
+            video = f"{info['extractor_key'].lower()} {info['id']}"
+            return self.add(info["filepath"], key, video, info.get("title") or info["id"])
+        except (OSError, ValueError, IndexError, KeyError, TypeError, AttributeError):
+            return None
+        finally:
+            try:
+                os.remove(result_path)
+            except OSError:
+                pass
+
+    def link(self, stored, directory):
+        # מחזיר (נתיב, שיטה); קישור קיים לאותו קובץ לא נוצר מחדש
+        video_id = stored.video.split(" ", 1)[-1]
+        ext = os.path.splitext(stored.path)[1]
+        name = f"{safe_filename(stored.title or video_id)} [{safe_filename(video_id, 64)}]"
+        target = os.path.join(directory, name + ext)
+        if os.path.exists(target):
+            if self._same_content(stored, target):
+                return target, None
+            # קובץ אחר באותו שם (פורמט אחר של אותו סרטון) לא נדרס
+            target = os.path.join(directory, f"{name}.{stored.format_key}{ext}")
+            if os.path.exists(target) and self._same_content(stored, target):
+                return target, None
+        return target, link_file(stored.path, target)
+
+    @staticmethod
+    def _same_content(stored, path):
+        # קישור קשיח הוא אותו קובץ; העתקה או reflink מזוהים לפי גודל ו-sha256
+        if os.path.samefile(stored.path, path):
+            return True
+        return os.path.getsize(path) == stored.size and file_checksum(path) == stored.sha256
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._conn = CLOSED_CONNECTION
+
+
+EXPANSION_WORKERS = 4
+EXPANSION_TTL = 6 * 60 * 60
+YOUTUBE_CHANNEL_RE = re.compile(r"^(/(?:@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+))(?:/([^/]*))?/?$")
+CHANNEL_TABS = ("videos", "shorts", "streams")
+
+
+def collection_url(url):
+    # מחזיר (סוג, קישור להרחבה) עבור פלייליסט או ערוץ של YouTube, או None.
+    # ערוץ בלי לשונית מופנה ל-/videos כדי שהרשומות יהיו סרטונים ולא לשוניות.
+    parts = urlsplit(url)
+    if host_key(url) not in YOUTUBE_HOSTS:
+        return None
+    path = parts.path.rstrip("/")
+    if path == "/playlist" and parse_qs(parts.query).get("list"):
+        return "playlist", url
+    match = YOUTUBE_CHANNEL_RE.match(parts.path)
+    if match is None:
+        return None
+    tab = match.group(2) if match.group(2) in CHANNEL_TABS else "videos"
+    return "channel", f"https://www.youtube.com{match.group(1)}/{tab}"
+
+
+class ExpansionCache:
+    # מטמון על הדיסק של רשימות שטוחות (id, קישור, כותרת) של פלייליסטים וערוצים,
+    # ושל הפורמט שנמצא עובד לכל סרטון ופרופיל (FormatProber)
+    def __init__(self, path=METADATA_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS expansions ("
+            " url TEXT PRIMARY KEY,"
+            " fetched REAL NOT NULL,"
+            " entries TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS format_probes ("
+            " video TEXT NOT NULL,"
+            " selector TEXT NOT NULL,"
+            " probed REAL NOT NULL,"
+            " format_id TEXT NOT NULL,"
+            " PRIMARY KEY (video, selector))"
+        )
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fetched, entries FROM expansions WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None, []
+        return row[0], json.loads(row[1])
+
+    def put(self, url, entries):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO expansions (url, fetched, entries) VALUES (?, ?, ?)",
+                (url, time.time(), json.dumps(entries, ensure_ascii=False))
+            )
+
+    def get_format(self, video, selector):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT probed, format_id FROM format_probes WHERE video = ? AND selector = ?", (video, selector)
+            ).fetchone()
+        return (None, None) if row is None else row
+
+    def put_format(self, video, selector, format_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO format_probes (video, selector, probed, format_id) VALUES (?, ?, ?, ?)",
+                (video, selector, time.time(), format_id)
+            )
+
+    def forget_format(self, video, selector):
+        with self._lock:
+            self._conn.execute("DELETE FROM format_probes WHERE video = ? AND selector = ?", (video, selector))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._conn = CLOSED_CONNECTION
+
+
+def _entry_from_info(info):
+    video_id = info.get("id")
+    url = info.get("webpage_url") or info.get("url") or ""
+    if not video_id:
+        return None
+    result = canonicalize_url(url) if url else None
+    if result is not None:
+        url = result[1]
+    elif info.get("ie_key") == "Youtube":
+        url = f"https://www.youtube.com/watch?v={video_id}"
+    if not url:
+        return None
+    return [video_id, url, info.get("title") or "", info.get("upload_date")]
+
+
+class PlaylistExpander:
+    # פורש פלייליסטים וערוצים לסרטונים בודדים (flat extraction). כשהמטמון טרי
+    # הוא משמש כמו שהוא; אחרת ערוץ (מהחדש לישן) נסרק רק עד הסרטון המוכר הראשון.
+    def __init__(self, cache, in_process=True, ttl=EXPANSION_TTL):
+        self.cache = cache
+        self.in_process = in_process and load_yt_dlp() is not None
+        self.ttl = ttl
+
+    def expand(self, url, format_option):
+        kind, expand_url = collection_url(url)
+        fetched, cached = self.cache.get(expand_url)
+        if fetched is not None and time.time() - fetched < self.ttl:
+            return cached
+        
+        known = {entry[0] for entry in cached} if kind == "channel" else set()
+        fresh = self.fetch(expand_url, format_option, known)
+        if fresh is None:
+            return cached or None
+        
+        fresh_ids = {entry[0] for entry in fresh}
+        entries = fresh + [entry for entry in cached if entry[0] not in fresh_ids] if known else fresh
+        self.cache.put(expand_url, entries)
+        return entries
+
+    def fetch(self, url, format_option, known=(), date_after=None, limit=None):
+        # רשימה שטוחה טרייה, בלי מטמון: נעצרת בסרטון המוכר הראשון (known), בסרטון
+        # הראשון שפורסם לפני date_after (YYYYMMDD), או אחרי limit רשומות
+        if self.in_process:
+            return self._expand_in_process(url, format_option, known, date_after, limit)
+        return self._expand_subprocess(url, format_option, known, date_after, limit)
+
+    def _expand_in_process(self, url, format_option, known, date_after=None, limit=None):
+        yt_dlp = load_yt_dlp()
+        entries = []
+        
+        def collect(info, incomplete=False):
+            if "playlist_index" in info:
+                if date_after and (info.get("upload_date") or date_after) < date_after:
+                    raise yt_dlp.utils.RejectedVideoReached(f"{info.get('id')}: older than {date_after}")
+                entry = _entry_from_info(info)
+                if entry is not None:
+                    entries.append(entry)
+            return None
+        
+        args = list(format_option[1:]) + ["--flat-playlist"]
+        if limit:
+            args += ["--playlist-items", f"1:{limit}"]
+        ydl_opts = yt_dlp.parse_options(args).ydl_opts
+        ydl_opts.update(quiet=True, no_warnings=True, noprogress=True, simulate=True, ignoreerrors=False,
+                        lazy_playlist=True, match_filter=collect, logger=YtdlpLogger(lambda line: None))
+        if known:
+            ydl_opts.update(download_archive={f"youtube {video_id}" for video_id in known},
+                            break_on_existing=True)
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                if ydl.extract_info(url, download=False) is None:
+                    return None
+        except (yt_dlp.utils.ExistingVideoReached, yt_dlp.utils.RejectedVideoReached):
+            pass
+        except yt_dlp.utils.YoutubeDLError:
+            return None
+        return entries
+
+    def _expand_subprocess(self, url, format_option, known, date_after=None, limit=None):
+        command = format_option + ["--flat-playlist", "--lazy-playlist", "-j", "--no-warnings"]
+        if limit:
+            command += ["--playlist-items", f"1:{limit}"]
+        if date_after:
+            # רשומה בלי תאריך עוברת את המסנן (=?), כמו בריצה בתוך התהליך
+            command += ["--break-match-filters", f"upload_date >=? {date_after}"]
+        archive_path = None
+        if known:
+            with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as f:
+                f.writelines(f"youtube {video_id}\n" for video_id in known)
+                archive_path = f.name
+            command += ["--download-archive", archive_path, "--break-on-existing"]
+        entries = []
+        
+        def on_line(stream, line):
+            if stream != STDOUT:
+                return
+            try:
+                entry = _entry_from_info(json.loads(line))
+            except ValueError:
+                return
+            if entry is not None:
+                entries.append(entry)
+        
+        try:
+            process = subprocess.Popen(
+                command + [url],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding="utf-8",
+                errors="replace"
+            )
+            exit_code = OutputPump(process, on_line).run()
+        except FileNotFoundError:
+            return None
+        finally:
+            if archive_path is not None:
+                os.remove(archive_path)
+        # 101 הוא קוד היציאה של yt-dlp כשעצר על סרטון שכבר מופיע בארכיון או על מסנן עוצר
+        return entries if exit_code in (0, 101) else None
+
+
+DEFAULT_SYNC_INTERVAL = 24 * 60 * 60
+SYNC_CHECK_INTERVAL = 60.0
+SYNC_WORKERS = 4
+SUBSCRIPTION_SEED = 30
+SUBSCRIPTION_MEMORY = 200
+SUBSCRIPTION_DATE_SLACK = 2 * 24 * 60 * 60
+
+Subscription = namedtuple(
+    "Subscription",
+    "id url kind format_option interval backfill checked last_sync newest_id newest_date seen error"
+)
+SyncResult = namedtuple("SyncResult", "subscription entries error")
+
+
+def _date_before(date, seconds):
+    # YYYYMMDD פחות מרווח ביטחון, כי תאריכי העלאה מדווחים לפי אזור הזמן של האתר
+    try:
+        moment = datetime.strptime(date, "%Y%m%d").timestamp() - seconds
+    except (TypeError, ValueError):
+        return None
+    return datetime.fromtimestamp(moment).strftime("%Y%m%d")
+
+
+class SubscriptionStore:
+    # מינויים לערוצים ולפלייליסטים. לכל מינוי נשמרים הסרטון והתאריך החדשים ביותר
+    # שנראו, ורשימת ה-id שכבר נראו: בערוץ רק האחרונים (הסריקה נעצרת בהם), ובפלייליסט
+    # כולם, כי סרטונים חדשים נוספים בסופו והוא נסרק במלואו.
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " url TEXT NOT NULL UNIQUE,"
+            " kind TEXT NOT NULL,"
+            " format_option TEXT NOT NULL,"
+            " interval REAL NOT NULL,"
+            " backfill INTEGER NOT NULL DEFAULT 0,"
+            " checked REAL,"
+            " last_sync REAL,"
+            " newest_id TEXT,"
+            " newest_date TEXT,"
+            " seen TEXT NOT NULL DEFAULT '[]',"
+            " error TEXT)"
+        )
+
+    def _rows(self, where="", params=()):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, url, kind, format_option, interval, backfill, checked, last_sync, newest_id,"
+                f" newest_date, seen, error FROM subscriptions {where} ORDER BY id", params
+            ).fetchall()
+        return [Subscription(row[0], row[1], row[2], json.loads(row[3]), row[4], row[5], row[6], row[7],
+                             row[8], row[9], json.loads(row[10]), row[11]) for row in rows]
+
+    def add(self, url, format_option, interval=DEFAULT_SYNC_INTERVAL, backfill=0):
+        # מחזיר את המינוי (קיים או חדש), או None כשהקישור אינו פלייליסט או ערוץ
+        result = canonicalize_url(url)
+        if result is None:
+            return None
+        collection = collection_url(result[1])
+        if collection is None:
+            return None
+        kind, url = collection
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO subscriptions (url, kind, format_option, interval, backfill)"
+                " VALUES (?, ?, ?, ?, ?)", (url, kind, json.dumps(format_option), interval, max(backfill, 0))
+            )
+        return self._rows("WHERE url = ?", (url,))[0]
+
+    def remove(self, subscription_id):
+        with self._lock:
+            return self._conn.execute("DELETE FROM subscriptions WHERE id = ?", (subscription_id,)).rowcount > 0
+
+    def get(self, subscription_id):
+        rows = self._rows("WHERE id = ?", (subscription_id,))
+        return rows[0] if rows else None
+
+    def all(self):
+        return self._rows()
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return self._rows("WHERE checked IS NULL OR checked + interval <= ?", (now,))
+
+    def mark_due(self, subscription_id=None):
+        # הסנכרון הבא יבדוק את המינוי (או את כולם) בלי לחכות למרווח
+        with self._lock:
+            if subscription_id is None:
+                self._conn.execute("UPDATE subscriptions SET checked = NULL")
+            else:
+                self._conn.execute("UPDATE subscriptions SET checked = NULL WHERE id = ?", (subscription_id,))
+
+    def record_sync(self, subscription, entries):
+        # entries מהחדש לישן (בערוץ) או לפי סדר הפלייליסט; רק החדשים נשמרים כנראו
+        seen = [entry[0] for entry in entries] + subscription.seen
+        if subscription.kind == "channel":
+            seen = seen[:SUBSCRIPTION_MEMORY]
+            newest = entries[0] if entries else None
+        else:
+            newest = entries[-1] if entries else None
+        dates = [entry[3] for entry in entries if len(entry) > 3 and entry[3]]
+        newest_date = max(dates + ([subscription.newest_date] if subscription.newest_date else []), default=None)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE subscriptions SET checked = ?, last_sync = ?, seen = ?, newest_id = ?,"
+                " newest_date = ?, error = NULL WHERE id = ?",
+                (now, now, json.dumps(seen), newest[0] if newest else subscription.newest_id,
+                 newest_date, subscription.id)
+            )
+
+    def record_error(self, subscription, error):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE subscriptions SET checked = ?, error = ? WHERE id = ?",
+                (time.time(), error, subscription.id)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._conn = CLOSED_CONNECTION
+
+
+class SubscriptionSyncer:
+    # בודק מינויים שהגיע זמנם ומחזיר רק את הסרטונים החדשים. ערוץ נסרק מהחדש לישן
+    # ונעצר בסרטון המוכר הראשון (break-on-existing) או בסרטון שפורסם לפני התאריך
+    # החדש ביותר שנראה (date-after), כך שסנכרון שגרתי עולה בקשה אחת או שתיים לערוץ.
+    # בסנכרון הראשון נרשמים SUBSCRIPTION_SEED הסרטונים האחרונים כבסיס, ומתוכם
+    # מוחזרים רק backfill האחרונים; פלייליסט נרשם במלואו.
+    def __init__(self, store, expander, workers=SYNC_WORKERS):
+        self.store = store
+        self.expander = expander
+        self.workers = workers
+
+    def sync(self, subscriptions, cancelled=None):
+        if not subscriptions:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(subscriptions))) as executor:
+            results = executor.map(lambda subscription: self._sync_one(subscription, cancelled), subscriptions)
+            return [result for result in results if result is not None]
+
+    def sync_due(self, now=None, cancelled=None):
+        return self.sync(self.store.due(now), cancelled)
+
+    def _sync_one(self, subscription, cancelled=None):
+        if cancelled is not None and cancelled():
+            return None
+        first = subscription.last_sync is None
+        known = set(subscription.seen)
+        if first and subscription.kind == "channel":
+            fresh = self.expander.fetch(subscription.url, subscription.format_option,
+                                        limit=max(SUBSCRIPTION_SEED, subscription.backfill))
+        elif subscription.kind == "channel":
+            fresh = self.expander.fetch(subscription.url, subscription.format_option, known,
+                                        date_after=_date_before(subscription.newest_date, SUBSCRIPTION_DATE_SLACK))
+        else:
+            fresh = self.expander.fetch(subscription.url, subscription.format_option)
+        if fresh is None:
+            error = "לא ניתן לקרוא את רשימת הסרטונים"
+            self.store.record_error(subscription, error)
+            return SyncResult(subscription, [], error)
+        
+        entries = []
+        for entry in fresh:
+            if entry[0] not in known:
+                known.add(entry[0])
+                entries.append(entry)
+        self.store.record_sync(subscription, entries)
+        if first:
+            backfill = subscription.backfill
+            if subscription.kind == "channel":
+                entries = entries[:backfill]
+            else:
+                entries = entries[len(entries) - backfill:] if backfill else []
+        return SyncResult(subscription, entries, None)
+
+
+class SubscriptionScheduler:
+    # חוט רקע שבודק כל SYNC_CHECK_INTERVAL שניות אילו מינויים הגיע זמנם, ומעביר
+    # את הסרטונים החדשים ל-on_entries(subscription, entries)
+    def __init__(self, syncer, on_entries, on_error=None, check_interval=SYNC_CHECK_INTERVAL):
+        self.syncer = syncer
+        self.on_entries = on_entries
+        self.on_error = on_error
+        self.check_interval = check_interval
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for result in self.syncer.sync_due(cancelled=self._stop.is_set):
+                if result.error and self.on_error is not None:
+                    self.on_error(result.subscription, result.error)
+                elif result.entries:
+                    self.on_entries(result.subscription, result.entries)
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+
+
+PROBE_TTL = 24 * 60 * 60
+PROBE_TIMEOUT = 10.0
+
+
+def split_format_selector(selector):
+    # מפצל בורר פורמטים לחלופות שברמה העליונה (ה-/ שמחוץ לסוגריים)
+    alternatives = []
+    current = ""
+    depth = 0
+    for char in selector:
+        if char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+        if char == "/" and depth == 0:
+            alternatives.append(current)
+            current = ""
+        else:
+            current += char
+    alternatives.append(current)
+    return [alternative.strip() for alternative in alternatives if alternative.strip()]
+
+
+def format_selector_of(format_option):
+    for flag in ("-f", "--format"):
+        if flag in format_option[:-1]:
+            return format_option[format_option.index(flag) + 1]
+    return "ba/b" if "-x" in format_option else "bv*+ba/b"
+
+
+def with_format(format_option, selector):
+    format_option = list(format_option)
+    for flag in ("-f", "--format"):
+        if flag in format_option[:-1]:
+            format_option[format_option.index(flag) + 1] = selector
+            return format_option
+    return format_option + ["-f", selector]
+
+
+def _stream_url(fmt):
+    return fmt.get("url") or fmt.get("manifest_url") or fmt.get("fragment_base_url")
+
+
+def _probe_request_headers(fmt):
+    headers = dict(fmt.get("http_headers") or {})
+    if fmt.get("protocol") in ("http", "https"):
+        headers["Range"] = "bytes=0-0"
+    return headers
+
+
+class FormatProber:
+    # בודק לפני ההורדה איזו חלופה בשרשרת הפורמטים באמת נגישה (בקשה קצרה לכל זרם),
+    # כדי שברשת מסוננת לא יתבזבז ניסיון שלם על איכות שתיכשל באמצע. התוצאה נשמרת
+    # לכל סרטון ובורר, כך שניסיון חוזר או הורדה חוזרת לא בודקים שוב.
+    def __init__(self, cache, in_process=True, ttl=PROBE_TTL):
+        self.cache = cache
+        self.in_process = in_process and load_yt_dlp() is not None
+        self.ttl = ttl
+
+    def resolve(self, url, format_option):
+        # מחזיר (format_option עם מזהה הפורמט שנבחר, מפתח לביטול הזיכרון) או את המקור כשאין תוצאה
+        key = canonicalize_url(url)
+        if key is None:
+            return format_option, None
+        selector = format_selector_of(format_option)
+        probed, format_id = self.cache.get_format(key[0], selector)
+        if probed is None or time.time() - probed >= self.ttl:
+            alternatives = split_format_selector(selector)
+            if self.in_process:
+                format_id = self._probe_in_process(key[1], format_option, alternatives)
+            else:
+                format_id = self._probe_subprocess(key[1], format_option, alternatives)
+            if format_id is None:
+                return format_option, None
+            self.cache.put_format(key[0], selector, format_id)
+        return with_format(format_option, format_id), (key[0], selector)
+
+    def forget(self, probe_key):
+        # הפורמט שנבחר נכשל בהורדה עצמה; בניסיון הבא הבדיקה תרוץ מחדש
+        self.cache.forget_format(*probe_key)
+
+    def _probe_in_process(self, url, format_option, alternatives):
+        yt_dlp = load_yt_dlp()
+        from yt_dlp.networking import Request
+        
+        ydl_opts = yt_dlp.parse_options(list(format_option[1:])).ydl_opts
+        ydl_opts.update(quiet=True, no_warnings=True, noprogress=True, simulate=True, noplaylist=True,
+                        socket_timeout=PROBE_TIMEOUT, logger=YtdlpLogger(lambda line: None))
+        
+        def reachable(ydl, fmt):
+            stream_url = _stream_url(fmt)
+            if not stream_url:
+                return True
+            try:
+                with ydl.urlopen(Request(stream_url, headers=_probe_request_headers(fmt))) as response:
+                    response.read(1)
+                return True
+            except (yt_dlp.utils.YoutubeDLError, OSError):
+                return False
+        
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(url, download=False, process=False)
+                if info is None or info.get("_type", "video") != "video":
+                    return None
+                for alternative in alternatives:
+                    ydl.format_selector = ydl.build_format_selector(alternative)
+                    try:
+                        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+                    except yt_dlp.utils.YoutubeDLError:
+                        continue
+                    formats = selected.get("requested_formats") or [selected]
+                    if selected.get("format_id") and all(reachable(ydl, fmt) for fmt in formats):
+                        return selected["format_id"]
+        except (yt_dlp.utils.YoutubeDLError, SyntaxError):
+            return None
+        return None
+
+    def _probe_subprocess(self, url, format_option, alternatives):
+        insecure = "--no-check-certificate" in format_option
+        for alternative in alternatives:
+            try:
+                result = subprocess.run(
+                    with_format(format_option, alternative) + ["-J", "--no-warnings", "--no-playlist", url],
+                    capture_output=True, text=True, encoding="utf-8", errors="replace",
+                    timeout=PROBE_TIMEOUT * 3
+                )
+                selected = json.loads(result.stdout) if result.returncode == 0 else None
+            except (OSError, ValueError, subprocess.TimeoutExpired):
+                return None
+            if not selected or not selected.get("format_id"):
+                continue
+            formats = selected.get("requested_formats") or [selected]
+            if all(_reachable_http(fmt, insecure) for fmt in formats):
+                return selected["format_id"]
+        return None
+
+
+def _reachable_http(fmt, insecure=False):
+    import http.client
+    import ssl
+    import urllib.request
+    
+    stream_url = _stream_url(fmt)
+    if not stream_url:
+        return True
+    request = urllib.request.Request(stream_url, headers=_probe_request_headers(fmt))
+    context = ssl._create_unverified_context() if insecure else None
+    try:
+        with urllib.request.urlopen(request, timeout=PROBE_TIMEOUT, context=context) as response:
+            response.read(1)
+        return True
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+
+
+THUMBNAIL_DIR = os.path.join(APP_DATA_DIR, "thumbnails")
+MEDIA_CACHE_BYTES = 200 * 1024 * 1024
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_MAX_BYTES = 512 * 1024
+METADATA_WORKERS = 2
+METADATA_PENDING_LIMIT = 200
+
+
+def format_label(format_option):
+    # תיאור קצר של הפורמט של פריט בתור, לתצוגה
+    options = [option for option in format_option[1:] if option != "--no-check-certificate"]
+    for kind, kind_options in FORMAT_KINDS.items():
+        if options == kind_options:
+            return kind
+    if "--audio-format" in options[:-1]:
+        return options[options.index("--audio-format") + 1]
+    heights = re.findall(r"height<=(\d+)", format_selector_of(format_option))
+    return f"≤{heights[0]}p" if heights else "custom"
+
+
+def _info_size(info):
+    formats = info.get("requested_formats") or [info]
+    sizes = [fmt.get("filesize") or fmt.get("filesize_approx") for fmt in formats]
+    return sum(sizes) if all(sizes) else None
+
+
+def _thumbnail_url(info):
+    thumbnails = [t for t in info.get("thumbnails") or [] if t.get("url")]
+    sized = sorted((t for t in thumbnails if t.get("width")), key=lambda t: t["width"])
+    for thumbnail in sized:
+        if thumbnail["width"] >= THUMBNAIL_WIDTH:
+            return thumbnail["url"]
+    if sized:
+        return sized[-1]["url"]
+    return info.get("thumbnail") or (thumbnails[-1]["url"] if thumbnails else None)
+
+
+def _media_from_info(info):
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "size": _info_size(info),
+        "thumbnail_url": _thumbnail_url(info),
+    }
+
+
+class MediaCache:
+    # מטמון LRU על הדיסק של מטא-דאטה (כותרת, משך, גודל) ותמונות ממוזערות של סרטונים,
+    # עם תקרת גודל כוללת. הרשומות שלא נקראו הכי הרבה זמן נמחקות ראשונות.
+    def __init__(self, path=METADATA_FILE, directory=THUMBNAIL_DIR, max_bytes=MEDIA_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            " video TEXT PRIMARY KEY,"
+            " info TEXT NOT NULL,"
+            " thumbnail TEXT,"
+            " size INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS media_accessed ON media (accessed)")
+        self._total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM media").fetchone()[0]
+
+    def get(self, video):
+        # מחזיר (מטא-דאטה, נתיב תמונה) או (None, None)
+        with self._lock:
+            row = self._conn.execute("SELECT info, thumbnail FROM media WHERE video = ?", (video,)).fetchone()
+            if row is None:
+                return None, None
+            self._conn.execute("UPDATE media SET accessed = ? WHERE video = ?", (time.time(), video))
+        thumbnail = os.path.join(self.directory, row[1]) if row[1] else None
+        return json.loads(row[0]), thumbnail
+
+    def put(self, video, info, thumbnail_data=None):
+        data = json.dumps(info, ensure_ascii=False)
+        name = None
+        if thumbnail_data:
+            name = hashlib.sha1(video.encode("utf-8")).hexdigest() + ".jpg"
+            path = os.path.join(self.directory, name)
+            with open(path + ".tmp", "wb") as f:
+                f.write(thumbnail_data)
+            os.replace(path + ".tmp", path)
+        size = len(data.encode("utf-8")) + len(thumbnail_data or b"")
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM media WHERE video = ?", (video,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (video, info, thumbnail, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (video, data, name, size, time.time())
+            )
+            self._total += size - (old[0] if old else 0)
+            self._evict()
+        return os.path.join(self.directory, name) if name else None
+
+    def _evict(self):
+        while self._total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT video, thumbnail, size FROM media ORDER BY accessed LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self._total = 0
+                return
+            for video, thumbnail, size in rows:
+                if thumbnail:
+                    try:
+                        os.remove(os.path.join(self.directory, thumbnail))
+                    except OSError:
+                        pass
+                self._conn.execute("DELETE FROM media WHERE video = ?", (video,))
+                self._total -= size
+                if self._total <= self.max_bytes:
+                    return
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._conn = CLOSED_CONNECTION
+
+
+def _extract_media(url, format_option):
+    # רץ בתהליך נפרד של MetadataFetcher; מחזיר רק את השדות הנחוצים לתצוגה
+    yt_dlp = load_yt_dlp()
+    if yt_dlp is None:
+        return None
+    ydl_opts = yt_dlp.parse_options(list(format_option[1:])).ydl_opts
+    ydl_opts.update(quiet=True, no_warnings=True, noprogress=True, simulate=True, noplaylist=True,
+                    logger=YtdlpLogger(lambda line: None))
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.YoutubeDLError:
+        return None
+    return _media_from_info(info) if info is not None else None
+
+
+class MetadataFetcher:
+    # מביא ברקע מטא-דאטה ותמונה ממוזערת רק לפריטים שהתבקשו (השורות הגלויות בתצוגה).
+    # הבקשה האחרונה מטופלת ראשונה; בקשות ישנות שנדחקו מהתור נזנחות (on_dropped)
+    # ויתבקשו שוב אם השורה תחזור להיות גלויה. החילוץ עצמו רץ בתהליכים נפרדים:
+    # yt-dlp בתוך התהליך מחזיק את ה-GIL ומקפיא את גלילת הממשק.
+    def __init__(self, cache, on_result, in_process=True, workers=METADATA_WORKERS, on_dropped=None):
+        self.cache = cache
+        self.on_result = on_result
+        self.on_dropped = on_dropped
+        # בדיקה בלי import: ייבוא yt_dlp כאן היה מעכב את פתיחת החלון
+        self.in_process = in_process and yt_dlp_installed()
+        self.workers = workers
+        self._pending = deque()
+        self._requested = set()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._pool = None
+        self._closed = False
+
+    def request(self, video, url, format_option):
+        # מחזיר מיד מה שיש במטמון; אחרת מתזמן הבאה ומחזיר (None, None)
+        info, thumbnail = self.cache.get(video)
+        if info is not None:
+            return info, thumbnail
+        dropped = []
+        with self._condition:
+            if video in self._requested or self._closed:
+                return None, None
+            self._requested.add(video)
+            self._pending.appendleft((video, url, format_option))
+            while len(self._pending) > METADATA_PENDING_LIMIT:
+                dropped.append(self._pending.pop()[0])
+                self._requested.discard(dropped[-1])
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        if self.on_dropped is not None:
+            for video in dropped:
+                self.on_dropped(video)
+        return None, None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                video, url, format_option = self._pending.popleft()
+            try:
+                if self.in_process:
+                    media = self._executor().submit(_extract_media, url, format_option).result()
+                else:
+                    media = self._fetch_subprocess(url, format_option)
+            except Exception:
+                # ה-pool נסגר או שתהליך העבודה קרס
+                media = None
+            thumbnail = None
+            if media is not None:
+                try:
+                    thumbnail = self.cache.put(video, media, self._fetch_thumbnail(media["thumbnail_url"]))
+                except (OSError, sqlite3.Error):
+                    pass
+            if not self._closed:
+                self.on_result(video, media, thumbnail)
+
+    def _executor(self):
+        with self._condition:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn ולא fork: התהליך הראשי מריץ threads (ו-Qt)
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _fetch_subprocess(self, url, format_option):
+        try:
+            result = subprocess.run(
+                format_option + ["-J", "--no-warnings", "--no-playlist", url],
+                capture_output=True, text=True, encoding="utf-8", errors="replace", timeout=60
+            )
+            info = json.loads(result.stdout) if result.returncode == 0 else None
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            return None
+        return _media_from_info(info) if info else None
+
+    def _fetch_thumbnail(self, url):
+        import http.client
+        import urllib.request
+        
+        if not url:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT) as response:
+                data = response.read(THUMBNAIL_MAX_BYTES + 1)
+        except (OSError, ValueError, http.client.HTTPException):
+            return None
+        return data if len(data) <= THUMBNAIL_MAX_BYTES else None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._condition.notify_all()
+            pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+DEFAULT_MAX_RETRIES = 3
+RETRY_BASE_DELAY = 2.0
+RATE_LIMIT_BASE_DELAY = 15.0
+RETRY_MAX_DELAY = 300.0
+
+TRANSIENT = "transient"
+RATE_LIMITED = "rate_limited"
+PERMANENT = "permanent"
+
+# הסדר חשוב: שגיאות קבועות נבדקות לפני הדפוסים הכלליים של שגיאות רשת
+FAILURE_PATTERNS = [
+    (PERMANENT, re.compile(
+        r"Video unavailable|Private video|This video is not available|Unsupported URL|"
+        r"HTTP Error 404|Incomplete YouTube ID|is not a valid URL|Sign in to confirm your age|"
+        r"members-only|copyright|Requested format is not available|CERTIFICATE_VERIFY_FAILED",
+        re.IGNORECASE)),
+    (RATE_LIMITED, re.compile(r"HTTP Error 429|Too Many Requests|rate.?limit", re.IGNORECASE)),
+    (TRANSIENT, re.compile(
+        r"HTTP Error (?:403|5\d\d)|Connection (?:reset|refused|aborted)|timed? ?out|"
+        r"Temporary failure in name resolution|Name or service not known|Remote end closed|"
+        r"IncompleteRead|EOF occurred|SSL|TransportError|Unable to download (?:webpage|API page)|"
+        r"Got error|fragment",
+        re.IGNORECASE)),
+]
+
+Retry = namedtuple("Retry", "delay host_cooldown")
+
+
+def classify_failure(error_output):
+    for failure_class, pattern in FAILURE_PATTERNS:
+        if pattern.search(error_output or ""):
+            return failure_class
+    return PERMANENT
+
+
+def retry_delay(attempt, failure_class):
+    base = RATE_LIMIT_BASE_DELAY if failure_class == RATE_LIMITED else RETRY_BASE_DELAY
+    delay = min(base * (2 ** attempt), RETRY_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+RATE_RE = re.compile(r"^(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?$", re.IGNORECASE)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+SCHEDULE_CHECK_INTERVAL = 30.0
+POSTPROCESS_POLL = 0.25
+# שלבי הזמן של כל ניסיון הורדה, לפי הסדר: המתנה בתור, הפעלת yt-dlp (או קבלת מופע חם),
+# חילוץ מטא-דאטה (כולל בדיקת הפורמטים), הורדה, המתנה לעיבוד, עיבוד ffmpeg והעברת הקבצים
+STAGES = ("queue_wait", "spawn", "extract", "download", "queued", "postprocess", "move")
+STAGE_LABELS = {
+    "queue_wait": "המתנה בתור", "spawn": "הפעלה", "extract": "חילוץ מידע", "download": "הורדה",
+    "queued": "המתנה לעיבוד", "postprocess": "עיבוד", "move": "העברת קבצים",
+}
+# מפתחות ה-postprocessors של yt-dlp שמריצים ffmpeg (pp_key() בלי הקידומת FFmpeg),
+# כפי שהם מופיעים גם ב-hooks וגם בתחילת שורות הפלט, למשל "[Merger] Merging formats"
+FFMPEG_POSTPROCESSORS = (
+    r"Merger|ExtractAudio|VideoConvertor|VideoRemuxer|EmbedSubtitle|EmbedThumbnail|Metadata|"
+    r"Fixup\w+|CopyStream|SubtitlesConvertor|ThumbnailsConvertor|SplitChapters|Concat"
+)
+FFMPEG_POSTPROCESSOR_RE = re.compile(rf"(?:{FFMPEG_POSTPROCESSORS})$")
+POSTPROCESS_LINE_RE = re.compile(rf"^\[(?:{FFMPEG_POSTPROCESSORS})\]")
+MOVE_POSTPROCESSOR_RE = re.compile(r"MoveFiles(?:AfterDownload)?$")
+MOVE_LINE_RE = re.compile(r"^\[MoveFiles(?:AfterDownload)?\] Moving file")
+
+ScheduleRule = namedtuple("ScheduleRule", "days start end rate_limit max_postprocess")
+
+
+def parse_rate(value):
+    # "5M", "500K", "1.5m" או מספר בתים לשנייה. 0 או ריק = ללא הגבלה.
+    if value is None or value == "":
+        return 0
+    if isinstance(value, (int, float)):
+        return max(int(value), 0)
+    match = RATE_RE.match(value.strip())
+    if match is None:
+        raise ValueError(f"invalid rate: {value!r}")
+    return int(float(match.group(1)) * 1024 ** " kmg".index(match.group(2).lower() or " "))
+
+
+def _parse_clock(text):
+    hours, minutes = text.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError
+    return hours * 60 + minutes
+
+
+def _parse_days(text):
+    days = set()
+    for part in text.lower().split(","):
+        first, _, last = part.partition("-")
+        start = WEEKDAYS.index(first)
+        end = WEEKDAYS.index(last) if last else start
+        days.update((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+    return frozenset(days)
+
+
+def parse_schedule_rule(text):
+    # "mon-fri 09:00-18:00 rate=2M pp=1": בחלון הזמן הזה הקצב הכולל 2MB/s ועיבוד ffmpeg
+    # אחד בכל פעם. ימים הם אופציונליים; חלון שעובר את חצות שייך ליום שבו התחיל.
+    days = start = end = rate_limit = max_postprocess = None
+    try:
+        for token in text.split():
+            key, sep, value = token.partition("=")
+            if sep and key == "rate":
+                rate_limit = parse_rate(value)
+            elif sep and key == "pp":
+                max_postprocess = int(value)
+            elif ":" in token and not sep:
+                start, end = (_parse_clock(part) for part in token.split("-"))
+            elif not sep:
+                days = _parse_days(token)
+            else:
+                raise ValueError
+    except ValueError:
+        raise ValueError(f"invalid schedule rule: {text!r}") from None
+    if start is None:
+        raise ValueError(f"schedule rule has no time window: {text!r}")
+    return ScheduleRule(days, start, end, rate_limit, max_postprocess)
+
+
+def rule_matches(rule, now):
+    minute = now.hour * 60 + now.minute
+    weekday = now.weekday()
+    if rule.start <= rule.end:
+        inside = rule.start <= minute < rule.end
+    else:
+        inside = minute >= rule.start or minute < rule.end
+        if inside and minute < rule.end:
+            weekday = (weekday - 1) % 7
+    return inside and (rule.days is None or weekday in rule.days)
+
+
+class ResourceGovernor:
+    # תקציב משותף לכל ה-workers: קצב הורדה כולל שמתחלק בין ההורדות הפעילות,
+    # מכסה נפרדת לעיבודי ffmpeg, ולוח זמנים לפי שעות שגובר על שניהם בחלונות שלו.
+    # הורדה בתוך התהליך מקבלת את חלקה דרך params["ratelimit"], ש-yt-dlp קורא בכל
+    # בלוק, ולכן מתעדכנת גם באמצע; תהליך yt-dlp מקבל --limit-rate קבוע כשהוא מתחיל.
+    def __init__(self, rate_limit=0, max_postprocess=0, schedule=(), clock=datetime.now):
+        self.rate_limit = rate_limit
+        self.max_postprocess = max_postprocess
+        self.schedule = list(schedule)
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._downloads = {}
+        self._limits = None
+        self._next_check = 0.0
+
+    def limits(self):
+        rate_limit, max_postprocess = self.rate_limit, self.max_postprocess
+        now = self.clock()
+        for rule in self.schedule:
+            if rule_matches(rule, now):
+                if rule.rate_limit is not None:
+                    rate_limit = rule.rate_limit
+                if rule.max_postprocess is not None:
+                    max_postprocess = rule.max_postprocess
+                break
+        return rate_limit, max_postprocess
+
+    def refresh(self):
+        if time.monotonic() >= self._next_check:
+            with self._cond:
+                self._update()
+
+    def _update(self):
+        self._next_check = time.monotonic() + SCHEDULE_CHECK_INTERVAL
+        limits = self.limits()
+        if limits != self._limits:
+            self._limits = limits
+            self._rebalance()
+            self._cond.notify_all()
+
+    def _rebalance(self):
+        rate_limit = self._limits[0]
+        share = max(rate_limit // len(self._downloads), 1) if rate_limit and self._downloads else None
+        for params in self._downloads.values():
+            if params is not None:
+                params["ratelimit"] = share
+
+    def start(self, index, params=None, slots=1):
+        # מחזיר את הקצב לתהליך yt-dlp (או None). slots הוא מספר ההורדות שעוד עשויות
+        # לרוץ במקביל, כך שסכום החלקים הקבועים של התהליכים לא עובר את התקציב.
+        with self._cond:
+            self._downloads[index] = params
+            self._update()
+            self._rebalance()
+            rate_limit = self._limits[0]
+            if params is not None or not rate_limit:
+                return None
+            return max(rate_limit // max(slots, len(self._downloads)), 1)
+
+    def finish(self, index):
+        with self._cond:
+            params = self._downloads.pop(index, None)
+            if params is not None:
+                params["ratelimit"] = None
+            if params is not None or self._downloads:
+                self._rebalance()
+
+    def max_postprocess_now(self):
+        with self._cond:
+            self._update()
+            return self._limits[1]
+
+
+class PostprocessStage:
+    # השלב השני של הצינור. פריט שהגיע לעיבוד ffmpeg נכנס לתור חסום ומשחרר את
+    # מקומו בשלב הרשת, כך שהורדה אחרת מתחילה בזמן שה-CPU עובד. כשהתור מלא, הפריט
+    # נשאר בשלב הרשת (backpressure) וההורדות מאטות עד שהעיבוד מדביק אותן.
+    # מספר העיבודים במקביל הוא מכסת ה-governor, או מספר הליבות אם אין מכסה.
+    def __init__(self, governor=None, queue_size=DEFAULT_MAX_WORKERS):
+        self.governor = governor
+        self.queue_size = max(1, queue_size)
+        self._cond = threading.Condition()
+        self._queued = 0
+        self._running = 0
+
+    def slots(self):
+        max_postprocess = self.governor.max_postprocess_now() if self.governor is not None else 0
+        return max_postprocess or os.cpu_count() or 1
+
+    def enter(self, handoff, cancelled=None, on_block=None):
+        # handoff() משחרר את מקום הרשת; on_block() נקרא פעם אחת אם צריך להמתין
+        blocked = []
+
+        def wait(ready):
+            while not ready():
+                if on_block is not None and not blocked:
+                    blocked.append(True)
+                    on_block()
+                if cancelled is not None and cancelled():
+                    return False
+                self._cond.wait(POSTPROCESS_POLL)
+            return True
+
+        with self._cond:
+            if not wait(lambda: self._queued < self.queue_size):
+                return False
+            self._queued += 1
+        handoff()
+        with self._cond:
+            try:
+                if not wait(lambda: self._running < self.slots()):
+                    return False
+                self._running += 1
+                return True
+            finally:
+                self._queued -= 1
+                self._cond.notify_all()
+
+    def leave(self):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+
+
+def governor_from_config(config):
+    rate_limit = parse_rate(config.get("rate_limit"))
+    max_postprocess = config.get("max_postprocess", 0)
+    schedule = [parse_schedule_rule(rule) for rule in config.get("schedule", [])]
+    if not (rate_limit or max_postprocess or schedule):
+        return None
+    return ResourceGovernor(rate_limit, max_postprocess, schedule)
+
+
+class DownloadScheduler:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_connections = max(0, int(max_connections))
+        self._connections = 0
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._delayed = []
+        self._cooldown = {}
+        self._sequence = 0
+        self._active = 0
+        self._jobs = 0
+        self._per_host = {}
+        self._slots = {}
+        self._cancelled = False
+        self._abandon_at = None
+        self._closed = False
+
+    def run(self, items, job, persistent=False):
+        # במצב persistent (שירות ה-API) התור לא נגמר כשהוא מתרוקן, אלא רק ב-cancel()
+        with self._cond:
+            for i, item in enumerate(items, 1):
+                self._pending.append((host_key(item.url), i, item))
+            while True:
+                item = self._take_next()
+                if item is None:
+                    idle = not (self._pending or self._delayed) and not persistent
+                    if not self._jobs and (self._cancelled or idle):
+                        self._closed = True
+                        break
+                    if self._abandon_at is not None:
+                        # workers שלא הגיבו לביטול בזמן נזנחים (הם daemon), כדי שהיציאה לא תיתקע
+                        remaining = self._abandon_at - time.monotonic()
+                        if remaining <= 0:
+                            self._closed = True
+                            break
+                        self._cond.wait(remaining)
+                        continue
+                    self._cond.wait(self._next_wakeup())
+                    continue
+                self._jobs += 1
+                worker = threading.Thread(target=self._run_job, args=(item, job), daemon=True)
+                worker.start()
+
+    def add(self, items, first_index):
+        # False אם run() כבר הסתיים, ואף אחד לא יריץ את הפריטים
+        with self._cond:
+            if self._closed:
+                return False
+            for i, item in enumerate(items, first_index):
+                self._pending.append((host_key(item.url), i, item))
+            self._cond.notify_all()
+        return True
+
+    def remove(self, index):
+        with self._cond:
+            for pos, entry in enumerate(self._pending):
+                if entry[1] == index:
+                    del self._pending[pos]
+                    return True
+            for pos, (_, _, entry) in enumerate(self._delayed):
+                if entry[1] == index:
+                    del self._delayed[pos]
+                    heapq.heapify(self._delayed)
+                    return True
+        return False
+
+    def outstanding(self):
+        with self._cond:
+            return len(self._pending) + len(self._delayed) + self._active
+
+    def wait_idle(self, timeout=None):
+        # אחרי cancel(abandon_after) הלולאה חוזרת גם כש-workers עוד רצים; כאן מחכים להם
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._jobs, timeout)
+
+    def cancel(self, abandon_after=None):
+        with self._cond:
+            self._cancelled = True
+            if abandon_after is not None:
+                self._abandon_at = time.monotonic() + abandon_after
+            self._pending.clear()
+            self._delayed.clear()
+            self._cond.notify_all()
+
+    def _next_wakeup(self):
+        # פריטים שממתינים לניסיון חוזר לא תופסים worker; מתעוררים כשהראשון מהם מוכן
+        now = time.monotonic()
+        times = [due for due, _, _ in self._delayed[:1]]
+        times.extend(until for until in self._cooldown.values() if until > now)
+        return max(min(times) - now, 0.01) if times else None
+
+    def _take_next(self):
+        if self._cancelled or self._active >= self.max_workers:
+            return None
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            self._pending.appendleft(heapq.heappop(self._delayed)[2])
+        for pos, entry in enumerate(self._pending):
+            host = entry[0]
+            if self._cooldown.get(host, 0) > now:
+                continue
+            if self._per_host.get(host, 0) < self.max_per_host:
+                weight = self._weight(entry[2])
+                if self._active and self._connections + weight > self.max_connections > 0:
+                    # לא מדלגים לפריט קל יותר שאחריו, כדי שפריט כבד לא יחכה לעד
+                    return None
+                del self._pending[pos]
+                self._active += 1
+                self._connections += weight
+                self._per_host[host] = self._per_host.get(host, 0) + 1
+                self._slots[entry[1]] = (host, weight)
+                return entry
+        return None
+
+    def _weight(self, item):
+        weight = format_connections(item.format_option)
+        # פריט שלבדו גדול מהתקציב רץ לבד, במקום לא לרוץ אף פעם
+        return min(weight, self.max_connections) if self.max_connections else weight
+
+    def handoff(self, index):
+        # הפריט עבר לשלב העיבוד: המקום שלו (כולל המכסה לאתר) מתפנה להורדה הבאה,
+        # וה-thread שלו ממשיך לרוץ עד סוף העיבוד
+        with self._cond:
+            self._release_slot(index)
+            self._cond.notify_all()
+
+    def _release_slot(self, index):
+        slot = self._slots.pop(index, None)
+        if slot is not None:
+            host, weight = slot
+            self._active -= 1
+            self._connections -= weight
+            self._per_host[host] -= 1
+
+    def _run_job(self, entry, job):
+        host, index, item = entry
+        retry = None
+        try:
+            retry = job(index, item)
+        finally:
+            with self._cond:
+                self._release_slot(index)
+                self._jobs -= 1
+                if retry is not None and not self._cancelled:
+                    now = time.monotonic()
+                    self._sequence += 1
+                    heapq.heappush(self._delayed, (now + retry.delay, self._sequence, entry))
+                    if retry.host_cooldown:
+                        self._cooldown[host] = max(self._cooldown.get(host, 0), now + retry.host_cooldown)
+                self._cond.notify_all()
+
+
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+METRICS_BACKUPS = 3
+METRICS_WINDOW = 1000
+METRICS_QUANTILES = (0.5, 0.95)
+# נקודות הזמן של ניסיון הורדה. נקודה שלא הגיעו אליה (אין עיבוד, נכשל לפני ההורדה)
+# מקבלת את הזמן של הנקודה הבאה, כך שהשלב שלה יוצא 0.
+TIMING_MARKS = ("ready", "picked", "start", "spawned", "first_progress", "downloaded", "postprocess", "moving", "end")
+
+
+def stage_durations(timing):
+    times = {}
+    following = timing["end"]
+    for mark in reversed(TIMING_MARKS):
+        following = timing.get(mark, following)
+        times[mark] = following
+    return {
+        "queue_wait": times["picked"] - times["ready"],
+        "spawn": times["spawned"] - times["start"],
+        # בדיקת הפורמטים רצה לפני ההפעלה, אבל היא חילוץ מידע לכל דבר
+        "extract": (times["start"] - times["picked"]) + (times["first_progress"] - times["spawned"]),
+        "download": times["downloaded"] - times["first_progress"],
+        "queued": times["postprocess"] - times["downloaded"],
+        "postprocess": times["moving"] - times["postprocess"],
+        "move": times["end"] - times["moving"],
+    }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class MetricsRecorder:
+    # רשומה אחת לכל ניסיון הורדה: נכתבת ללוג JSONL מתגלגל (None = בלי קובץ) ונשמרת
+    # בחלון של הרשומות האחרונות, ממנו מחושבים האחוזונים לפאנל ולייצוא ל-Prometheus.
+    # המונים (פריטים, בתים, ניסיונות חוזרים) מצטברים מאז שהתהליך עלה.
+    def __init__(self, path=METRICS_FILE, max_bytes=METRICS_MAX_BYTES, backups=METRICS_BACKUPS,
+                 window=METRICS_WINDOW):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=window)
+        self._file = None
+        self._closed = False
+        self.results = {}
+        self.bytes = 0
+        self.retries = 0
+        self.stage_sums = dict.fromkeys(STAGES, 0.0)
+        self.attempts = 0
+
+    def record(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._records.append(record)
+            self.attempts += 1
+            self.results[record["result"]] = self.results.get(record["result"], 0) + 1
+            self.bytes += record["bytes"]
+            self.retries += record["result"] == "retry"
+            for stage, seconds in record["stages"].items():
+                self.stage_sums[stage] += seconds
+            if self.path is not None and not self._closed:
+                try:
+                    self._write(line)
+                except OSError:
+                    # תקלה בכתיבת הלוג לא עוצרת הורדות
+                    self.path = None
+
+    def _write(self, line):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() + len(line) > self.max_bytes and self._file.tell() > 0:
+            self._file.close()
+            for n in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{n}"):
+                    os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(line)
+        self._file.flush()
+
+    def snapshot(self):
+        with self._lock:
+            records = list(self._records)
+            totals = {"attempts": self.attempts, "results": dict(self.results), "bytes": self.bytes,
+                      "retries": self.retries, "stage_sums": dict(self.stage_sums)}
+        stages = {}
+        for stage in STAGES:
+            values = sorted(record["stages"][stage] for record in records)
+            stages[stage] = {q: percentile(values, q) for q in METRICS_QUANTILES}
+        # התפוקה נמדדת על החלון: בתים וסרטונים חלקי הזמן מתחילת הניסיון הראשון ועד סוף האחרון
+        throughput = items_per_minute = None
+        if records:
+            span = max(record["time"] for record in records) - min(
+                record["time"] - sum(record["stages"].values()) for record in records)
+            if span > 0:
+                throughput = sum(record["bytes"] for record in records) / span
+                items_per_minute = sum(record["result"] == "ok" for record in records) * 60 / span
+        totals.update(window=len(records), stages=stages, throughput=throughput,
+                      items_per_minute=items_per_minute)
+        return totals
+
+    def prometheus(self):
+        # פורמט הטקסט של Prometheus (גרסה 0.0.4)
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP replica_attempts_total Download attempts by result.",
+            "# TYPE replica_attempts_total counter",
+        ]
+        for result, count in sorted(snapshot["results"].items()):
+            lines.append(f'replica_attempts_total{{result="{result}"}} {count}')
+        lines += [
+            "# HELP replica_downloaded_bytes_total Bytes downloaded.",
+            "# TYPE replica_downloaded_bytes_total counter",
+            f"replica_downloaded_bytes_total {snapshot['bytes']}",
+            "# HELP replica_stage_seconds Time per download stage, over the recent attempts.",
+            "# TYPE replica_stage_seconds summary",
+        ]
+        for stage in STAGES:
+            for q, value in snapshot["stages"][stage].items():
+                if value is not None:
+                    lines.append(f'replica_stage_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'replica_stage_seconds_sum{{stage="{stage}"}} {snapshot["stage_sums"][stage]:.6f}')
+            lines.append(f'replica_stage_seconds_count{{stage="{stage}"}} {snapshot["attempts"]}')
+        if snapshot["throughput"] is not None:
+            lines += [
+                "# HELP replica_throughput_bytes_per_second Download throughput over the recent attempts.",
+                "# TYPE replica_throughput_bytes_per_second gauge",
+                f"replica_throughput_bytes_per_second {snapshot['throughput']:.1f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def set_path(self, path):
+        # החלפת קובץ הלוג (או כיבויו עם None) באמצע הריצה, בלי לסגור את ה-recorder
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.path = path
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class EngineListener:
+    # כל האירועים של DownloadEngine עוברים דרך המתודות האלה. ה-GUI הופך אותן
+    # לסיגנלים של Qt, ומצב ה-headless מדפיס אותן כ-JSON.
+    def status(self, message):
+        pass
+
+    def console(self, chunk):
+        pass
+
+    def batch_started(self, total):
+        pass
+
+    def item_progress(self, event):
+        pass
+
+    def item_finished(self, index, ok):
+        pass
+
+    def item_timings(self, index, record):
+        pass
+
+    def error(self, message):
+        pass
+
+    def finished(self, successful, failed, skipped, retries):
+        pass
+
+
+class JsonLinesListener(EngineListener):
+    # כל אירוע נכתב כשורת JSON אחת (ברירת מחדל: stdout), לצריכה ע"י systemd/cron/סקריפטים
+    def __init__(self, out=None, console_out=None):
+        self.out = out or sys.stdout
+        self.console_out = console_out
+        self._lock = threading.Lock()
+
+    def write(self, event, **fields):
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        line = json.dumps(fields, ensure_ascii=False)
+        with self._lock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def status(self, message):
+        self.write("status", message=message)
+
+    def console(self, chunk):
+        if self.console_out is not None:
+            self.console_out.write(chunk)
+            self.console_out.flush()
+
+    def batch_started(self, total):
+        self.write("batch", total=total)
+
+    def item_progress(self, event):
+        self.write("progress", index=event.index, downloaded=event.downloaded,
+                   total=event.total, speed=event.speed, eta=event.eta)
+
+    def item_finished(self, index, ok):
+        self.write("item", index=index, ok=ok)
+
+    def item_timings(self, index, record):
+        fields = {key: value for key, value in record.items() if key not in ("stages", "time")}
+        self.write("timings", **fields, **record["stages"])
+
+    def error(self, message):
+        self.write("error", message=message)
+
+    def finished(self, successful, failed, skipped, retries):
+        self.write("finished", successful=successful, failed=failed, skipped=skipped, retries=retries)
+
+
+class DownloadEngine:
+    def __init__(self, items, save_directory, show_cli,
+                 max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST, ydl_pool=None,
+                 queue=None, archive=None, expander=None, max_retries=DEFAULT_MAX_RETRIES, listener=None,
+                 persistent=False, keep_partial=True, governor=None, prober=None, metrics=None, stream=None,
+                 max_connections=DEFAULT_MAX_CONNECTIONS, store=None, die_with_parent=False):
+        self.listener = listener if listener is not None else EngineListener()
+        self.ydl_pool = ydl_pool if ydl_pool is not None and ydl_pool.available() else None
+        self.items = list(items)
+        self.persistent = persistent
+        self.keep_partial = keep_partial
+        self.governor = governor
+        self.prober = prober
+        self.metrics = metrics
+        self.stream = stream
+        # הזרמה כותבת ל-sink משלה ולכן לא עוברת במאגר
+        self.store = store if stream is None else None
+        self._timings = {}
+        self._ready_at = {}
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+        self._index_by_id = {}
+        self._handles = {}
+        self._cancelled_items = set()
+        self._filenames = {}
+        self.queue = queue
+        self.archive = archive
+        self.expander = expander
+        self.max_retries = max_retries
+        self._attempts = {}
+        self.extra_args = archive.args() if archive is not None else []
+        self.save_directory = save_directory
+        self.show_cli = show_cli
+        self.command_prefix = parent_death_prefix() if die_with_parent else []
+        self.running = True
+        self.scheduler = DownloadScheduler(max_workers, max_per_host, max_connections)
+        self.postprocess_stage = PostprocessStage(governor, self.scheduler.max_workers)
+        self._lock = threading.Lock()
+        self.successful = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self._last_progress = {}
+        self.console_buffer = ConsoleBuffer()
+        self._flushing = threading.Event()
+        self._accepting = threading.Event()
+
+    def log(self, text, key=None, progress=False):
+        if self.show_cli:
+            self.console_buffer.write(text, key, progress)
+
+    def flush_console(self):
+        chunk = self.console_buffer.drain()
+        if chunk:
+            self.listener.console(chunk)
+
+    def _flush_loop(self):
+        while not self._flushing.wait(CONSOLE_FLUSH_INTERVAL):
+            self.flush_console()
+
+    def expand_items(self, items):
+        collections = [item for item in items if collection_url(item.url) is not None]
+        if not collections:
+            return items
+        
+        self.listener.status(f"סורק {len(collections)} פלייליסטים/ערוצים...")
+        
+        def expand(item):
+            try:
+                return self.expander.expand(item.url, item.format_option)
+            except Exception as e:
+                self.log(f"❌ שגיאה בסריקת {item.url}: {e}\n")
+                return None
+        
+        with ThreadPoolExecutor(max_workers=EXPANSION_WORKERS) as pool:
+            results = list(pool.map(expand, collections))
+        expanded_by_item = {id(item): entries for item, entries in zip(collections, results)}
+        
+        expanded = []
+        seen = set()
+        for item in items:
+            if id(item) not in expanded_by_item:
+                key = canonicalize_url(item.url)
+                if key is not None:
+                    seen.add(key[0])
+        for item in items:
+            entries = expanded_by_item.get(id(item))
+            if entries is None:
+                expanded.append(item)
+                continue
+            urls = collect_links((entry[1] for entry in entries), seen).urls
+            self.log(f"{item.url}: נמצאו {len(urls)} סרטונים\n")
+            if self.queue is not None:
+                expanded.extend(self.queue.expand(item, urls))
+            else:
+                expanded.extend(QueueItem(None, url, item.format_option, None, 0) for url in urls)
+        return expanded
+
+    def run(self):
+        self.successful = 0
+        self.failed = 0
+        self.skipped = 0
+        self.retries = 0
+        self.stage_totals = dict.fromkeys(STAGES, 0.0)
+
+        flusher = None
+        if self.show_cli:
+            flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            flusher.start()
+
+        if self.expander is not None:
+            self.items = self.expand_items(self.items)
+            self.listener.batch_started(len(self.items))
+        self._index_items(self.items, 1)
+        self._accepting.set()
+
+        self.scheduler.run(self.items, self.download_one, self.persistent)
+        total_urls = len(self.items)
+
+        if flusher is not None:
+            self._flushing.set()
+            flusher.join()
+
+        if self.running:
+            summary = f"הושלם: {self.successful}/{total_urls} הורדות הצליחו, {self.failed}/{total_urls} נכשלו"
+            if self.skipped:
+                summary += f", {self.skipped}/{total_urls} דולגו (כבר הורדו)"
+            if self.retries:
+                summary += f", {self.retries} ניסיונות חוזרים"
+            totals = " | ".join(f"{STAGE_LABELS[stage]} {seconds:.1f}s"
+                                for stage, seconds in self.stage_totals.items())
+            self.log(f"\n{'='*50}\n{summary}\nזמן מצטבר לפי שלב: {totals}\n{'='*50}\n")
+            
+            self.flush_console()
+            self.listener.status(summary)
+            self.listener.finished(self.successful, self.failed, self.skipped, self.retries)
+
+    def _index_items(self, items, first_index):
+        now = time.monotonic()
+        for i, item in enumerate(items, first_index):
+            self._ready_at[i] = now
+            if item.id is not None:
+                self._index_by_id[item.id] = i
+
+    def submit(self, items):
+        # הוספת פריטים למנוע שכבר רץ (שירות ה-API). מחזיר את הפריטים אחרי הרחבה, או
+        # None אם המנוע כבר סיים (אצווה רגילה שהתרוקנה, או עצירה) והפריטים לא ירוצו
+        if self.expander is not None:
+            items = self.expand_items(items)
+        # run() מחליף את self.items אחרי הרחבת הפריטים הראשונים; עד אז לא מוסיפים
+        self._accepting.wait()
+        with self._lock:
+            first_index = len(self.items) + 1
+            self.items.extend(items)
+            self._index_items(items, first_index)
+            if not self.scheduler.add(items, first_index):
+                del self.items[first_index - 1:]
+                for i, item in enumerate(items, first_index):
+                    self._ready_at.pop(i, None)
+                    self._index_by_id.pop(item.id, None)
+                return None
+        self.listener.batch_started(len(self.items))
+        return items
+
+    def cancel_item(self, item_id):
+        index = self._index_by_id.get(item_id)
+        if index is None:
+            return False
+        if self.scheduler.remove(index):
+            self._ready_at.pop(index, None)
+            if self.queue is not None:
+                self.queue.mark_cancelled(item_id)
+            self.log(f"⨯ {self.items[index - 1].url} בוטל\n", index)
+            self.listener.item_finished(index, False)
+            return True
+        with self._lock:
+            if index not in self._handles:
+                return False
+            self._cancelled_items.add(index)
+            handle = self._handles[index]
+        if handle is not None:
+            self._cancel_handle(handle)
+        return True
+
+    def _register(self, i, handle):
+        # handle הוא תהליך yt-dlp או Event של הורדה בתוך התהליך. ביטול שהגיע לפני
+        # שה-handle נרשם מופעל עליו מיד.
+        with self._lock:
+            self._handles[i] = handle
+            cancelled = i in self._cancelled_items or not self.running
+        if cancelled and handle is not None:
+            self._cancel_handle(handle)
+
+    @staticmethod
+    def _cancel_handle(handle):
+        if isinstance(handle, threading.Event):
+            handle.set()
+        else:
+            terminate_process_group(handle)
+
+    def _finish_cancelled(self, i, item, prefix):
+        # הקבצים נמחקים לפי השמות שדווחו בהתקדמות, ולא לפי התבנית, כי שני פריטים
+        # שהתחילו באותה שנייה חולקים את אותה תבנית
+        filenames = self._filenames.get(i, ())
+        if not self.keep_partial:
+            for path in (path for filename in filenames for path in partial_files(filename)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if not self.running:
+            # עצירה של כל האצווה: הפריט נשאר running בתור ויחודש בהפעלה הבאה
+            return
+        if self.queue is not None:
+            self.queue.mark_cancelled(item.id)
+        self.log(f"\n{prefix}⨯ ההורדה של {item.url} בוטלה\n\n", i)
+        self.listener.item_finished(i, False)
+
+    def download_one(self, i, item):
+        if not self.running:
+            return
+        self._register(i, None)
+        now = time.monotonic()
+        self._timings[i] = {"ready": self._ready_at.pop(i, now), "picked": now, "bytes": {}}
+        try:
+            return self._download_one(i, item)
+        finally:
+            self._finish_timings(i)
+            with self._lock:
+                self._handles.pop(i, None)
+                self._cancelled_items.discard(i)
+                self._filenames.pop(i, None)
+
+    def _enter_postprocess(self, i, process=None):
+        # סוף שלב הרשת: מפנים את המקום ב-scheduler ואת חלק הקצב, ומחכים למקום עיבוד.
+        # תהליך yt-dlp מושהה (SIGSTOP) בזמן ההמתנה, כדי ש-ffmpeg לא יתחיל לפני התור.
+        timing = self._timings[i]
+        timing["downloaded"] = time.monotonic()
+
+        def handoff():
+            if self.governor is not None:
+                self.governor.finish(i)
+            self.scheduler.handoff(i)
+
+        on_block = (lambda: suspend_process_group(process)) if process is not None else None
+        try:
+            entered = self.postprocess_stage.enter(
+                handoff, lambda: i in self._cancelled_items or not self.running, on_block
+            )
+        finally:
+            if process is not None:
+                resume_process_group(process)
+        if entered:
+            timing["postprocess"] = time.monotonic()
+        return entered
+
+    def _mark(self, i, mark):
+        timing = self._timings.get(i)
+        if timing is not None and mark not in timing:
+            timing[mark] = time.monotonic()
+
+    def _finish_timings(self, i):
+        timing = self._timings.pop(i, None)
+        if timing is None:
+            return
+        if timing.get("postprocess") is not None:
+            self.postprocess_stage.leave()
+        if not self.running:
+            return
+        timing["end"] = time.monotonic()
+        durations = stage_durations(timing)
+        with self._lock:
+            for stage, duration in durations.items():
+                self.stage_totals[stage] += duration
+        item = self.items[i - 1]
+        downloaded = int(sum(timing["bytes"].values()))
+        download_time = durations["download"]
+        record = {
+            "time": round(time.time(), 3),
+            "index": i,
+            "id": item.id,
+            "host": host_key(item.url),
+            "result": timing.get("result", "failed"),
+            "retries": self._attempts.get(i, 0),
+            "bytes": downloaded,
+            "speed": round(downloaded / download_time) if downloaded and download_time > 0 else None,
+            "stages": {stage: round(duration, 3) for stage, duration in durations.items()},
+        }
+        if self.metrics is not None:
+            self.metrics.record(record)
+        self.listener.item_timings(i, record)
+        if self.show_cli:
+            prefix = f"[{i}] " if self.scheduler.max_workers > 1 else ""
+            stages = " | ".join(f"{STAGE_LABELS[stage]} {duration:.1f}s"
+                                for stage, duration in durations.items() if duration >= 0.05)
+            self.log(f"{prefix}⏱ {stages or 'פחות מ-0.1s'}\n", i)
+
+    def _download_one(self, i, item):
+
+        url = item.url
+        total_urls = len(self.items)
+        prefix = f"[{i}] " if self.scheduler.max_workers > 1 else ""
+        
+        video = archive_id(url)
+        entry = video if self.archive is not None else None
+        store_key = format_key(item.format_option) if self.store is not None else None
+        if store_key is not None and video is not None:
+            stored = self.store.lookup(video, store_key)
+            if stored is not None and self._finish_from_store(i, item, stored, entry, prefix):
+                return
+        if entry is not None and entry in self.archive:
+            with self._lock:
+                self.skipped += 1
+            if self.queue is not None:
+                self.queue.mark_done(item.id)
+            self._timings[i]["result"] = "skipped"
+            self.log(f"{prefix}⏭ {url} כבר הורד בעבר, מדלג.\n", i)
+            self.listener.item_finished(i, True)
+            return
+        
+        self.listener.status(f"מוריד {i}/{total_urls}: {url}")
+        
+        # פריט שהתחיל בהפעלה קודמת ממשיך עם אותו שם קובץ, כך ש-yt-dlp ימשיך את קובץ ה-.part.
+        # הזרמה לא ממשיכה מאמצע ומתחילה תמיד sink חדש.
+        # במאגר השם נקבע לפי id ופורמט, כך שגם המשך הורדה מוצא את אותו קובץ .part בתיקייה הזמנית.
+        output_template = item.output_template
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        store_result = None
+        if self.stream is not None:
+            output_template = stream_target_path(self.stream, self.save_directory, timestamp)
+        elif store_key is not None:
+            output_template = self.store.template(store_key)
+            store_result = self.store.result_file()
+        elif output_template is None:
+            output_template = os.path.join(self.save_directory, f"%(title)s_{timestamp}.%(ext)s")
+        if self.queue is not None:
+            self.queue.mark_running(item.id, output_template)
+        
+        format_option = item.format_option
+        probe_key = None
+        if self.prober is not None:
+            self.listener.status(f"בודק פורמטים זמינים {i}/{total_urls}: {url}")
+            format_option, probe_key = self.prober.resolve(url, format_option)
+        format_option = format_option + self.extra_args
+        if self.stream is not None:
+            command = format_option + STREAM_PROGRESS_ARGS + ["-o", "-", url]
+        else:
+            command = format_option + PROGRESS_ARGS + ["--continue", "-o", output_template]
+            if store_result is not None:
+                command += self.store.args(store_result)
+            command.append(url)
+        
+        self.log(f"\n{'='*50}\n{prefix}מתחיל הורדה של: {url}\nפקודה: {' '.join(command)}\n{'='*50}\n\n", i)
+        
+        timing = self._timings[i]
+        timing["start"] = time.monotonic()
+        try:
+            if self.ydl_pool is not None and self.stream is None:
+                emit = (lambda line: self.log(prefix + line, i)) if self.show_cli else (lambda line: None)
+                cancelled = threading.Event()
+                self._register(i, cancelled)
+                governor = self.governor
+
+                def on_start(params):
+                    # מופע חם מוכן: המקבילה של הפעלת התהליך
+                    self._mark(i, "spawned")
+                    if governor is not None:
+                        governor.start(i, params, self._rate_slots())
+
+                exit_code, error_output = self.ydl_pool.download(
+                    format_option, url, output_template, emit,
+                    lambda d: self.report_progress(progress_from_hook(i, d), prefix),
+                    cancelled,
+                    on_start,
+                    lambda: self._enter_postprocess(i),
+                    lambda: self._mark(i, "moving"),
+                    self.store.params(store_result) if store_result is not None else None
+                )
+                if governor is not None:
+                    governor.finish(i)
+            else:
+                exit_code, error_output = self.run_subprocess(i, command, prefix,
+                                                              output_template if self.stream is not None else None)
+            
+            if i in self._cancelled_items or not self.running:
+                timing["result"] = "cancelled"
+                self._finish_cancelled(i, item, prefix)
+                return
+            
+            if exit_code != 0:
+                if probe_key is not None:
+                    self.prober.forget(probe_key)
+                retry = self.plan_retry(i, item, error_output, prefix)
+                if retry is not None:
+                    timing["result"] = "retry"
+                    return retry
+            elif store_result is not None:
+                error_output = self._finalize_store(i, store_result, store_key, prefix)
+                store_result = None
+                if error_output:
+                    exit_code = 1
+            
+            if self.queue is not None:
+                if exit_code == 0:
+                    self.queue.mark_done(item.id)
+                else:
+                    self.queue.mark_failed(item.id, error_output)
+            timing["result"] = "ok" if exit_code == 0 else "failed"
+            self.listener.item_finished(i, exit_code == 0)
+            if exit_code == 0:
+                if entry is not None:
+                    self.archive.remember(entry)
+                with self._lock:
+                    self.successful += 1
+                self.log(f"\n{prefix}✓ ההורדה של {url} הושלמה בהצלחה!\n\n", i)
+            else:
+                with self._lock:
+                    self.failed += 1
+                self.listener.status(f"נכשל: {url}")
+                self.log(f"\n{prefix}❌ שגיאה בהורדה של {url}. קוד יציאה: {exit_code}\n"
+                         f"פרטי שגיאה: {error_output}\n\n", i)
+        
+        except FileNotFoundError:
+            if self.queue is not None:
+                self.queue.mark_failed(item.id, "yt-dlp not found")
+            self.listener.item_finished(i, False)
+            with self._lock:
+                self.failed += 1
+            self.scheduler.cancel()
+            error_msg = "yt-dlp לא נמצא במערכת. ודא שהתקנת אותו ושהוא נגיש מ-PATH."
+            self.listener.error(error_msg)
+            self.log(f"\n❌ שגיאה: {error_msg}\n\n")
+        finally:
+            if store_result is not None and os.path.exists(store_result):
+                os.remove(store_result)
+
+    def _finish_from_store(self, i, item, stored, entry, prefix):
+        try:
+            target, method = self.store.link(stored, self.save_directory)
+        except OSError as e:
+            # הקישור נכשל (למשל אין מקום להעתקה); הפריט יורד כרגיל
+            self.log(f"{prefix}⚠ לא ניתן לקשר את {stored.path}: {e}\n", i)
+            return False
+        with self._lock:
+            self.skipped += 1
+        if self.queue is not None:
+            self.queue.mark_done(item.id)
+        if entry is not None:
+            self.archive.remember(entry)
+        self._timings[i]["result"] = "skipped"
+        if method is None:
+            self.log(f"{prefix}⏭ {item.url} כבר נמצא ב-{target}, מדלג.\n", i)
+        else:
+            self.log(f"{prefix}⧉ {item.url} כבר במאגר, קושר אל {target} ({method}).\n", i)
+        self.listener.item_finished(i, True)
+        return True
+
+    def _finalize_store(self, i, result_path, key, prefix):
+        # רושם את הקובץ שהורד במאגר (גודל ו-sha256) ומקשר אותו לתיקיית השמירה.
+        # מחזיר הודעת שגיאה, או "" בהצלחה.
+        stored = self.store.add_result(result_path, key)
+        if stored is None:
+            return "yt-dlp לא דיווח על הקובץ שנשמר במאגר"
+        try:
+            target, method = self.store.link(stored, self.save_directory)
+        except OSError as e:
+            return f"לא ניתן לקשר את {stored.path} אל תיקיית השמירה: {e}"
+        if self.show_cli:
+            self.log(f"{prefix}⧉ {format_bytes(stored.size)} נשמרו במאגר ({stored.sha256[:12]}), "
+                     f"קושרו אל {target}{f' ({method})' if method else ''}\n", i)
+        return ""
+
+    def plan_retry(self, i, item, error_output, prefix):
+        failure_class = classify_failure(error_output)
+        attempt = self._attempts.get(i, 0)
+        if failure_class == PERMANENT or attempt >= self.max_retries:
+            return None
+        
+        self._attempts[i] = attempt + 1
+        delay = retry_delay(attempt, failure_class)
+        # ההמתנה של ה-backoff אינה המתנה בתור
+        self._ready_at[i] = time.monotonic() + delay
+        with self._lock:
+            self.retries += 1
+        if self.queue is not None:
+            self.queue.mark_pending(item.id, error_output)
+        self.log(f"\n{prefix}⟳ שגיאה זמנית בהורדה של {item.url}, ניסיון חוזר {attempt + 1}/{self.max_retries} "
+                 f"בעוד {delay:.0f} שניות\n\n", i)
+        return Retry(delay, delay if failure_class == RATE_LIMITED else 0)
+
+    def _rate_slots(self):
+        return min(self.scheduler.max_workers, self.scheduler.outstanding())
+
+    def run_subprocess(self, i, command, prefix, stream_name=None):
+        governor = self.governor
+        if governor is not None:
+            rate_limit = governor.start(i, None, self._rate_slots())
+            if rate_limit:
+                command = command[:-1] + ["--limit-rate", str(rate_limit), command[-1]]
+        try:
+            if stream_name is not None:
+                return self._run_stream(i, command, prefix, stream_name)
+            return self._run_subprocess(i, command, prefix)
+        finally:
+            if governor is not None:
+                governor.finish(i)
+
+    def _run_subprocess(self, i, command, prefix):
+        process = subprocess.Popen(
+            self.command_prefix + command, 
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+            **popen_group_kwargs()
+        )
+        self._register(i, process)
+        self._mark(i, "spawned")
+        
+        # כשהקונסול מוסתר רק שורות ההתקדמות מפוענחות, וכל השאר נזרק
+        show_cli = self.show_cli
+        postprocessing = []
+        
+        def on_line(stream, line):
+            if stream != STDOUT:
+                return
+            event = parse_progress_line(i, line)
+            if event is not None:
+                self.report_progress(event, prefix)
+                return
+            # yt-dlp מדפיס את שורת ה-postprocessor לפני שהוא מפעיל את ffmpeg
+            if not postprocessing and POSTPROCESS_LINE_RE.match(line):
+                postprocessing.append(True)
+                self._enter_postprocess(i, process)
+            elif MOVE_LINE_RE.match(line):
+                self._mark(i, "moving")
+            if show_cli:
+                self.log(prefix + line, i)
+        
+        pump = OutputPump(process, on_line)
+        exit_code = pump.run()
+        return exit_code, pump.error_output() if exit_code != 0 else ""
+
+    def _run_stream(self, i, command, prefix, name_template):
+        process = subprocess.Popen(
+            self.command_prefix + command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            **popen_group_kwargs()
+        )
+        # stdout הוא המדיה ונשאר בינארי; stderr נקרא כשורות טקסט
+        process.stderr = io.TextIOWrapper(process.stderr, errors="replace")
+        self._register(i, process)
+        self._mark(i, "spawned")
+        
+        sink = open_stream_sink(self.stream, name_template)
+        names = {}
+        named = threading.Event()
+        expected = [None]
+        show_cli = self.show_cli
+        
+        def on_line(stream, line):
+            event = parse_progress_line(i, line)
+            if event is None:
+                if show_cli:
+                    self.log(prefix + line, i)
+                return
+            if not named.is_set():
+                video_id, ext, title = ((event.filename or "").split("\t", 2) + ["", ""])[:3]
+                names.update(id=video_id, ext=ext, title=title.rstrip("\r\n"))
+                named.set()
+            expected[0] = event.total
+            self.report_progress(event._replace(filename=None), prefix)
+        
+        pump = OutputPump(process, on_line, drain_stdout=False)
+        
+        def name_ready():
+            # השם מגיע בשורת ההתקדמות הראשונה ב-stderr; בלעדיה (extractor בלי info
+            # מלא) ה-sink מקבל שם לפי מספר הפריט
+            deadline = time.monotonic() + STREAM_NAME_TIMEOUT
+            while not named.wait(0.1):
+                if time.monotonic() > deadline or (process.poll() is not None and not pump.stderr_open()):
+                    break
+            return render_stream_name(name_template, {
+                "id": names.get("id") or str(i),
+                "ext": names.get("ext") or "bin",
+                "title": names.get("title") or f"stream_{i}",
+            })
+        
+        sink_error = None
+        try:
+            pump_stream(process.stdout, sink, name_ready,
+                        lambda: i in self._cancelled_items or not self.running, lambda: expected[0])
+        except OSError as e:
+            # הקורא של ה-pipe נסגר, הדיסק מלא וכו': עוצרים את yt-dlp במקום להשאיר אותו חסום
+            sink_error = f"stream sink {sink.path}: {e}"
+            terminate_process_group(process)
+        finally:
+            sink.close()
+            process.stdout.close()
+        exit_code = pump.run()
+        if sink_error is not None:
+            return exit_code or 1, sink_error
+        if sink.paths and show_cli:
+            self.log(f"{prefix}⇢ {format_bytes(sink.written)} נכתבו אל {', '.join(sink.paths)}\n", i)
+        return exit_code, pump.error_output() if exit_code != 0 else ""
+
+    def report_progress(self, event, prefix=""):
+        if self.governor is not None:
+            self.governor.refresh()
+        if event.filename is not None:
+            self._filenames.setdefault(event.index, set()).add(event.filename)
+        timing = self._timings.get(event.index)
+        if timing is not None:
+            timing.setdefault("first_progress", time.monotonic())
+            # וידאו ואודיו מורדים לקבצים נפרדים, וההתקדמות מתאפסת בין הקבצים
+            timing["bytes"][event.filename] = event.downloaded
+        now = time.monotonic()
+        done = event.total is not None and event.downloaded >= event.total
+        if not done and now - self._last_progress.get(event.index, 0) < PROGRESS_INTERVAL:
+            return
+        self._last_progress[event.index] = now
+        self.listener.item_progress(event)
+        self.log(prefix + format_progress(event), event.index, progress=True)
+
+    def wait_stopped(self, timeout=None):
+        # stop() לא מחכה ל-workers; מי שסוגר אחריו את התור, המדדים והמאגר מחכה כאן קודם
+        return self.scheduler.wait_idle(timeout)
+
+    def stop(self):
+        self.running = False
+        self.scheduler.cancel(STOP_TIMEOUT)
+        with self._lock:
+            handles = [handle for handle in self._handles.values() if handle is not None]
+        for handle in handles:
+            self._cancel_handle(handle)
+
+
+class WorkerListener(EngineListener):
+    # מעביר כל אירוע למאזין המקורי, ובדרך זוכר את ההתקדמות האחרונה של כל
+    # פריט פעיל כדי שה-worker ידווח עליה לתצוגה המרוכזת
+    def __init__(self, inner):
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._progress = {}
+
+    def __getattr__(self, name):
+        # write() של JsonLinesListener/EventBroker ושאר התוספות שלהם
+        return getattr(self.inner, name)
+
+    def active(self):
+        with self._lock:
+            return dict(self._progress)
+
+    def status(self, message):
+        self.inner.status(message)
+
+    def console(self, chunk):
+        self.inner.console(chunk)
+
+    def batch_started(self, total):
+        self.inner.batch_started(total)
+
+    def item_progress(self, event):
+        with self._lock:
+            self._progress[event.index] = event
+        self.inner.item_progress(event)
+
+    def item_finished(self, index, ok):
+        with self._lock:
+            self._progress.pop(index, None)
+        self.inner.item_finished(index, ok)
+
+    def item_timings(self, index, record):
+        self.inner.item_timings(index, record)
+
+    def error(self, message):
+        self.inner.error(message)
+
+    def finished(self, successful, failed, skipped, retries):
+        self.inner.finished(successful, failed, skipped, retries)
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class QueueWorker:
+    # מחבר DownloadEngine במצב persistent לתור משותף: חוכר פריטים כשיש מקום
+    # פנוי, מחדש את החכירה שלהם ב-heartbeat, עוצר פריטים שבוטלו או נלקחו ממנו
+    # ומדווח על מצבו. backend הוא DownloadQueue על קובץ משותף או RemoteQueue
+    # מול coordinator; לשניהם אותו ממשק. במצב drain ה-worker יוצא כשהתור ריק.
+    def __init__(self, engine, backend, name=None, capacity=None, lease=LEASE_SECONDS,
+                 heartbeat=HEARTBEAT_INTERVAL, poll=CLAIM_POLL_INTERVAL, drain=False):
+        self.engine = engine
+        self.backend = backend
+        self.name = name or default_worker_name()
+        # קצת יותר ממספר ה-workers, כדי שפריט חדש יחכה מוכן כשהורדה מסתיימת
+        self.capacity = capacity or engine.scheduler.max_workers * 2
+        self.lease = lease
+        self.heartbeat_interval = heartbeat
+        self.poll = poll
+        self.drain = drain
+        self.listener = WorkerListener(engine.listener)
+        engine.listener = self.listener
+        self.started = time.time()
+        self._owned = set()
+        self._submitting = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_heartbeat = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            # הפריטים שלא הסתיימו חוזרים לתור מיד, ולא רק כשהחכירה פגה
+            self.backend.release(self.name)
+            self.backend.report(self.name, self.status("stopped"))
+        except (sqlite3.Error, OSError) as e:
+            self.listener.error(f"queue {self.name}: {e}")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() >= self._next_heartbeat:
+                    self._heartbeat()
+                    self._next_heartbeat = time.monotonic() + self.heartbeat_interval
+                idle = self._claim()
+                self.backend.report(self.name, self.status("draining" if self.drain else "running"))
+            except (sqlite3.Error, OSError) as e:
+                # התור המשותף לא זמין כרגע; החכירות תקפות עד LEASE_SECONDS, ומנסים שוב
+                self.listener.error(f"queue {self.name}: {e}")
+            else:
+                if idle and self.drain:
+                    self.engine.scheduler.cancel()
+                    return
+            self._stop.wait(self.poll)
+
+    def _heartbeat(self):
+        with self._lock:
+            owned = list(self._owned)
+        active, lost = self.backend.heartbeat(self.name, owned, self.lease)
+        with self._lock:
+            self._owned.difference_update(set(owned) - set(active))
+        for item_id in lost:
+            # בוטל דרך ה-coordinator, או שהחכירה פגה ו-worker אחר לקח אותו
+            self.listener.status(f"פריט {item_id} כבר לא שייך ל-{self.name}")
+            self.engine.cancel_item(item_id)
+
+    def _claim(self):
+        if not self.engine.running:
+            return False
+        with self._lock:
+            submitting = self._submitting
+        free = self.capacity - self.engine.scheduler.outstanding() - submitting
+        if free <= 0:
+            return False
+        items = self.backend.claim(self.name, free, self.lease)
+        if not items:
+            if submitting or self.engine.scheduler.outstanding() or not self.drain:
+                return False
+            # פריטים של worker אחר עוד עלולים לחזור לתור אם הוא ייפול
+            counts = self.backend.counts()
+            return not counts.get(PENDING) and not counts.get(RUNNING)
+        with self._lock:
+            self._owned.update(item.id for item in items)
+            self._submitting += len(items)
+        # הרחבת פלייליסטים עלולה לקחת זמן, וה-heartbeat לא מחכה לה
+        threading.Thread(target=self._submit, args=(items,), daemon=True).start()
+        return False
+
+    def _submit(self, items):
+        try:
+            accepted = self.engine.submit(items)
+        except (sqlite3.Error, OSError) as e:
+            self.listener.error(f"queue {self.name}: {e}")
+            accepted = None
+        if accepted is None:
+            # בלי heartbeat החכירה תפוג והפריטים יחזרו לתור
+            accepted = []
+            with self._lock:
+                self._owned.difference_update(item.id for item in items)
+        with self._lock:
+            self._owned.update(item.id for item in accepted if item.id is not None)
+            self._submitting -= len(items)
+
+    def status(self, state):
+        engine = self.engine
+        active = []
+        for index, event in sorted(self.listener.active().items()):
+            item = engine.items[index - 1]
+            active.append({"id": item.id, "url": item.url, "downloaded": event.downloaded,
+                           "total": event.total, "speed": event.speed})
+        return {
+            "state": state,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started": round(self.started, 3),
+            "capacity": self.capacity,
+            "outstanding": engine.scheduler.outstanding(),
+            "successful": engine.successful,
+            "failed": engine.failed,
+            "skipped": engine.skipped,
+            "retries": engine.retries,
+            "active": active,
+            "speed": sum(entry["speed"] or 0 for entry in active),
+        }
@@ -0,0 +1,230 @@
+"""Offline tests of the HTTP control API, against bench/fake_yt_dlp.py.
+
+    python -m pytest -q tests
+    python -m unittest discover tests
+"""
+import http.client
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_YT_DLP = os.path.join(REPO_DIR, "bench", "fake_yt_dlp.py")
+sys.path.insert(0, REPO_DIR)
+
+# תיקיית הגדרות ריקה, לפני ש-replica_engine קובע את APP_DATA_DIR, כמו ב-bench
+TEST_HOME = tempfile.mkdtemp(prefix="replica-tests-")
+os.environ["HOME"] = os.environ["APPDATA"] = TEST_HOME
+
+from replica_engine import DownloadEngine, DownloadQueue  # noqa: E402
+from replica_api import ApiServer, EventBroker  # noqa: E402
+
+TOKEN = "test-token"
+WAIT_TIMEOUT = 20.0
+
+
+def install_fake_yt_dlp(directory):
+    # אפשרויות הפורמט מריצות "yt-dlp" מה-PATH; עוטף קטן מפנה אותו ל-fake
+    path = os.path.join(directory, "yt-dlp")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_YT_DLP}" "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+@unittest.skipIf(os.name == "nt", "the yt-dlp stand-in is installed as a shell script")
+class ApiTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp(prefix="replica-api-", dir=TEST_HOME)
+        bin_dir = os.path.join(cls.workdir, "bin")
+        os.makedirs(bin_dir)
+        install_fake_yt_dlp(bin_dir)
+        cls.saved_path = os.environ.get("PATH", "")
+        os.environ["PATH"] = bin_dir + os.pathsep + cls.saved_path
+
+        cls.queue = DownloadQueue(os.path.join(cls.workdir, "queue.db"))
+        cls.broker = EventBroker()
+        cls.engine = DownloadEngine([], os.path.join(cls.workdir, "out"), False, 2, 2, None, cls.queue,
+                                    None, None, 0, listener=cls.broker, persistent=True)
+        cls.runner = threading.Thread(target=cls.engine.run, daemon=True)
+        cls.runner.start()
+        cls.server = ApiServer(cls.engine, cls.broker, "127.0.0.1", 0, TOKEN)
+        cls.port = cls.server.server_address[1]
+        cls.serving = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.serving.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.stop()
+        cls.runner.join(WAIT_TIMEOUT)
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.queue.close()
+        os.environ["PATH"] = cls.saved_path
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def request(self, method, path, body=None, token=TOKEN, raw=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=WAIT_TIMEOUT)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        data = raw if raw is not None else (json.dumps(body) if body is not None else None)
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read() or b"null")
+        finally:
+            connection.close()
+
+    def wait_for_state(self, item_id, states):
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            status, item = self.request("GET", f"/jobs/{item_id}")
+            self.assertEqual(status, 200)
+            if item["state"] in states:
+                return item
+            time.sleep(0.05)
+        self.fail(f"item {item_id} did not reach {states}: {item}")
+
+    def test_post_and_get_jobs(self):
+        status, result = self.request("POST", "/jobs", {"urls": [
+            "https://fake.test/watch?v=post1&write=0",
+            "https://fake.test/watch?v=post1&write=0",
+            "not a link",
+        ]})
+        self.assertEqual(status, 202)
+        self.assertEqual((result["accepted"], result["duplicates"], result["invalid"]), (1, 1, 1))
+        item_id = result["ids"][0]
+        item = self.wait_for_state(item_id, ("done", "failed"))
+        self.assertEqual(item["state"], "done")
+
+        status, listing = self.request("GET", "/jobs?state=done")
+        self.assertEqual(status, 200)
+        self.assertIn(item_id, [entry["id"] for entry in listing["items"]])
+        self.assertGreaterEqual(listing["counts"]["done"], 1)
+        self.assertEqual(self.request("GET", "/jobs/999999")[0], 404)
+        self.assertEqual(self.request("GET", "/jobs?limit=x")[0], 400)
+
+        status, stats = self.request("GET", "/stats")
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(stats["successful"], 1)
+
+    def test_delete_job(self):
+        # 50 MB ב-100 KB/s: ההורדה עדיין רצה כשהביטול מגיע
+        status, result = self.request("POST", "/jobs", {
+            "urls": ["https://fake.test/watch?v=slow1&size=50000000&rate=100000&write=0"]
+        })
+        self.assertEqual(status, 202)
+        item_id = result["ids"][0]
+        self.wait_for_state(item_id, ("running",))
+        status, result = self.request("DELETE", f"/jobs/{item_id}")
+        self.assertEqual((status, result), (200, {"cancelled": True}))
+        self.assertEqual(self.wait_for_state(item_id, ("cancelled",))["state"], "cancelled")
+        self.assertEqual(self.request("DELETE", f"/jobs/{item_id}")[0], 409)
+        self.assertEqual(self.request("DELETE", "/jobs/nope")[0], 404)
+
+    def test_event_stream(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=WAIT_TIMEOUT)
+        try:
+            connection.request("GET", "/events", headers={"Authorization": f"Bearer {TOKEN}"})
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader("Content-Type"), "text/event-stream")
+            status, result = self.request("POST", "/jobs", {"urls": ["https://fake.test/watch?v=sse1&write=0"]})
+            self.assertEqual(status, 202)
+            events = []
+            while "item" not in events:
+                line = response.fp.readline().decode("utf-8")
+                self.assertTrue(line, "the event stream closed")
+                if line.startswith("event: "):
+                    events.append(line[len("event: "):].strip())
+                elif line.startswith("data: ") and events[-1] == "item":
+                    self.assertTrue(json.loads(line[len("data: "):])["ok"])
+            self.assertIn("batch", events)
+        finally:
+            connection.close()
+
+    def test_token_required(self):
+        self.assertEqual(self.request("GET", "/jobs", token=None), (401, {"error": "unauthorized"}))
+        self.assertEqual(self.request("GET", "/stats", token="wrong")[0], 401)
+        self.assertEqual(self.request("POST", "/jobs", {"urls": []}, token="wrong")[0], 401)
+        self.assertEqual(self.request("DELETE", "/jobs/1", token=None)[0], 401)
+        # בלי token מותר להאזין רק על loopback
+        with self.assertRaises(ValueError):
+            ApiServer(self.engine, self.broker, "0.0.0.0", 0)
+
+    def test_bad_request_bodies(self):
+        for raw in ("{not json", "[1, 2]", '"https://fake.test/watch?v=x"', "{}",
+                    '{"urls": [1, 2]}', '{"urls": {"a": 1}}', '{"urls": ["https://fake.test/watch?v=x"], "format": "nope"}'):
+            with self.subTest(body=raw):
+                status, result = self.request("POST", "/jobs", raw=raw)
+                self.assertEqual(status, 400)
+                self.assertIn("error", result)
+        self.assertEqual(self.request("POST", "/subscriptions", raw="[1]")[0], 400)
+        self.assertEqual(self.request("POST", "/nothing", {"urls": []})[0], 404)
+
+    def test_worker_routes_need_a_coordinator(self):
+        # עם --serve התור שייך למנוע המקומי, ואסור לחכור ממנו פריטים מבחוץ
+        status, result = self.request("POST", "/jobs", {"urls": ["https://fake.test/watch?v=lease1&write=0"]})
+        self.assertEqual(status, 202)
+        item_id = result["ids"][0]
+        for path, body in (("/leases", {"worker": "w1", "limit": 5}),
+                           ("/leases/heartbeat", {"worker": "w1", "ids": [item_id]}),
+                           ("/leases/release", {"worker": "w1"}),
+                           (f"/jobs/{item_id}/state", {"worker": "w1", "state": "done"}),
+                           (f"/jobs/{item_id}/expand", {"worker": "w1", "urls": []}),
+                           ("/workers/w1", {"state": "running"})):
+            with self.subTest(path=path):
+                self.assertEqual(self.request("POST", path, body), (404, {"error": "not found"}))
+        self.assertEqual(self.wait_for_state(item_id, ("done", "failed"))["state"], "done")
+
+
+
+class CoordinatorApiTest(unittest.TestCase):
+    # בלי מנוע: השרת רק מחזיק את התור המשותף בשביל ה-workers
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="replica-coordinator-", dir=TEST_HOME)
+        self.queue = DownloadQueue(os.path.join(self.workdir, "shared-queue.db"))
+        self.broker = EventBroker()
+        self.server = ApiServer(None, self.broker, "127.0.0.1", 0, TOKEN, queue=self.queue)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.queue.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    request = ApiTest.request
+
+    def test_worker_report(self):
+        events = self.broker.subscribe()
+        status = {"state": "running", "host": "box", "pid": 7, "capacity": 4, "successful": 2,
+                  "active": [{"id": 1, "speed": 1000.0}], "speed": 1000.0}
+        self.assertEqual(self.request("POST", "/workers/w1", dict(status, extra="dropped")),
+                         (200, {"reported": True}))
+        (worker,) = self.queue.workers()
+        self.assertNotIn("extra", worker)
+        self.assertEqual({key: worker[key] for key in status}, status)
+        event = events.get(timeout=WAIT_TIMEOUT)
+        self.assertEqual((event["event"], event["name"], event["status"]), ("worker", "w1", status))
+        self.assertEqual(self.request("GET", "/stats")[1]["successful"], 2)
+
+    def test_bad_worker_report_is_not_stored(self):
+        for payload in ({"name": "other", "successful": "2"}, {"active": [1]}, {"pid": True},
+                        {"speed": None}):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.request("POST", "/workers/w2", payload)[0], 400)
+        self.assertEqual(self.queue.workers(), [])
+        # שדה לא מוכר, גם כזה שמתנגש בשם, פשוט נזרק
+        self.assertEqual(self.request("POST", "/workers/w2", {"name": "other", "time": 1})[0], 200)
+        self.assertEqual([worker["name"] for worker in self.queue.workers()], ["w2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests of reading link files (iter_link_file + collect_links)."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# תיקיית הגדרות ריקה, לפני ש-replica_engine קובע את APP_DATA_DIR, כמו ב-bench
+TEST_HOME = tempfile.mkdtemp(prefix="replica-tests-")
+os.environ["HOME"] = os.environ["APPDATA"] = TEST_HOME
+
+from replica_engine import collect_links, iter_link_file  # noqa: E402
+
+
+class CsvLinksTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="replica-links-", dir=TEST_HOME)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def collect(self, text):
+        path = os.path.join(self.workdir, "links.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        result = collect_links(iter_link_file(path))
+        return result.urls, result.invalid
+
+    def test_header_names_the_link_column(self):
+        urls, invalid = self.collect(
+            "Title,Date,URL,Channel\n"
+            '"Hello, world",2024-01-01,https://example.com/v/1,Someone\n'
+            "No link yet,2024-01-02,,Someone\n"
+            "Not a link,2024-01-03,example,Someone\n"
+        )
+        self.assertEqual(urls, ["https://example.com/v/1"])
+        # שורה אחת בלי קישור ושורה אחת עם קישור פגום; הכותרת והעמודות האחרות לא נספרות
+        self.assertEqual(invalid, 2)
+
+    def test_links_anywhere_in_the_row(self):
+        urls, invalid = self.collect(
+            "Video,Title\n"
+            "https://youtu.be/dQw4w9WgXcQ,First\n"
+            "Second,https://example.com/a,https://example.com/b\n"
+            "\n"
+            "just a note,nothing here\n"
+        )
+        self.assertEqual(urls, ["https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+                                "https://example.com/a", "https://example.com/b"])
+        self.assertEqual(invalid, 1)
+
+    def test_no_header(self):
+        urls, invalid = self.collect("https://example.com/a,title\nhttps://example.com/b,other\n")
+        self.assertEqual((urls, invalid), (["https://example.com/a", "https://example.com/b"], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
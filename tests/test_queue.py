@@ -0,0 +1,230 @@
+"""Tests of the leased shared queue: DownloadQueue.claim/heartbeat/release and RemoteQueue.
+
+    python -m pytest -q tests
+    python -m unittest discover tests
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# תיקיית הגדרות ריקה, לפני ש-replica_engine קובע את APP_DATA_DIR, כמו ב-bench
+TEST_HOME = tempfile.mkdtemp(prefix="replica-tests-")
+os.environ["HOME"] = os.environ["APPDATA"] = TEST_HOME
+
+from replica_engine import DownloadQueue, PENDING, RUNNING, DONE, CANCELLED  # noqa: E402
+from replica_api import ApiServer, EventBroker, RemoteQueue  # noqa: E402
+
+TOKEN = "test-token"
+FORMAT = ["yt-dlp", "-f", "best"]
+SHORT_LEASE = 0.2
+PROCESS_TIMEOUT = 60
+
+# worker בתהליך נפרד: חוכר פריט אחד בכל פעם עד שהתור ריק, ומדפיס את המזהים שסיים
+CLAIM_SCRIPT = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+from replica_engine import DownloadQueue
+queue = DownloadQueue(sys.argv[2], sys.argv[3])
+done = []
+while True:
+    items = queue.claim(sys.argv[3], 1)
+    if not items:
+        break
+    for item in items:
+        queue.mark_running(item.id, None)
+        queue.mark_done(item.id)
+        done.append(item.id)
+queue.close()
+print(json.dumps(done))
+"""
+
+
+class QueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="replica-queue-", dir=TEST_HOME)
+        self.path = os.path.join(self.workdir, "shared-queue.db")
+        self.queue = DownloadQueue(self.path)
+        self.addCleanup(shutil.rmtree, self.workdir, ignore_errors=True)
+        self.addCleanup(self.queue.close)
+
+    def state(self, item_id):
+        return self.queue.get(item_id)["state"]
+
+
+class LeaseTest(QueueTestCase):
+    def test_workers_claim_disjoint_items(self):
+        first = DownloadQueue(self.path, "w1")
+        second = DownloadQueue(self.path, "w2")
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        ids = [item.id for item in self.queue.add([f"https://example.com/{n}" for n in range(10)], FORMAT)]
+        claimed = [item.id for item in first.claim("w1", 4)]
+        claimed_second = [item.id for item in second.claim("w2", 4)]
+        self.assertEqual(claimed, ids[:4])
+        self.assertEqual(claimed_second, ids[4:8])
+        self.assertEqual([item.id for item in first.claim("w1", 10)], ids[8:])
+        self.assertEqual(second.claim("w2", 10), [])
+        self.assertEqual({entry["worker"] for entry in self.queue.list_items()}, {"w1", "w2"})
+
+    def test_processes_claim_disjoint_items(self):
+        ids = [item.id for item in self.queue.add([f"https://example.com/{n}" for n in range(60)], FORMAT)]
+        processes = [subprocess.Popen([sys.executable, "-c", CLAIM_SCRIPT, REPO_DIR, self.path, f"w{n}"],
+                                      stdout=subprocess.PIPE, text=True) for n in range(3)]
+        done = []
+        for process in processes:
+            out, _ = process.communicate(timeout=PROCESS_TIMEOUT)
+            self.assertEqual(process.returncode, 0)
+            done.append(json.loads(out))
+        claimed = [item_id for worker_done in done for item_id in worker_done]
+        # BEGIN IMMEDIATE: אף פריט לא נלקח פעמיים ואף פריט לא נשכח
+        self.assertEqual(sorted(claimed), ids)
+        self.assertEqual(self.queue.counts(), {DONE: len(ids)})
+
+    def test_expired_lease_is_reclaimed_under_a_new_name(self):
+        (item,) = self.queue.add(["https://example.com/a"], FORMAT)
+        self.queue.claim("w1", 1, lease=SHORT_LEASE)
+        self.queue.mark_running(item.id, "a-w1.%(ext)s", "w1")
+        self.assertEqual(self.queue.claim("w2", 1), [])
+        time.sleep(SHORT_LEASE * 2)
+        (taken,) = self.queue.claim("w2", 1)
+        # ה-yt-dlp של w1 עלול עדיין לכתוב ל-a-w1, ולכן w2 מוריד לשם חדש
+        self.assertEqual((taken.id, taken.output_template, taken.attempts), (item.id, None, 1))
+        entry = self.queue.get(item.id)
+        self.assertEqual((entry["worker"], entry["state"]), ("w2", PENDING))
+
+    def test_own_expired_lease_keeps_the_partial_file(self):
+        (item,) = self.queue.add(["https://example.com/a"], FORMAT)
+        self.queue.claim("w1", 1, lease=SHORT_LEASE)
+        self.queue.mark_running(item.id, "a-w1.%(ext)s", "w1")
+        time.sleep(SHORT_LEASE * 2)
+        (taken,) = self.queue.claim("w1", 1)
+        self.assertEqual(taken.output_template, "a-w1.%(ext)s")
+
+    def test_heartbeat_renews_and_reports_lost_items(self):
+        items = self.queue.add([f"https://example.com/{n}" for n in range(3)], FORMAT)
+        ids = [item.id for item in items]
+        self.queue.claim("w1", 3, lease=SHORT_LEASE)
+        time.sleep(SHORT_LEASE / 2)
+        self.assertEqual(self.queue.heartbeat("w1", ids, lease=SHORT_LEASE * 4), (ids, []))
+        time.sleep(SHORT_LEASE)
+        # החכירה חודשה, ולכן worker אחר לא יכול לקחת את הפריטים
+        self.assertEqual(self.queue.claim("w2", 3), [])
+
+        # w1 הפסיק לחדש: פריט אחד עבר ל-w2 ופריט אחד בוטל
+        time.sleep(SHORT_LEASE * 4)
+        self.assertEqual([item.id for item in self.queue.claim("w2", 1)], ids[:1])
+        self.queue.mark_cancelled(ids[1])
+        active, lost = self.queue.heartbeat("w1", ids)
+        self.assertEqual((active, sorted(lost)), (ids[2:], ids[:2]))
+        self.assertEqual(self.queue.heartbeat("w1", []), ([], []))
+
+    def test_mark_refused_for_items_of_another_worker(self):
+        first = DownloadQueue(self.path, "w1")
+        self.addCleanup(first.close)
+        item_a, item_b = self.queue.add(["https://example.com/a", "https://example.com/b"], FORMAT)
+        self.queue.claim("w2", 1)
+        first.mark_running(item_a.id, "a.%(ext)s")
+        first.mark_done(item_a.id)
+        first.mark_failed(item_a.id, "error")
+        first.mark_pending(item_a.id, "error")
+        first.mark_cancelled(item_a.id)
+        entry = self.queue.get(item_a.id)
+        self.assertEqual((entry["state"], entry["worker"], entry["output_template"], entry["attempts"]),
+                         (PENDING, "w2", None, 0))
+        # עם worker מפורש, וגם על פריט שלא נחכר בכלל
+        self.queue.mark_done(item_a.id, "w1")
+        self.assertEqual(self.state(item_a.id), PENDING)
+        self.queue.mark_done(item_a.id, "w2")
+        self.assertEqual(self.state(item_a.id), DONE)
+        first.mark_done(item_b.id)
+        self.assertEqual(self.state(item_b.id), DONE)
+
+    def test_release_returns_items_at_once(self):
+        items = self.queue.add(["https://example.com/a", "https://example.com/b"], FORMAT)
+        self.queue.claim("w1", 2)
+        self.queue.mark_running(items[0].id, "a.%(ext)s", "w1")
+        self.queue.mark_done(items[1].id, "w1")
+        self.queue.release("w1")
+        (taken,) = self.queue.claim("w2", 2)
+        # פריט שהוחזר כראוי ממשיך מאותו קובץ .part
+        self.assertEqual((taken.id, taken.output_template), (items[0].id, "a.%(ext)s"))
+        self.assertEqual(self.state(items[1].id), DONE)
+
+    def test_expand_leases_children_to_the_worker(self):
+        (item,) = self.queue.add(["https://example.com/list"], FORMAT)
+        self.queue.claim("w1", 1)
+        children = self.queue.expand(item, ["https://example.com/1", "https://example.com/2"], "w1")
+        self.assertEqual(self.state(item.id), DONE)
+        self.assertEqual({self.queue.get(child.id)["worker"] for child in children}, {"w1"})
+        self.assertEqual(self.queue.claim("w2", 5), [])
+
+
+class RemoteQueueTest(QueueTestCase):
+    # אותו פרוטוקול דרך coordinator אמיתי על פורט פנוי
+    def setUp(self):
+        super().setUp()
+        self.server = ApiServer(None, EventBroker(), "127.0.0.1", 0, TOKEN, queue=self.queue)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def remote(self, worker, token=TOKEN):
+        remote = RemoteQueue(self.url, worker, token)
+        self.addCleanup(remote.close)
+        return remote
+
+    def test_claim_heartbeat_and_state(self):
+        first, second = self.remote("w1"), self.remote("w2")
+        ids = [item.id for item in self.queue.add(["https://example.com/a", "https://example.com/b"], FORMAT)]
+        (item,) = first.claim("w1", 1, lease=SHORT_LEASE)
+        self.assertEqual((item.id, item.format_option), (ids[0], FORMAT))
+        self.assertEqual([other.id for other in second.claim("w2", 5)], ids[1:])
+        first.mark_running(item.id, "a.%(ext)s")
+        self.assertEqual(self.state(item.id), RUNNING)
+        # w2 לא יכול לשנות פריט של w1
+        second.mark_done(item.id)
+        self.assertEqual(self.state(item.id), RUNNING)
+
+        time.sleep(SHORT_LEASE * 2)
+        (taken,) = second.claim("w2", 5)
+        self.assertEqual((taken.id, taken.output_template), (item.id, None))
+        self.assertEqual(first.heartbeat("w1", [item.id]), ([], [item.id]))
+        self.assertEqual(second.heartbeat("w2", ids), (ids, []))
+        second.release("w2")
+        self.assertEqual(self.queue.counts(), {PENDING: 2})
+
+    def test_state_updates_wait_in_the_outbox(self):
+        (item,) = self.queue.add(["https://example.com/a"], FORMAT)
+        self.queue.claim("w1", 1)
+        # ה-coordinator דוחה את הבקשה (כמו coordinator שנפל); העדכון נשמר ונשלח עם ה-heartbeat
+        remote = self.remote("w1", token="wrong")
+        remote.mark_done(item.id)
+        self.assertEqual(self.state(item.id), PENDING)
+        with self.assertRaises(OSError):
+            remote.heartbeat("w1", [item.id])
+        remote.token = TOKEN
+        self.assertEqual(remote.heartbeat("w1", [item.id]), ([], []))
+        self.assertEqual(self.state(item.id), DONE)
+
+    def test_cancel_on_the_coordinator_reaches_the_worker(self):
+        remote = self.remote("w1")
+        (item,) = self.queue.add(["https://example.com/a"], FORMAT)
+        remote.claim("w1", 1)
+        remote.mark_running(item.id, "a.%(ext)s")
+        self.assertEqual(remote._request("DELETE", f"/jobs/{item.id}"), {"cancelled": True})
+        self.assertEqual(self.state(item.id), CANCELLED)
+        self.assertEqual(remote.heartbeat("w1", [item.id]), ([], [item.id]))
+
+
+if __name__ == "__main__":
+    unittest.main()